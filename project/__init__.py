@@ -2,13 +2,19 @@
 Used to mark the /project directory as a python Package directory,
 such that the child files can refer to one another using relative
 parent imports.
-The create_app function initalises the SQL database. 
+The create_app function initalises the SQL database and the blob store which holds file bytes.
 """
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from .modules.functions import bitshift_hash
+from .modules.blobstore import BlobStore
+from .modules.staging import UploadStaging
+from .modules.derivatives import DerivativeCache
+from .modules.pipeline import ImagePipeline
+from .modules.events import EventBus
+from .modules.schema import upgrade_schema
 
 from os import getenv
 from dotenv import load_dotenv
@@ -20,9 +26,17 @@ RDS = 0xfb
 MODE = LOCAL
 
 db = SQLAlchemy()
+blobstore = BlobStore()
+staging = UploadStaging()
+derivatives = DerivativeCache()
+pipeline = ImagePipeline()
+events = EventBus()
 
 
-def create_app():
+def create_app(test_config: dict | None = None):
+    """
+    Creates the app. Any config given (e.g. by the tests) is applied after the defaults and before the extensions are set up.
+    """
     app = Flask(__name__)
 
     if MODE == RDS:
@@ -39,7 +53,15 @@ def create_app():
 
     app.config['SECRET_KEY'] = bitshift_hash(getenv("secret"))
 
+    if test_config:
+        app.config.update(test_config)
+
     db.init_app(app)
+    blobstore.init_app(app)
+    staging.init_app(app)
+    derivatives.init_app(app)
+    pipeline.init_app(app)
+    events.init_app(app)
 
     login_manager = LoginManager()
     login_manager.login_view = 'auth.login'
@@ -47,6 +69,9 @@ def create_app():
 
     from .models import User
 
+    with app.app_context():
+        upgrade_schema(db)
+
     @login_manager.user_loader
     def load_user(user_id):
         return User.query.get(int(user_id))
@@ -56,10 +81,14 @@ def create_app():
     from .main import main as main_blueprint
     from .files import files as files_blueprint
     from .images import images as images_blueprint
+    from .uploads import uploads as uploads_blueprint
+    from .commands import commands as commands_blueprint
 
     app.register_blueprint(auth_blueprint)
     app.register_blueprint(main_blueprint)
     app.register_blueprint(files_blueprint)
     app.register_blueprint(images_blueprint)
+    app.register_blueprint(uploads_blueprint)
+    app.register_blueprint(commands_blueprint)
 
     return app
\ No newline at end of file
@@ -0,0 +1,311 @@
+"""
+Maintenance commands which are run from the terminal with the flask CLI.
+    - flask migrate-blobs: Moves file bytes stored in the database into the blob store.
+    - flask sweep-blobs: Removes blobs which are no longer referenced by any file and were not removed when released.
+    - flask purge-uploads: Removes upload sessions which were never finalised.
+    - flask backfill-metadata: Extracts the metadata columns of files stored before they existed.
+    - flask sweep-derivatives: Removes previews which were rendered by an older version of the image pipeline.
+    - flask promote-properties: Moves properties which have their own columns out of the properties JSON.
+    - flask rename-duplicates: Renames files which have the same name as another of the user's files.
+    - flask reconcile-usage: Checks the storage usage counters against the files, and corrects them with --fix.
+    - flask compress-blobs: Compresses the blobs of compressible files which were stored uncompressed.
+    - flask blob-stats: Shows the logical and physical size of the blob store, by codec.
+    - flask worker: Runs the queued background jobs, e.g. rendering previews and compressing blobs.
+    - flask purge-jobs: Removes jobs which finished some time ago.
+"""
+
+from flask import Blueprint
+import click
+from sqlalchemy import or_, func
+
+from .models import File, UploadSession, StorageUsage, Job, DATE_FORMAT, PROPERTY_COLUMNS, IMAGES
+from . import db, blobstore, staging, derivatives
+from .modules.functions import log
+from .modules import jobs
+
+import os
+import multiprocessing
+from datetime import datetime, timedelta
+
+commands = Blueprint('commands', __name__, cli_group=None)
+
+@commands.cli.command("migrate-blobs")
+def migrate_blobs():
+    """
+    Moves the bytes of files stored before the blob store existed out of the database.
+    """
+    files = File.query.filter(File.hash == None).options(db.undefer(File._value)).all()
+
+    for file in files:
+        file.value = file._value or b""
+
+    db.session.commit()
+
+    log(f"Migrated {len(files)} file(s) to the blob store.")
+
+@commands.cli.command("sweep-blobs")
+def sweep_blobs():
+    """
+    Deletes blobs that no file refers to anymore, e.g. uploads which were never saved as a file,
+    or blobs released while they were still within their grace period (see BlobStore.release).
+    """
+    referenced = {digest for (digest,) in db.session.query(File.hash).distinct()}
+
+    removed = 0
+    for digest in list(blobstore.digests()):
+        if digest not in referenced and blobstore.release(digest):
+            removed += 1
+
+    log(f"Removed {removed} unreferenced blob(s).")
+
+@commands.cli.command("purge-uploads")
+@click.option("--hours", default=24, help="Age in hours after which an unfinished upload session is removed.")
+def purge_uploads(hours: int):
+    """
+    Deletes upload sessions, and their staged chunks, which were created more than the given number of hours ago.
+    """
+    cutoff = datetime.now() - timedelta(hours=hours)
+
+    sessions = [session for session in UploadSession.query.all() if datetime.strptime(session.date_created, DATE_FORMAT) < cutoff]
+    for session in sessions:
+        staging.discard(session.id)
+        db.session.delete(session)
+
+    db.session.commit()
+
+    log(f"Removed {len(sessions)} unfinished upload session(s).")
+
+@commands.cli.command("backfill-metadata")
+@click.option("--batch", default=100, help="Number of files to extract and commit at a time.")
+def backfill_metadata(batch: int):
+    """
+    Extracts the type, dimensions, orientation, frame count and date taken of every file which does not have them yet.
+    Files are committed in batches so that only a batch of files is held in memory at once.
+    """
+    count = 0
+    while True:
+        files = File.query.filter(or_(
+            File.mimetype == None, File.type_class == None, (File.type_class == IMAGES) & (File.orientation == None)
+        )).limit(batch).all()
+        if not files:
+            break
+
+        for file in files:
+            file.extract_metadata()
+        db.session.commit()
+        db.session.expunge_all()
+
+        count += len(files)
+
+    log(f"Extracted the metadata of {count} file(s).")
+
+@commands.cli.command("sweep-derivatives")
+def sweep_derivatives():
+    """
+    Deletes the cached previews which were rendered before imaging.PREVIEW_VERSION was last increased.
+    They are never read again, as previews of the current version are rendered in their place when requested.
+    """
+    removed = derivatives.sweep()
+
+    log(f"Removed {removed} outdated preview(s).")
+
+@commands.cli.command("promote-properties")
+@click.option("--batch", default=100, help="Number of files to update and commit at a time.")
+def promote_properties(batch: int):
+    """
+    Moves the archived and date uploaded properties of files stored before they had their own columns
+    out of the properties JSON and into the columns, so that the listings can filter on them.
+    """
+    mentions_column = or_(*[File.properties.like(f'%"{key}"%') for key in PROPERTY_COLUMNS])
+
+    count = 0
+    last_id = 0
+    while True:
+        files = File.query.filter(File.id > last_id, mentions_column).order_by(File.id).limit(batch).all()
+        if not files:
+            break
+
+        last_id = files[-1].id
+        for file in files:
+            file.promote_properties()
+        db.session.commit()
+        db.session.expunge_all()
+
+        count += len(files)
+
+    log(f"Moved the properties of {count} file(s) into their columns.")
+
+@commands.cli.command("rename-duplicates")
+def rename_duplicates():
+    """
+    Renames files with the same name as another file of the same user, which stop the unique index
+    on (user, name) from being added. The oldest file keeps its name and the others are numbered, e.g. 'photo (2).png'.
+    Restart the app afterwards to add the index.
+    """
+    duplicates = (
+        db.session.query(File.user, File.name)
+        .group_by(File.user, File.name)
+        .having(func.count() > 1)
+        .all()
+    )
+
+    count = 0
+    for user, name in duplicates:
+        files = File.query.filter(File.user == user, File.name == name).order_by(File.id).all()
+        taken = {taken_name for (taken_name,) in db.session.query(File.name).filter(File.user == user)}
+
+        stem, dot, extension = name.rpartition(".")
+        if not dot:
+            stem, extension = name, ""
+
+        number = 2
+        for file in files[1:]:
+            while True:
+                new_name = f"{stem} ({number}){dot}{extension}"
+                number += 1
+                if new_name not in taken:
+                    break
+
+            taken.add(new_name)
+            file.name = new_name
+            count += 1
+
+    db.session.commit()
+
+    log(f"Renamed {count} file(s) with duplicate names.")
+
+@commands.cli.command("reconcile-usage")
+@click.option("--fix", is_flag=True, help="Replace the counters which are wrong with the real totals.")
+def reconcile_usage(fix: bool):
+    """
+    Adds up the files of every user and compares the totals with the storage usage counters,
+    logging each counter which does not match. Run with --fix once after upgrading, to fill in the counters of existing files.
+    """
+    actual = {}
+    totals = (
+        db.session.query(File.user, File.type_class, File.archived, func.count(), func.coalesce(func.sum(File.size), 0))
+        .group_by(File.user, File.type_class, File.archived)
+    )
+    for user, type_class, archived, file_count, size in totals:
+        # Files without a type class yet share the counters of the empty type class, as in StorageUsage.key
+        total = actual.setdefault(StorageUsage.key(user, type_class, archived), [0, 0])
+        total[0] += file_count
+        total[1] += size
+
+    counters = {(c.user, c.type_class, c.archived): c for c in StorageUsage.query.all()}
+
+    mismatches = 0
+    for key in set(actual) | set(counters):
+        file_count, size = actual.get(key, [0, 0])
+        counter = counters.get(key)
+        if counter and (counter.file_count, counter.bytes) == (file_count, size):
+            continue
+        if not counter and file_count == 0:
+            continue
+
+        mismatches += 1
+        counted = (counter.file_count, counter.bytes) if counter else (0, 0)
+        log(f"Usage of {key} is {counted[0]} file(s), {counted[1]} bytes, but should be {file_count} file(s), {size} bytes.")
+
+        if fix:
+            if counter:
+                counter.file_count = file_count
+                counter.bytes = size
+            else:
+                db.session.add(StorageUsage(
+                    user=key[0], type_class=key[1], archived=key[2], file_count=file_count, bytes=size
+                ))
+
+    db.session.commit()
+
+    if fix:
+        log(f"Corrected {mismatches} usage counter(s).")
+    else:
+        log(f"Found {mismatches} usage counter(s) which do not match the files.")
+
+@commands.cli.command("compress-blobs")
+@click.option("--batch", default=500, help="Number of files to look through at a time.")
+def compress_blobs(batch: int):
+    """
+    Compresses the blobs of compressible files which were stored uncompressed,
+    e.g. before blobs were compressed or while BLOB_CODEC was turned off.
+    """
+    count = 0
+    checked = set()
+    last_id = 0
+    while True:
+        files = File.query.filter(File.id > last_id, File.hash != None).order_by(File.id).limit(batch).all()
+        if not files:
+            break
+
+        last_id = files[-1].id
+        for file in files:
+            if file.hash not in checked and file.compressible:
+                checked.add(file.hash)
+                count += jobs.compress_blob(file.hash)
+        db.session.expunge_all()
+
+    log(f"Compressed {count} blob(s).")
+
+@commands.cli.command("blob-stats")
+def blob_stats():
+    """
+    Logs the number of blobs with each codec, with their logical size (the size of the files' bytes)
+    and their physical size (the space they take up on disk), to show how much compression saves.
+    """
+    sizes = dict(db.session.query(File.hash, File.size).filter(File.hash != None).distinct())
+
+    totals = {}
+    for digest in blobstore.digests():
+        if digest not in sizes:
+            # Not referenced by any file, see sweep-blobs
+            continue
+
+        _, codec = blobstore.locate(digest)
+        total = totals.setdefault(codec or "none", [0, 0, 0])
+        total[0] += 1
+        total[1] += sizes[digest] or 0
+        total[2] += blobstore.physical_size(digest)
+
+    for codec, (count, logical, physical) in sorted(totals.items()):
+        saving = 1 - physical / logical if logical else 0
+        log(f"{codec}: {count} blob(s), {logical} bytes stored in {physical} bytes ({saving:.0%} saved).")
+
+@commands.cli.command("worker")
+@click.option("--processes", default=os.cpu_count() or 1, help="Number of worker processes, which each run one job at a time.")
+@click.option("--burst", is_flag=True, help="Stop once the queue is empty, rather than waiting for more jobs.")
+def worker(processes: int, burst: bool):
+    """
+    Runs the queued background jobs (see modules/jobs.py), e.g. rendering previews and compressing blobs.
+    Run alongside the app, with as many processes as there are cores to spare.
+    """
+    if processes <= 1:
+        jobs.work(burst)
+        return
+
+    # Worker processes are spawned rather than forked, so that each one opens its own database connections.
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=jobs.work_process, args=(burst,)) for _ in range(processes)]
+    for process in workers:
+        process.start()
+
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        for process in workers:
+            process.terminate()
+
+@commands.cli.command("purge-jobs")
+@click.option("--hours", default=24, help="Age in hours after which a finished job is removed.")
+def purge_jobs(hours: int):
+    """
+    Deletes jobs which finished, or failed for good, more than the given number of hours ago.
+    """
+    cutoff = (datetime.now() - timedelta(hours=hours)).strftime(DATE_FORMAT)
+
+    # DATE_FORMAT sorts in date order, so finished dates are compared as strings.
+    count = Job.query.filter(Job.status.in_([Job.DONE, Job.FAILED]), Job.date_finished < cutoff).delete()
+    db.session.commit()
+
+    log(f"Removed {count} finished job(s).")
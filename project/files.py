@@ -1,35 +1,55 @@
 """
 Routes handling file management
-    - Uploading
+    - Uploading, one file per request or many files in one multipart request
+    - Checking for files whose content is already stored, so their bytes do not need to be uploaded again
+    - Listing files one page at a time
     - Get the file data as a base64 representation
+    - Serve the raw bytes of a file, with partial and conditional requests
     - Create a duplicate of an existing file
     - Renaming
     - Archiving
     - Restoration of archived files
     - Permanent deletion
+      (these three change every given file with one statement, see modules/fileops.py)
+    - Downloading files as a streamed zip
+    - Polling the status of background jobs, e.g. rendering the previews of uploaded images
+    - Streaming progress events of uploads, zips, bulk changes and background jobs (Server-Sent Events)
     = Retrieving total file storage that is taken up, in bytes.
     = Retrieving all valid file extensions
 """
 
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, Response, url_for, stream_with_context, send_file
 from flask_login import login_required, current_user
+from sqlalchemy import select, func, or_
 
-from .modules.fileloader import FileLoader, timer
+from .modules.fileloader import FileLoader, PAGE_SIZE
+from .modules.imaging import THUMBNAIL, GALLERY
+from .modules import fileops
 from .modules.functions import bitshift_hash, random_name, log
+from .modules.streaming import is_streaming, stream_uploads
+from .modules.zipstream import stream_zip
+from .modules.events import operation_id
 
-from .models import File, DATE_FORMAT
-from . import db
+from .models import File, StorageUsage, Job, Download, DATE_FORMAT, IMAGES, FILES
+from . import db, blobstore, events
 
 import json
 import base64
-from datetime import datetime
+import hashlib
+import secrets
+from time import monotonic
+from io import BytesIO
+from datetime import datetime, timedelta
 
-import os
 from os.path import join, dirname
-import zipfile
 
 files = Blueprint('files', __name__)
 
+EVENT_RETRY = 3000 # Milliseconds before a browser reconnects to a dropped event stream
+EVENT_POLL_INTERVAL = 5 # Seconds between polls for finished background jobs
+EVENT_KEEPALIVE = 15 # Seconds of silence before a keepalive comment is sent
+DOWNLOAD_EXPIRY = timedelta(days=1) # How long the URL of a download keeps working
+
 @files.route('/uploadFile', methods=['POST'])
 @login_required
 def upload_file():
@@ -37,39 +57,71 @@ def upload_file():
     '/uploadFile' route, uploads a given file to the database, with its date uploaded as a file property.
 
     Takes in 'name'<string>, 'value'(base64)<string>, 'overwrite'<bool> and 'allowImages'<bool'.
+    The file can also be streamed as a raw application/octet-stream body (options given as query parameters),
+    or as a multipart/form-data body (options given as form fields), instead of as base64 within JSON.
+    The progress of a streamed upload is sent as 'upload' events (see '/events').
 
+    Response code 204: No file was given in a streamed upload.
     Response code 201: File with the same name exists
     Response code 300: Parameter allowImages is false but the file's type is an image.
     Response code 200: Returns the file thumbnail as a base64 string of its 32x32 image thumbnail.
     """
-    data = json.loads(request.data)
-    name = data["name"]
-    value = data["value"]
-    user = current_user.username
+    progress = None
+    if is_streaming(request):
+        progress = events.progress(current_user.username, "upload", operation_id(request), total_bytes=request.content_length)
+        data, uploads = stream_uploads(request, progress)
+        if not uploads:
+            progress.finish(files=0)
+            return jsonify({"response": 204})
+        name, digest, size = uploads[0]
+        blob = {"hash": digest, "size": size}
+    else:
+        data = json.loads(request.data)
+        name = data["name"]
+        blob = {"value": base64.b64decode(data["value"].split("base64")[-1])}
 
     overwrite = bool("overwrite" in data)
 
     allow_images = bool("allowImages" in data)
 
+    result = save_upload(name, blob, overwrite, allow_images)
+    if progress:
+        progress.finish(files=int(result["response"] == 200))
+
+    return jsonify(result)
+
+def save_upload(name: str, blob: dict, overwrite: bool, allow_images: bool) -> dict:
+    """
+    Saves an uploaded file as a File of the current user, with its date uploaded as a file property.
+    Shared by '/uploadFile' and the finalisation of resumable upload sessions.
+
+    Takes in the file name, blob<dict> which is either {'value': bytes} or {'hash': str, 'size': int} of a stored blob,
+    whether to overwrite a file with the same name, and whether image files are allowed.
+
+    Returns the response data as a dict, with the same response codes as '/uploadFile'.
+    """
+    user = current_user.username
+
     fileloader = FileLoader()
     same_file = fileloader.search(name=name, user=current_user)
     # same_file = File.query.filter_by(name=name, user=user).first()
-    if same_file:
-        if not overwrite:
-            # Send back overwrite requests
-            return jsonify({"response": 201})
-        else:
-            # Replace original file
-            db.session.delete(same_file)
+    if same_file and not overwrite:
+        # Send back overwrite requests
+        return {"response": 201}
 
-    file_bytes = base64.b64decode(value.split("base64")[-1])
+    new_file = File(name=name, user=user, **blob)
+    # Set directly, as set_property commits, and the upload is saved in one transaction.
+    new_file.date_uploaded = datetime.now().strftime(DATE_FORMAT)
 
-    new_file = File(name=name, value=file_bytes, user=user)
-    new_file.set_property("date_uploaded", datetime.now().strftime(DATE_FORMAT))
-    
-    # If file is an image file, reject it.
+    # If file is an image file, reject it. Checked before the original is deleted, so a rejected upload leaves it as it was.
     if new_file.extension in [".JPEG", ".JPG", ".PNG", ".GIF"] and not allow_images:
-        return jsonify({"response": 300})
+        return {"response": 300}
+
+    if same_file:
+        # Replace original file
+        db.session.delete(same_file)
+        # Deletes are flushed after inserts, so the original is removed now to keep file names unique.
+        db.session.flush()
 
     # db.session.add(new_file)
     current_user.files.append(new_file)
@@ -78,8 +130,185 @@ def upload_file():
     images = FileLoader()
     file_data = images.load_thumbnail(new_file)
 
-    return jsonify({"response": 200, "file": file_data})
+    return {"response": 200, "file": file_data}
+
+@files.route('/uploadFiles', methods=['POST'])
+@login_required
+def upload_files():
+    """
+    '/uploadFiles' route, uploads many files in one multipart/form-data request, each with its date uploaded as a file property.
+    Every file is written to the blob store as it streams in, the names are checked for conflicts with one query,
+    and every new file is saved in one transaction.
+
+    Takes in any number of files, and the form fields 'overwrite'<bool> and 'allowImages'<bool>.
+    If a name is given more than once, the last file with it is kept.
+    The progress of the upload is sent as 'upload' events (see '/events').
+
+    Response code 204: No files were given, or the request is not multipart/form-data.
+    Response code 200: Returns 'files', a list with the result of each file in the order they were sent:
+        {'name', 'response'} with the same response codes as '/uploadFile' (201, 300, or 200 along with 'file').
+    """
+    if request.mimetype != "multipart/form-data":
+        return jsonify({"response": 204})
+
+    progress = events.progress(current_user.username, "upload", operation_id(request), total_bytes=request.content_length)
+    data, streamed = stream_uploads(request, progress)
+    if not streamed:
+        progress.finish(files=0)
+        return jsonify({"response": 204})
+
+    uploads = {name: {"hash": digest, "size": size} for name, digest, size in streamed}
+    results = save_uploads(uploads, bool("overwrite" in data), bool("allowImages" in data))
+
+    saved = sum(result["response"] == 200 for result in results)
+    progress.finish(files=saved)
+    log(f"Uploaded {saved} of {len(uploads)} file(s) in one request.")
+
+    return jsonify({"response": 200, "files": results})
+
+def save_uploads(uploads: dict[str, dict], overwrite: bool, allow_images: bool, preset: str = THUMBNAIL) -> list[dict]:
+    """
+    Saves many stored blobs as Files of the current user in one transaction, with their date uploaded as a file property.
+    Shared by '/uploadFiles' and '/checkUploads'. The names are checked for conflicts with one query.
+
+    Takes in a dict of {'hash': str, 'size': int} blobs keyed by their file names, whether to overwrite files with the same names,
+    whether image files are allowed, and the preset of the image previews.
+
+    Returns the result of each file as {'name', 'response'} with the same response codes as '/uploadFile',
+    in the same order as the given files.
+    """
+    user = current_user.username
+    date_uploaded = datetime.now().strftime(DATE_FORMAT)
+
+    fileloader = FileLoader()
+    same_files = fileloader.search_many(list(uploads), current_user)
+
+    results = {}
+    new_files = []
+    for name, blob in uploads.items():
+        if name in same_files and not overwrite:
+            results[name] = {"name": name, "response": 201}
+            continue
+
+        new_file = File(name=name, user=user, **blob)
+        if new_file.extension in [".JPEG", ".JPG", ".PNG", ".GIF"] and not allow_images:
+            results[name] = {"name": name, "response": 300}
+            continue
+
+        if name in same_files:
+            # Replace original file
+            db.session.delete(same_files[name])
+
+        # Set directly rather than with set_property, which commits, so that the whole batch is one transaction.
+        new_file.date_uploaded = date_uploaded
+        new_files.append(new_file)
+
+    # Deletes are flushed after inserts, so the originals are removed first to keep file names unique.
+    db.session.flush()
+    db.session.add_all(new_files)
+    db.session.commit()
+
+    for new_file in new_files:
+        file_data = fileloader.load_thumbnail(new_file, new_file.preview_url(preset) if new_file.is_image else None)
+        results[new_file.name] = {"name": new_file.name, "response": 200, "file": file_data}
+
+    return [results[name] for name in uploads]
+
+@files.route('/checkUploads', methods=['POST'])
+@login_required
+def check_uploads():
+    """
+    '/checkUploads' route, the handshake before an upload which skips sending the bytes of files that are already stored.
+    Each file is given by its name, size and SHA-256 hash. If one of the current user's files already has the same content,
+    a new file is saved which refers to the same blob, and no bytes need to be sent.
+    Only the current user's own files are matched, so the route cannot be used to find out what other users have stored.
+
+    Takes in 'files'<list> of {'name'<string>, 'size'<int>, 'hash'<string>}, 'overwrite'<bool>, 'allowImages'<bool>
+    and 'preset'<string> (thumbnail or gallery, the preview returned for images).
+
+    Response code 300: Invalid list of files or preset.
+    Response code 200: Returns 'files', a list with the result of each file in the order they were sent:
+        {'name', 'response'} with the response code 202 if the content is not stored so the file must be uploaded,
+        otherwise the same response codes as '/uploadFile' (201, 300, or 200 along with 'file').
+    """
+    data = json.loads(request.data)
+
+    preset = data.get("preset", THUMBNAIL)
+    if preset not in [THUMBNAIL, GALLERY]:
+        return jsonify({"response": 300})
+
+    try:
+        checks = {file["name"]: (str(file["hash"]).lower(), int(file["size"])) for file in data["files"]}
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"response": 300})
+
+    # Find which of the given hashes the user already has, one query per batch of hashes.
+    stored = {}
+    hashes = list({digest for digest, _ in checks.values()})
+    for batch in fileops.batches(hashes):
+        query = (
+            select(File.hash, File.size)
+            .where(File.user == current_user.username, File.hash.in_(batch))
+            .distinct()
+        )
+        for row in db.session.execute(query):
+            stored[row.hash] = row.size
+
+    uploads = {}
+    for name, (digest, size) in checks.items():
+        # Touching the blob keeps it from being released while the new file which refers to it is saved.
+        if stored.get(digest) == size and blobstore.touch(digest):
+            uploads[name] = {"hash": digest, "size": size}
+
+    results = {result["name"]: result for result in save_uploads(uploads, bool("overwrite" in data), bool("allowImages" in data), preset)}
+
+    log(f"Upload check: {len(uploads)} of {len(checks)} file(s) already stored.")
+
+    return jsonify({"response": 200, "files": [results.get(name, {"name": name, "response": 202}) for name in checks]})
+
+@files.route('/listFiles', methods=['GET'])
+@login_required
+def list_files():
+    """
+    '/listFiles' route, returns one page of the current user's files, sorted and filtered by the database.
+
+    Takes in query parameters (all optional):
+        'type': 'images' or 'files', otherwise all files are listed.
+        'archived': '1' to list the archived files (recently deleted).
+        'sort': name, size, date_uploaded, date_taken or type. Defaults to name.
+        'direction': 'ascending' or 'descending'. Defaults to ascending.
+        'cursor': the cursor returned with the previous page, to get the next page.
+        'limit': the number of files per page.
+        'preset': the preview of image files, 'thumbnail' or 'gallery'. Defaults to thumbnail.
+
+    Response code 300: The sort, cursor or preset are not valid.
+    Response code 200:
+        Returns the files of the page, in the same format as the file manager,
+        and the cursor of the next page, which is null on the last page.
+    """
+    _type = request.args.get("type")
+    if _type not in [IMAGES, FILES]:
+        _type = None
+
+    preset = request.args.get("preset", THUMBNAIL)
+    if preset not in [THUMBNAIL, GALLERY]:
+        return jsonify({"response": 300})
+
+    fileloader = FileLoader()
+    try:
+        page, cursor = fileloader.load_page(
+            _type,
+            archived=request.args.get("archived") == "1",
+            sort=request.args.get("sort", "name"),
+            descending=request.args.get("direction") == "descending",
+            cursor=request.args.get("cursor"),
+            limit=request.args.get("limit", PAGE_SIZE, type=int),
+            preset=preset
+        )
+    except ValueError:
+        return jsonify({"response": 300})
 
+    return jsonify({"response": 200, "files": page, "cursor": cursor})
 
 @files.route('/getFile', methods=['POST'])
 @login_required
@@ -131,11 +360,61 @@ def get_file():
 
     return jsonify({"response": 200, "file": file_data})
 
+@files.route('/file/<path:name>', methods=['GET'])
+@login_required
+def serve_file(name: str):
+    """
+    '/file/<name>' route, serves the raw bytes of one of the current user's files.
+
+    Supports partial requests (Range headers, with 206 responses) so that large files can be seeked into
+    and interrupted downloads can be resumed, and conditional requests using the file's hash as a strong ETag,
+    so browsers can cache the file and only download it again once it has changed (otherwise 304).
+    If the 'download' query parameter is given, the file is sent as an attachment.
+
+    Response code 404: File does not exist.
+    """
+    fileloader = FileLoader()
+    file = fileloader.search(name=name, user=current_user)
+    if not file:
+        return Response("File does not exist.", status=404)
+
+    compressed = False
+    if file.hash:
+        source, codec = blobstore.locate(file.hash)
+        if codec is not None:
+            # Compressed blobs are decompressed as they are sent, so send_file cannot tell their size from the path.
+            source = blobstore.open(file.hash)
+            compressed = True
+        etag = file.hash
+    else:
+        source = BytesIO(file.value)
+        etag = hashlib.sha256(file.value).hexdigest()
+
+    response = send_file(
+        source,
+        mimetype=file.mimetype or "application/octet-stream",
+        as_attachment="download" in request.args,
+        download_name=name,
+        conditional=not compressed,
+        etag=etag,
+        max_age=0
+    )
+    if compressed:
+        # Ranges are found by seeking the decompressed stream, which decompresses up to the start of the range.
+        response.content_length = file.size
+        response.make_conditional(request, accept_ranges=True, complete_length=file.size)
+    # The same name can be overwritten with new contents, so the browser must revalidate its copy.
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.accept_ranges = "bytes"
+
+    return response
+
 @files.route('/copyFile', methods=['POST'])
 @login_required
 def copy_file():
     """
-    '/copyFile' route, creates a duplicate of a given file.
+    '/copyFile' route, creates a duplicate of a given file, which shares the bytes of the original.
     If overwrite parameter is enabled, ignores the file query conditions.
 
     Takes in 'name'<string> of file to duplicate and 'overwrite'<bool>.
@@ -165,11 +444,16 @@ def copy_file():
             return jsonify({"response": 300, "name": new_name})
         else:
             db.session.delete(same_file)
+            db.session.flush()
 
-    table = file.__table__
-    non_pk_columns = [k for k in table.columns.keys() if k not in table.primary_key]
+    # The copy refers to the same blob as the original, so no bytes are read or written however large the file is.
+    # Changing the bytes of either file later writes a new blob, leaving the other file's bytes as they are.
+    columns = [attr.key for attr in db.inspect(File).column_attrs if attr.key not in ["id", "_value"]]
 
-    file_info = {c: getattr(file, c) for c in non_pk_columns}
+    file_info = {c: getattr(file, c) for c in columns}
+    if not file.hash:
+        # Files stored before the blob store have their bytes moved into it.
+        file_info["value"] = file.value
     new_file = File(**file_info)
 
     new_file.name = new_name
@@ -185,19 +469,17 @@ def archive_files():
     """
     '/archiveFiles' route, archives a list of given files.
 
-    Takes in a list of file names as strings.
+    Takes in a list of file names as strings. The progress is sent as 'archive' events (see '/events').
 
-    Response code 200: Successful archival.
+    Response code 200: Successful archival, returns the list of file names which were not found.
     """
     data = json.loads(request.data)
 
-    fileloader = FileLoader()
-    for filename in data["images"]:
-        file = fileloader.search(name=filename, user=current_user)
-        file.set_property("archived", 1)
-    db.session.commit()
+    missing = fileops.archive(data["images"], current_user, events.progress(
+        current_user.username, "archive", operation_id(request), total=len(data["images"])
+    ))
 
-    return jsonify({"response": 200})
+    return jsonify({"response": 200, "missing": missing})
 
 @files.route('/restoreFiles', methods=['POST'])
 @login_required
@@ -205,19 +487,17 @@ def restore_files():
     """
     '/restoreFiles' route, restores/unarchives a list of given files.
 
-    Takes in a list of file names as strings.
+    Takes in a list of file names as strings. The progress is sent as 'restore' events (see '/events').
 
-    Response code 200: Successful restoration.
+    Response code 200: Successful restoration, returns the list of file names which were not found.
     """
     files = json.loads(request.data)
 
-    fileloader = FileLoader()
-    for filename in files:
-        file = fileloader.search(name=filename, user=current_user)
-        file.remove_property("archived")
-    db.session.commit()
+    missing = fileops.restore(files, current_user, events.progress(
+        current_user.username, "restore", operation_id(request), total=len(files)
+    ))
 
-    return jsonify({"response": 200})
+    return jsonify({"response": 200, "missing": missing})
 
 @files.route('/deleteFiles', methods=['POST'])
 @login_required
@@ -225,94 +505,202 @@ def delete_files():
     """
     '/deleteFiles' route, permanently deletes a list of given files.
 
-    Takes in a list of file names as strings.
+    Takes in a list of file names as strings. The progress is sent as 'delete' events (see '/events').
 
-    Response code 200: Successful deletion.
+    Response code 200: Successful deletion, returns the list of file names which were not found.
     """
     files = json.loads(request.data)
 
-    fileloader = FileLoader()
-    for filename in files:
-        file = fileloader.search(name=filename, user=current_user)
-        db.session.delete(file)
-    db.session.commit()
+    missing = fileops.delete(files, current_user, events.progress(
+        current_user.username, "delete", operation_id(request), total=len(files)
+    ))
 
-    return jsonify({"response": 200})
+    return jsonify({"response": 200, "missing": missing})
 
 @files.route('/downloadFiles', methods=['POST'])
 @login_required
 def download_files():
     """
-    '/downloadFiles' route, creates a zipped folder with given files and returns the path of the folder to the user.
+    '/downloadFiles' route, checks that the given files exist and returns the path which streams them as a zip.
     Thus redirecting the user to the download page.
+    The selection is kept in the database under a short token, so the path stays short however many files are selected.
 
     Takes in either a list of file names to be downloaded
-    Or if 'path' is a key of the request data, then it will delete the zip file, suggesting that the downloading process is complete.
+    Or if 'path' is a key of the request data, the download is complete. Zips are streamed rather than
+    written to disk, so there is nothing left to delete, but the response is kept for older clients.
 
     First download request:
         Response code 304: One or more request files does not exist.
         Response code 200: Responds with the path of the zipped folder.
 
     Upon download completion:
-        Response code 401: Invalid zip
-        Response code 200: Zip file has been deleted.
+        Response code 200: Nothing to delete.
     """
     data = json.loads(request.data)
     
     if "path" in data:
-        zip_path = data["path"]
-
-        # In case of malicious POST requests, check the send path laboriously.
-        # Start and end of string must match, and the length of the string must be between 35 and 37.
-        if zip_path[:18] != "static/temp/files-" or zip_path[-4:] != ".zip" or len(zip_path) not in [35, 36, 37]:
-            return Response("Invalid zip path name.", status=401, mimetype='application/json')
-        
-        zip_whole_path = join(dirname(__file__), zip_path)
-        os.remove(zip_whole_path);
-        
-        log(f"Zip file deleted, name: {zip_path}")
         return Response("File deleted.", status=200, mimetype='application/json')
 
-    files = {}
     fileloader = FileLoader()
-    for name in data:
-        file = fileloader.search(name=name, user=current_user)
-        if file:
-            files[name] = file.value
-        else:
-            return jsonify({"response": 304})
+    if len(fileloader.search_many(data, current_user)) < len(set(data)):
+        return jsonify({"response": 304})
+
+    now = datetime.now()
+    # Downloads which have expired are removed as new ones are made.
+    Download.query.filter(Download.date_created < (now - DOWNLOAD_EXPIRY).strftime(DATE_FORMAT)).delete()
+
+    download = Download(
+        id=secrets.token_hex(16),
+        user=current_user.username,
+        names=json.dumps(list(dict.fromkeys(data))),
+        date_created=now.strftime(DATE_FORMAT)
+    )
+    db.session.add(download)
+    db.session.commit()
 
-    # Zip up the files into a temporary folder
-    zip_path = f"files-{bitshift_hash(random_name(5))}.zip"
-    zip_path = "static/temp/" + zip_path
-    zip_whole_path = join(dirname(__file__), zip_path)
+    return jsonify({"response": 200, "path": url_for("files.stream_files", id=download.id)})
 
-    with zipfile.ZipFile(zip_whole_path, 'a') as zf:
-        for name in files:
-            with zf.open(name, 'w') as f:
-                f.write(files[name])
-                f.close()
-        zf.close()
-    print(5)
+@files.route('/downloadFiles', methods=['GET'])
+@login_required
+def stream_files():
+    """
+    '/downloadFiles' GET route, streams a zip of the files selected by a download request, given by its 'id' query parameter
+    (or of the files given by the 'name' query parameters, for small selections).
+    The zip is built as it is sent, one file at a time, so it is never stored in memory or on disk.
+    Its progress is sent as 'zip' events (see '/events'), for the 'operation' query parameter.
+
+    Response code 404: The download does not exist or has expired, or one or more request files does not exist.
+    Response code 200: The zip file as an attachment.
+    """
+    if "id" in request.args:
+        download = db.session.get(Download, request.args["id"])
+        expired = download and datetime.strptime(download.date_created, DATE_FORMAT) < datetime.now() - DOWNLOAD_EXPIRY
+        if not download or download.user != current_user.username or expired:
+            return Response("Download does not exist.", status=404)
+        names = download.name_list
+    else:
+        names = request.args.getlist("name")
+
+    fileloader = FileLoader()
+    found = fileloader.search_many(names, current_user)
+    if len(found) < len(set(names)):
+        return Response("File does not exist.", status=404)
+    files = [found[name] for name in dict.fromkeys(names)]
 
     log(f"Zip file downloaded, number of files: {len(files)}")
 
-    return jsonify({"response": 200, "path": zip_path})
+    progress = events.progress(
+        current_user.username, "zip", operation_id(request), total=len(files), total_bytes=sum(file.size for file in files)
+    )
+    response = Response(stream_with_context(stream_zip(files, progress)), mimetype="application/zip")
+    response.headers["Content-Disposition"] = f"attachment; filename=files-{bitshift_hash(random_name(5))}.zip"
+    return response
 
 @files.route('/getFileStorage', methods=['POST'])
 @login_required
 def get_file_storage():
     """
     '/getFileStorage' route, returns the total file storage in bytes.
+    The storage is read from the user's usage counters, rather than adding up the sizes of their files.
 
     Response code 200:
-        Returns the total file storage taken up in bytes.
+        Returns the total file storage taken up in bytes,
+        and the number of files and bytes for each type class, split into live and archived files.
     """
+    counters = StorageUsage.query.filter(StorageUsage.user == current_user.username).all()
 
-    files = current_user.files
-    size = sum([file.size for file in files])
+    usage = {}
+    for counter in counters:
+        type_usage = usage.setdefault(counter.type_class or "other", {})
+        type_usage["archived" if counter.archived else "live"] = {"files": counter.file_count, "size": counter.bytes}
 
-    return jsonify({"response": 200, "size": size})
+    return jsonify({"response": 200, "size": sum(counter.bytes for counter in counters), "usage": usage})
+
+@files.route('/jobStatus', methods=['GET'])
+@login_required
+def job_status():
+    """
+    '/jobStatus' route, returns the status of background jobs of the current user (see modules/jobs.py),
+    e.g. to poll for the previews of uploaded images.
+
+    Takes in any number of 'id' query parameters.
+
+    Response code 300: A job id is not a number.
+    Response code 200: Returns 'jobs', a list of {'id', 'kind', 'target', 'status', 'attempts', 'error'} for each job found,
+        where status is queued, running, done or failed.
+    """
+    try:
+        ids = [int(job_id) for job_id in request.args.getlist("id")]
+    except ValueError:
+        return jsonify({"response": 300})
+
+    jobs = Job.query.filter(Job.user == current_user.username, Job.id.in_(ids)).order_by(Job.id).all()
+
+    return jsonify({"response": 200, "jobs": [job.to_json() for job in jobs]})
+
+@files.route('/events', methods=['GET'])
+@login_required
+def event_stream():
+    """
+    '/events' route, a Server-Sent Events stream of the progress of the current user's long operations.
+    Events are JSON objects, of the types:
+        upload: {'operation', 'total_bytes', 'bytes', 'received', 'files', 'done'} while files are uploaded.
+        zip: {'operation', 'total', 'total_bytes', 'members', 'bytes', 'done'} while a zip is downloaded.
+        archive, restore, delete: {'operation', 'total', 'files', 'missing', 'done'} while files are changed.
+        job: a background job which has finished, as in '/jobStatus', e.g. once the previews of an image (its hash is 'target') are rendered.
+    'operation' is the id which the client gave the request of the operation, in the X-Operation header or the 'operation' query parameter.
+
+    Response code 200: The event stream, which stays open until the client closes it.
+    """
+    user = current_user.username
+
+    def generate():
+        subscriber = events.subscribe(user)
+        try:
+            # Jobs are run by worker processes, which cannot publish to this process, so finished jobs are polled for instead.
+            last_job = db.session.query(func.max(Job.id)).filter(Job.user == user).scalar() or 0
+            pending = set(db.session.scalars(
+                select(Job.id).where(Job.user == user, Job.status.in_([Job.QUEUED, Job.RUNNING]))
+            ))
+            db.session.close()
+            last_poll = last_sent = monotonic()
+
+            yield f"retry: {EVENT_RETRY}\n\n"
+
+            while True:
+                messages = subscriber.pop_all(EVENT_POLL_INTERVAL)
+
+                if monotonic() - last_poll >= EVENT_POLL_INTERVAL:
+                    jobs = Job.query.filter(Job.user == user, or_(Job.id > last_job, Job.id.in_(pending))).all()
+                    # The session is closed between polls, so the stream does not hold a connection or transaction open.
+                    db.session.close()
+
+                    for job in jobs:
+                        last_job = max(last_job, job.id)
+                        if job.status in (Job.DONE, Job.FAILED):
+                            pending.discard(job.id)
+                            messages.append(("job", job.to_json()))
+                        else:
+                            pending.add(job.id)
+                    last_poll = monotonic()
+
+                for event, data in messages:
+                    yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+                if messages:
+                    last_sent = monotonic()
+                elif monotonic() - last_sent >= EVENT_KEEPALIVE:
+                    # Comments keep proxies from closing an idle stream.
+                    yield ": keepalive\n\n"
+                    last_sent = monotonic()
+        finally:
+            events.unsubscribe(user, subscriber)
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Stops nginx from buffering the stream.
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 @files.route('/getExtensions', methods=['POST'])
 @login_required
@@ -343,6 +731,8 @@ def rename_file():
         Request was made succesfully
     Response code 300:
         File not found error.
+    Response code 301:
+        A file with the new name already exists.
     """
     data = json.loads(request.data)
 
@@ -353,6 +743,9 @@ def rename_file():
     file = fileloader.search(name=original_name, user=current_user)
     if not file:
         return jsonify({"response": 300})
+
+    if new_name != original_name and fileloader.search(name=new_name, user=current_user):
+        return jsonify({"response": 301})
     
     file.name = new_name
 
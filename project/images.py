@@ -2,16 +2,23 @@
 Routes handling image transfer for the gallery
     - Uploading images
     - Getting the image as a base64 representation of its data..
+    - Serving image previews (derivatives) by URL, so browsers can fetch them in parallel and cache them.
+    - Editing images non-destructively (rotate, flip, crop, resize, quality), and exporting them with their edits applied.
 """
 
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, Response, url_for, redirect
 from flask_login import login_required, current_user
 
-from .models import User, File
+from .models import File, Job
 from .models import JPG_START, PNG_START, DATE_FORMAT, GIF_START
-from . import db
+from . import db, blobstore, derivatives, pipeline, events
 from .modules.functions import log
 from .modules.fileloader import FileLoader
+from .modules.streaming import is_streaming, stream_uploads
+from .modules.events import operation_id
+from .modules import imaging
+from .modules.imaging import GALLERY, VIEWER, THUMBNAIL, PRESETS, EXPORT
+from .modules.edits import edits_hash
 
 import json
 import base64
@@ -26,9 +33,12 @@ def upload_image():
     '/uploadImage' route
 
     Takes in request data 'images'<list> and 'overwrite'<bool>
+    The images can also be streamed as a multipart/form-data body with one or more image files,
+    or as a raw application/octet-stream body of a single image with its 'name' as a query parameter.
+    The progress of a streamed upload is sent as 'upload' events (see '/events').
 
     Response code 200:
-        returns images as a dict/json.
+        returns images as a dict/json, each with the id of the job which renders its previews ('job', see '/jobStatus').
     Reponse code 201:
         File(s) already exists (conflicting file names), returns the list of conflicting file names
     Response code 202:
@@ -37,40 +47,54 @@ def upload_image():
     if request.method != "POST":
         return
 
-    data = json.loads(request.data)
+    progress = None
+    if is_streaming(request):
+        progress = events.progress(current_user.username, "upload", operation_id(request), total_bytes=request.content_length)
+        data, uploads = stream_uploads(request, progress)
+        images = [(name, {"hash": digest, "size": size}) for name, digest, size in uploads]
+    else:
+        data = json.loads(request.data)
+        images = [(file["name"], {"value": file["value"]}) for file in data["images"]]
 
     overwrite = bool("overwrite" in data.keys())
     user = current_user.username
 
-    files = data["images"]
-
     file_objects = []
 
-    existing_files = []
-    for file in files:
-        img = file["value"]
-        filename: str = file["name"]
-
+    # File names are unique, so if a name is given more than once the last image with it is kept.
+    uploads = {}
+    for filename, blob in images:
         extension = filename.split(".")[-1].upper()
-        filename = filename[:-len(extension)] + extension
 
         if not extension:
             log("Wrong file format.")
             return Response("Filename must be .PNG, .JPEG, or .GIF", status=202, mimetype='application/json')
-        
-        if extension in ["JPG", "JPEG"]:
-            img = img[len(JPG_START):]
 
-        elif extension == "PNG":
-            img = img[len(PNG_START):]
+        uploads[filename[:-len(extension)] + extension] = blob
+
+    # Look up every file name in one query
+    fileloader = FileLoader()
+    same_files = fileloader.search_many(list(uploads), current_user)
+
+    existing_files = []
+    for filename, blob in uploads.items():
+        extension = filename.split(".")[-1]
 
-        elif extension == "GIF":
-            img = img[len(GIF_START):]
+        if "value" in blob:
+            img = blob["value"]
 
-        img_bytes = base64.b64decode(img)
+            if extension in ["JPG", "JPEG"]:
+                img = img[len(JPG_START):]
 
-        fileloader = FileLoader()
-        image_object = fileloader.search(name=filename, user=current_user)
+            elif extension == "PNG":
+                img = img[len(PNG_START):]
+
+            elif extension == "GIF":
+                img = img[len(GIF_START):]
+
+            blob = {"value": base64.b64decode(img)}
+
+        image_object = same_files.get(filename)
         if image_object:
             if not overwrite:
                 # Check if the filename already exists, only if the overwrite option is False
@@ -78,18 +102,16 @@ def upload_image():
             else:
                 # Replace file data
                 db.session.delete(image_object)
-                image_object = File(name=filename, user=user, value=img_bytes)
-                image_object.set_property("date_uploaded", datetime.now().strftime(DATE_FORMAT))
+                # Deletes are flushed after inserts, so the original is removed now to keep file names unique.
+                db.session.flush()
+                image_object = File(name=filename, user=user, **blob)
+                image_object.date_uploaded = datetime.now().strftime(DATE_FORMAT)
                 
         else:
-            image_object = File(name=filename, user=user, value=img_bytes)
-            image_object.set_property("date_uploaded", datetime.now().strftime(DATE_FORMAT))
-            
-        # Base64 File is sometimes rotated 90 degrees clockwise.
-        # Rotate it back if the orientation is 8.
-        if image_object.orientation == 8:
-            image_object.value = image_object.rotate_left()
+            image_object = File(name=filename, user=user, **blob)
+            image_object.date_uploaded = datetime.now().strftime(DATE_FORMAT)
 
+        # The original is stored as it was uploaded. Its EXIF orientation is applied to its previews instead (see modules/imaging.py).
         file_objects.append(image_object)
 
     if existing_files:
@@ -105,14 +127,25 @@ def upload_image():
                 "size": image_obj.size,
                 "dims": image_obj.dims,
             }
-        if image_obj.extension == ".GIF":
-            image_data["downsized"] = image_obj.first_frame
-        else:
-            image_data["downsized"] = image_obj.resize(240)
+        image_data["downsized"] = image_obj.preview_url(GALLERY)
         return_images.append(image_data)
         db.session.add(image_obj)
     db.session.commit()
 
+    # The previews are rendered by a worker after the response is sent (see modules/jobs.py),
+    # and the render job of each image is returned so that its status can be polled at '/jobStatus'.
+    # Until a preview is rendered, requesting it renders it in the request instead.
+    render_jobs = dict(
+        db.session.query(Job.target, Job.id)
+        .filter(Job.kind == Job.RENDER, Job.target.in_([image_obj.hash for image_obj in file_objects]),
+                Job.status.in_([Job.QUEUED, Job.RUNNING]))
+    )
+    for image_obj, image_data in zip(file_objects, return_images):
+        image_data["job"] = render_jobs.get(image_obj.hash)
+
+    if progress:
+        progress.finish(files=len(file_objects))
+
     return_data = {
         "response": 200,
         "images": return_images
@@ -125,14 +158,153 @@ def upload_image():
 def get_image():
     """
     '/getImage' route which responds with:
-        base64<string>, downsized<string>, metadata<string>
+        base64<string>, downsized<string>, metadata<string>, src<string>
+
+    'downsized' is the URL of the viewer preview.
+    'src' is the URL which serves the original image as raw bytes.
+    'export' is the URL which serves the image with its edits applied, and 'edits' is the list of its edits.
+    If 'base64' is given as false, the base64 representation of the original is left out.
+
+    Response code 300: File not found, or the file is not an image.
+    """
+    data = json.loads(request.data)
+
+    fileloader = FileLoader()
+    img = fileloader.search(name=data.get("name"), user=current_user)
+    if not img or not img.is_image:
+        return jsonify({"response": 300})
+
+    image_data = {
+        "downsized": img.preview_url(VIEWER),
+        "metadata": img.get_metadata(),
+        "src": url_for("files.serve_file", name=img.name),
+        "export": url_for("images.export_image", name=img.name),
+        "edits": img.edit_list
+    }
+    if data.get("base64", True):
+        image_data["base64"] = img.base64
+
+    return jsonify(image_data)
+
+# Previews are named by the hash of the original, so the bytes behind a URL never change and browsers can keep them.
+DERIVATIVE_MAX_AGE = 365 * 24 * 60 * 60
+
+@images.route('/derivative/<digest>/<preset>', methods=['GET'])
+@login_required
+def serve_derivative(digest: str, preset: str):
+    """
+    '/derivative/<hash>/<preset>' route, serves a preview of one of the current user's images.
+    Previews are rendered the first time they are requested, by the image pipeline, and then read from the derivative cache.
+
+    The response may be cached by the browser forever (immutable), as a preview is keyed by the content hash of its original
+    and the hash of its edits. The 'v' query parameter is the version of the previews (imaging.PREVIEW_VERSION),
+    which changes the URL when they are rendered differently, and 'e' is the hash of the edits of an edited image.
+
+    Response code 404: Unknown preset, or none of the user's files have the hash (and edits).
+    Response code 302: The preview could not be rendered, redirects to the file icon.
+    Response code 200: The encoded preview.
+    """
+    if preset not in PRESETS:
+        return Response("Unknown preset.", status=404)
+
+    # Files which share a blob may have different edits, so the edits are found by their hash in the URL.
+    edits_key = request.args.get("e")
+    for (stored,) in db.session.query(File.edits).filter_by(user=current_user.username, hash=digest):
+        edits = json.loads(stored) if stored else None
+        if edits_hash(edits) == edits_key:
+            break
+    else:
+        return Response("File does not exist.", status=404)
+
+    data = derivatives.get(digest, preset, edits)
+    if data is None:
+        data = pipeline.render_many([(blobstore.image_path(digest), preset, edits)])[0]
+        if data is None:
+            return redirect(url_for("static", filename="icons/file64.png"))
+        derivatives.put(digest, preset, data, edits)
+
+    response = Response(data, mimetype=imaging.mimetype(data))
+    response.set_etag(f"{digest}-{edits_key}-{preset}-{imaging.PREVIEW_VERSION}")
+    response.cache_control.private = True
+    response.cache_control.max_age = DERIVATIVE_MAX_AGE
+    response.cache_control.immutable = True
+
+    return response.make_conditional(request)
+
+@images.route('/editImage', methods=['POST'])
+@login_required
+def edit_image():
+    """
+    '/editImage' route, edits an image without changing its bytes (see modules/edits.py).
+    The edits are kept as a list of operations, which are applied when its previews or export are rendered.
+
+    Takes in 'name'<string>, and either 'edits'<list> which replaces every edit of the image ([] undoes them all),
+    or 'add'<list> of operations which are applied after its current edits.
+
+    Response code 300: File not found, or the file is not an image.
+    Response code 301: An edit operation is invalid, returns the 'error'.
+    Response code 200: Returns the new 'edits', the 'dims' of the edited image,
+        and the URLs of its previews ('thumbnail', 'downsized' and 'viewer').
     """
     data = json.loads(request.data)
-    filename = data["name"]
-    username = current_user.username
 
-    img = File.query.filter_by(name=filename, user=username).first()
+    fileloader = FileLoader()
+    img = fileloader.search(name=data.get("name"), user=current_user)
+    if not img or not img.is_image:
+        return jsonify({"response": 300})
+
+    try:
+        if "edits" in data:
+            img.set_edits(data["edits"])
+        else:
+            img.add_edits(data.get("add", []))
+    except ValueError as e:
+        return jsonify({"response": 301, "error": str(e)})
+
+    db.session.commit()
+
+    return jsonify({
+        "response": 200,
+        "edits": img.edit_list,
+        "dims": img.edited_dims,
+        "thumbnail": img.preview_url(THUMBNAIL),
+        "downsized": img.preview_url(GALLERY),
+        "viewer": img.preview_url(VIEWER)
+    })
+
+@images.route('/export/<path:name>', methods=['GET'])
+@login_required
+def export_image(name: str):
+    """
+    '/export/<name>' route, serves an image at full size with its edits applied, as an attachment if 'download' is given.
+    Images without edits are served as they were uploaded. Exports are rendered once and then read from the derivative cache.
+
+    Response code 404: File not found, or the file is not an image.
+    Response code 302: The image has no edits, redirects to its original. Or the export could not be rendered,
+        redirects to the file icon.
+    Response code 200: The encoded export.
+    """
+    fileloader = FileLoader()
+    img = fileloader.search(name=name, user=current_user)
+    if not img or not img.is_image:
+        return Response("File does not exist.", status=404)
+
+    edits = img.edit_list
+    if not edits or not img.hash:
+        return redirect(url_for("files.serve_file", name=img.name))
+
+    data = derivatives.get(img.hash, EXPORT, edits)
+    if data is None:
+        data = pipeline.render_many([(blobstore.image_path(img.hash), EXPORT, edits)])[0]
+        if data is None:
+            return redirect(url_for("static", filename="icons/file64.png"))
+        derivatives.put(img.hash, EXPORT, data, edits)
 
-    max_height = min(1280, img.dims[1]//2)
-    return jsonify({"base64": img.base64, "downsized": img.resize(max_height), "metadata": img.get_metadata()})
+    response = Response(data, mimetype=imaging.mimetype(data))
+    if "download" in request.args:
+        response.headers.set("Content-Disposition", "attachment", filename=img.name)
+    response.set_etag(f"{img.hash}-{edits_hash(edits)}-{EXPORT}-{imaging.PREVIEW_VERSION}")
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
 
+    return response.make_conditional(request)
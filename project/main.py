@@ -12,9 +12,7 @@ Provides web routes for all of the pages on the Storage Saver application.
 from flask import Blueprint, render_template, url_for, request, jsonify
 from flask_login import login_required, current_user
 
-from .models import SETTINGS
-from .modules.fileloader import FileLoader
-from .modules.fileloader import FILES
+from .models import SETTINGS, FILES
 
 main = Blueprint('main', __name__)
 
@@ -35,38 +33,33 @@ def profile():
 @main.route('/all', methods=["GET"])
 @login_required
 def all_files():
-    fileloader = FileLoader()    
-    files = fileloader.load_thumbnails()
+    # The files are requested by the page from /listFiles, one page at a time.
+    list_view = {"type": None, "archived": False}
 
     user_settings = current_user.get_all_settings()
-    return render_template("all_files.html", files=files, user_settings=user_settings, ignore_highlighting=True)
+    return render_template("all_files.html", list_view=list_view, user_settings=user_settings, ignore_highlighting=True)
 
 @main.route('/gallery', methods=["GET"])
 @login_required
 def gallery():
-    images = FileLoader()
-    image_json = images.load(archived=None)
-
     user_settings = current_user.get_all_settings()
-    return render_template('gallery.html', images=image_json, user_settings=user_settings)
+    return render_template('gallery.html', user_settings=user_settings)
 
 @main.route('/file_manager', methods=["GET"])
 @login_required
 def file_manager():
-    images = FileLoader()
-    files = images.load_thumbnails(_type=FILES)
+    list_view = {"type": FILES, "archived": False}
 
     user_settings = current_user.get_all_settings()
-    return render_template("file_manager.html", files=files, user_settings=user_settings, ignore_highlighting=True)
+    return render_template("file_manager.html", list_view=list_view, user_settings=user_settings, ignore_highlighting=True)
 
 @main.route('/recently_deleted', methods=["GET"])
 @login_required
 def recently_deleted():
-    images = FileLoader()
-    files = images.load_thumbnails(archived=True)
+    list_view = {"type": None, "archived": True}
     
     user_settings = current_user.get_all_settings()
-    return render_template("recently_deleted.html", files=files, user_settings=user_settings, ignore_highlighting=True)
+    return render_template("recently_deleted.html", list_view=list_view, user_settings=user_settings, ignore_highlighting=True)
 
 @main.route('/about', methods=["GET"])
 def about_us():
@@ -2,21 +2,50 @@
 SQLAlchemy models which represent records within the database.
 
 The database models being:
-    User(id, email<str>, password<str>, username<str>, settings<str>) -> relationship User.files to File model
+    User(id, email<str>, password<str>, username<str>, settings<str>) -> relationship User.files to File model (a query)
         - Represents a registered user and has their own index of files
-    File(id, name<str>, user<str>, value<bytes>, exif<str>, properties<str>)
-        - Stores the bytes representation of a file.
+    File(id, name<str>, user<str>, hash<str>, size<int>, exif<str>, properties<str>,
+         archived<bool>, date_uploaded<str>, type_class<str>,
+         mimetype<str>, sniffed<str>, width<int>, height<int>, orientation<int>, frame_count<int>, date_taken<str>, edits<str>)
+        - Refers to the bytes of a file, which are kept in the blob store under their SHA-256 hash.
+          File.value lazily reads the bytes from the blob store.
+        - Metadata is extracted from the bytes once, when the file is stored, into indexed columns.
+          The EXIF orientation of images is kept as metadata and applied to their previews, never to the stored bytes.
+        - Images are edited non-destructively: the edits are kept as a list of operations, which is applied
+          when a preview or export is rendered (see modules/edits.py).
+        - The properties which listings filter on are indexed columns, and any others are kept in the properties JSON.
         - Has methods for image preview and returning its base64 representation.
+    UploadSession(id<str>, user<str>, name<str>, chunk_count<int>, properties<str>, date_created<str>)
+        - A resumable upload whose chunks are staged on disk until it is finalised into a File.
+    Download(id<str>, user<str>, names<str>, date_created<str>)
+        - A selection of files to be downloaded as a zip, kept under a short token so that the download URL
+          does not have to hold every file name.
+    StorageUsage(user<str>, type_class<str>, archived<bool>, file_count<int>, bytes<int>)
+        - Running totals of the files a user has of each type class, archived or not.
+          Updated in the same transaction as the files, so a user's storage is read without adding up their files.
+    Job(id, user<str>, kind<str>, target<str>, status<str>, priority<int>, attempts<int>,
+        run_after<float>, locked_until<float>, error<str>, date_created<str>, date_finished<str>)
+        - Heavy work on a file's blob (e.g. rendering previews), queued in the same transaction as the file
+          and run later by the worker processes (see modules/jobs.py and 'flask worker').
 """
 
+from flask import url_for, current_app
 from flask_login import UserMixin
-from . import db
+from . import db, blobstore, derivatives
 from io import BytesIO
 from base64 import b64encode
 from datetime import datetime
 from .modules.functions import decrypt, encrypt
+from .modules.blobstore import CHUNK_SIZE
+from .modules import imaging
+from .modules.imaging import THUMBNAIL
+from .modules import edits as image_edits
+
+from sqlalchemy import event, inspect, select, text, update, insert
+from sqlalchemy.orm import Session
 
 import json
+import mimetypes
 import PIL
 import PIL.Image
 from os.path import join, dirname
@@ -39,6 +68,17 @@ JPG_SEQUENCE = b"\xff\xd8"
 
 DATE_FORMAT = "%Y/%m/%d %H:%M:%S"
 
+# Formats whose contents are already compressed, so they are neither compressed in the blob store nor deflated in zips.
+COMPRESSED_EXTENSIONS = [".JPEG", ".JPG", ".PNG", ".GIF", ".WEBP", ".PDF", ".ZIP", ".7Z", ".RAR", ".DOCX", ".PPTX", ".MOV", ".MP4", ".MP3"]
+
+# Type classes of files, which decide the pages they are shown on.
+IMAGES = "images"
+FILES = "files"
+
+# Properties which are filtered on by every listing, so they are stored in their own indexed columns
+# rather than the properties JSON. See File.set_property.
+PROPERTY_COLUMNS = ["archived", "date_uploaded"]
+
 with open(join(dirname(__file__), "modules/settings.json"), "r") as f:
     SETTINGS = json.load(f)
     f.close()
@@ -50,7 +90,8 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String, unique=True)
     settings = db.Column(db.String)
 
-    files = db.relationship("File", order_by="File.name") # Sort by user.name to perform binary search
+    # A query of the user's files rather than a list, so that they are only loaded when asked for. Sorted by name.
+    files = db.relationship("File", order_by="File.name", lazy="dynamic")
 
     def change_setting(self, setting: str, value: str | int | bool | None) -> None:
         """
@@ -88,15 +129,107 @@ class User(UserMixin, db.Model):
     
 class File(db.Model):
     __tablename__ = 'file'
+    __table_args__ = (
+        # Each user's file names are unique, and files are looked up by them (see FileLoader.search).
+        db.Index("ix_file_user_name", "user", "name", unique=True),
+        # Covers the listings, which are always of one user's archived or unarchived files of a type class.
+        db.Index("ix_file_user_archived_type_class", "user", "archived", "type_class"),
+        # Cover the sorts of the paginated listings (see FileLoader.load_page), which then end in id order.
+        db.Index("ix_file_user_archived_name", "user", "archived", "name"),
+        db.Index("ix_file_user_archived_size", "user", "archived", "size"),
+        db.Index("ix_file_user_archived_date_uploaded", "user", "archived", "date_uploaded"),
+        db.Index("ix_file_user_archived_date_taken", "user", "archived", "date_taken"),
+        db.Index("ix_file_user_archived_mimetype", "user", "archived", "mimetype"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     user = db.Column(db.String, db.ForeignKey('user.username')) # ForeignKey defines the connection between User.files and a File object.
-    value = db.Column(db.String)
+    # Legacy bytes, only set for files stored before the blob store. See 'flask migrate-blobs'.
+    # Deferred, so the bytes are only selected when File.value falls back to them, and never when files are listed.
+    _value = db.deferred(db.Column("value", db.String))
+    hash = db.Column(db.String(64), index=True)
+    size = db.Column(db.Integer, index=True)
     exif = db.Column(db.String)
-    properties = db.Column(db.String)
+    properties = db.Column(db.String) # JSON of any other properties
+
+    archived = db.Column(db.Boolean, nullable=False, default=False, server_default=text("0"), index=True)
+    date_uploaded = db.Column(db.String, index=True) # In DATE_FORMAT
+    type_class = db.Column(db.String(8), index=True) # IMAGES or FILES, set along with the metadata
+
+    # Metadata extracted once when the file is stored (see File.extract_metadata), so that listings never read the bytes.
+    # A mimetype of None means the metadata has not been extracted yet.
+    mimetype = db.Column(db.String(64), index=True)
+    sniffed = db.Column(db.String(8)) # Type found from the magic bytes, .PNG or .JPEG, or empty if neither
+    width = db.Column(db.Integer, index=True) # Of the image as it is shown, after its EXIF orientation is applied
+    height = db.Column(db.Integer, index=True)
+    orientation = db.Column(db.Integer) # EXIF orientation of images, 1 (upright) to 8, applied when previews are rendered
+    frame_count = db.Column(db.Integer)
+    date_taken = db.Column(db.String, index=True) # In DATE_FORMAT, which sorts in date order
+
+    # JSON list of the edit operations of an image (see modules/edits.py), or None if it is shown as it was uploaded.
+    edits = db.Column(db.String)
+
+    @property
+    def value(self) -> bytes:
+        """
+        The bytes of the file, which are only read from the blob store the first time they are accessed.
+        """
+        data = getattr(self, "_data", None)
+        if data is None:
+            if self.hash:
+                data = blobstore.read(self.hash)
+            else:
+                data = self._value
+            self._data = data
+
+        return data
+
+    @value.setter
+    def value(self, data: bytes) -> None:
+        """
+        Writes the bytes to the blob store and keeps a reference to them by their hash.
+        """
+        self.hash, self.size = blobstore.put(data)
+        self._value = None
+        self._data = data
+        self._parsed = {}
+        self.mimetype = None # The stored metadata is out of date until it is extracted again
+
+    def _memo(self, key: str, parse):
+        """
+        Returns something parsed from the bytes of the file (its sniffed type, image handle, dimensions or metadata),
+        only calling parse the first time it is needed.
+        File objects only live for one request, so each blob is parsed at most once per request.
+        The memo is cleared whenever the bytes of the file are changed.
+        """
+        parsed = getattr(self, "_parsed", None)
+        if parsed is None:
+            parsed = self._parsed = {}
+
+        if key not in parsed:
+            parsed[key] = parse()
+
+        return parsed[key]
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE):
+        """
+        Yields the bytes of the file in chunks of chunk_size bytes, without reading the whole file into memory.
+        """
+        if not self.hash:
+            data = self.value
+            for offset in range(0, len(data), chunk_size):
+                yield data[offset:offset + chunk_size]
+            return
+
+        yield from blobstore.iter_chunks(self.hash, chunk_size)
 
     def set_property(self, key: str, value: str) -> None:
+        if key in PROPERTY_COLUMNS:
+            setattr(self, key, bool(value) if key == "archived" else value)
+            db.session.commit()
+            return
+
         if not self.properties:
             self.properties = "{}"
 
@@ -107,6 +240,9 @@ class File(db.Model):
         db.session.commit()
 
     def get_property(self, key: str) -> str | None:
+        if key in PROPERTY_COLUMNS:
+            return getattr(self, key)
+
         if not self.properties:
             return None
         
@@ -118,6 +254,11 @@ class File(db.Model):
         return properties[key]
 
     def remove_property(self, key: str) -> None:
+        if key in PROPERTY_COLUMNS:
+            setattr(self, key, False if key == "archived" else None)
+            db.session.commit()
+            return
+
         if not self.properties:
             return
         
@@ -131,16 +272,33 @@ class File(db.Model):
 
         db.session.commit()
 
+    def promote_properties(self) -> None:
+        """
+        Moves properties which have their own columns out of the properties JSON,
+        for files which were stored before the columns existed. Does not commit.
+        """
+        if not self.properties:
+            return
+
+        properties = json.loads(self.properties)
+        for key in PROPERTY_COLUMNS:
+            if key in properties:
+                value = properties.pop(key)
+                setattr(self, key, bool(value) if key == "archived" else value)
+
+        self.properties = json.dumps(properties)
+
     @property
     def extension(self) -> str | bool:
         """
         Returns .PNG or .JPEG for extensions. Returns the filename extension otherwise, Returns None if nothing matches.
         """
-
-        if self.value[:4] == PNG_SEQUENCE[0] and self.value[-4:] == PNG_SEQUENCE[1]:
-            return ".PNG"
-        elif self.value[:2] == JPG_SEQUENCE:
-            return ".JPEG"
+        if self.mimetype is not None:
+            sniffed = self.sniffed
+        else:
+            sniffed = self._memo("sniffed", self._sniff)
+        if sniffed:
+            return sniffed
         
         extension = self.name.split(".")[-1]
         extension = "".join(extension.split())
@@ -150,18 +308,73 @@ class File(db.Model):
 
         return None
 
-    @property
-    def size(self) -> int:
-        return len(self.value)
-    
-    @property
-    def date(self) -> tuple[int]:
+    def _sniff(self) -> str | None:
+        """
+        Returns .PNG or .JPEG if the magic bytes at the start and end of the file match, otherwise None.
+        Only the first and last few bytes of a blob are read.
+        """
+        if self.hash:
+            head = blobstore.head(self.hash, 4)
+        else:
+            head = self.value[:4]
+
+        if head == PNG_SEQUENCE[0]:
+            # The end of the file is only read if the start matches, as it is slow to reach in compressed blobs.
+            tail = blobstore.tail(self.hash, 4) if self.hash else self.value[-4:]
+            if tail == PNG_SEQUENCE[1]:
+                return ".PNG"
+        elif head[:2] == JPG_SEQUENCE:
+            return ".JPEG"
+
+        return None
+
+    def extract_metadata(self) -> None:
+        """
+        Works out the type, dimensions, frame count and date taken of the file from its bytes,
+        and stores them in their columns. Called whenever a file is stored or its bytes or name change.
+        """
+        self.mimetype = None
+        self.sniffed = self._memo("sniffed", self._sniff) or ""
+
+        if self.size is None:
+            self.size = len(self.value)
+
+        extension = self.extension
+        mimetype = mimetypes.guess_type("file" + (extension or "").lower())[0]
+
+        self.width = self.height = self.orientation = self.frame_count = self.date_taken = None
+        if self.is_image:
+            self.orientation = imaging.UPRIGHT
+            try:
+                self.orientation = imaging.exif_orientation(self.image)
+                self.width, self.height = self._memo("dims", self._oriented_dims)
+                if extension == ".GIF":
+                    self.frame_count = self.image.n_frames
+                self.date_taken = self._parse_date()
+            except OSError:
+                # The bytes could not be read as an image, so there is nothing more to extract.
+                pass
+            finally:
+                # Files are extracted in batches of thousands, so the handle is not kept open for the rest of the request.
+                self._close_image()
+
+        self.type_class = IMAGES if self.is_image else FILES
+        self.mimetype = mimetype or "application/octet-stream"
+
+    def _parse_date(self) -> str | None:
         md = self.get_metadata()
         if "DateTime" in md:
             date_obj = datetime.strptime(md["DateTime"], "%Y:%m:%d %H:%M:%S")
             return date_obj.strftime(DATE_FORMAT)
         else:
             return None
+
+    @property
+    def date(self) -> tuple[int]:
+        if self.mimetype is not None:
+            return self.date_taken
+
+        return self._parse_date()
     
     @property
     def type(self) -> str:
@@ -180,46 +393,20 @@ class File(db.Model):
         if not self.is_image:
             return FILE_SRC
 
-        extension = self.extension
-        im = self.image
-        
-        # GIF returns the first frame but downsized
-        if extension == ".GIF":
-            im.seek(1)
-            extension = ".PNG"
-
-        dims = self.dims
-
-        # Portrait
-        if dims[1] > dims[0]:
-            height = int(dims[1] * 32 // dims[0])
-            # Images are downsized and cropped to 32x32
-            im_downsized = im.resize((32, height), PIL.Image.Resampling.BICUBIC)
-            top = height // 2 - 16
-            bottom = top + 32
-            im_cropped = im_downsized.crop((0, top, 32, bottom))
-
-        # Landscape
-        else:
-            width = int(dims[0] * 32 // dims[1])
-            im_downsized = im.resize((width, 32), PIL.Image.Resampling.BICUBIC)
-            left = width // 2 - 16
-            right = left + 32
-            im_cropped = im_downsized.crop((left, 0, right, 32))
-
-        buffered = BytesIO()
-        im_cropped.save(buffered, format=extension[1:]) # Stripping the period off of the file extension
-        img_str = b64encode(buffered.getvalue())
-
-        if extension == ".PNG":
-            return PNG_START + img_str.decode("utf-8")
-        elif extension == ".JPEG":
-            return JPG_START + img_str.decode("utf-8")
+        return self.preview_url(THUMBNAIL)
         
     @property
     def is_image(self):
         return self.extension in [".PNG", ".JPEG", ".JPG", ".GIF"]
 
+    @property
+    def compressible(self) -> bool:
+        """
+        Whether the bytes of the file are worth compressing in the blob store,
+        which is every type except those which are already compressed (going by the sniffed type first).
+        """
+        return self.extension not in COMPRESSED_EXTENSIONS
+
     @property
     def is_code(self):
         return self.extension in [".PY", ".JS", ".CSS", ".HTML", ".AHK", ".C", ".CPP", ".CS", ".LUA", ".VB", ".VBA", ".JSON"]
@@ -241,16 +428,51 @@ class File(db.Model):
     @property
     def bytesio(self) -> BytesIO:
         if not self.extension:
-            self.value = JPG_SEQUENCE + self.value
+            # Without a known type, the bytes are read as a JPEG. The stored bytes are left as they are.
+            return BytesIO(JPG_SEQUENCE + self.value)
         return BytesIO(self.value)
 
+    def _open_image(self) -> PIL.Image.Image:
+        """
+        Opens a new handle to the image. Only the header is read until the pixels are needed.
+        Blobs are opened from disk, so their bytes are not copied into memory first.
+        """
+        if self.hash and self.extension:
+            return PIL.Image.open(blobstore.image_path(self.hash))
+        return PIL.Image.open(self.bytesio)
+
     @property
     def image(self) -> PIL.Image.Image:
-        return PIL.Image.open(self.bytesio)
+        """
+        The image handle of the file, which is opened once and shared for the rest of the request.
+        Pixels are only decoded the first time they are used.
+        """
+        im = self._memo("image", self._open_image)
+        if im.tell() != 0:
+            # A previous caller moved to another frame of an animation
+            im.seek(0)
+        return im
+
+    def _close_image(self) -> None:
+        """
+        Closes the image handle if it has been opened, so that its file is not left open until the request ends.
+        The next use of the image opens a new handle.
+        """
+        im = (getattr(self, "_parsed", None) or {}).pop("image", None)
+        if im is not None:
+            im.close()
 
     @property
     def dims(self) -> tuple[int]:
-        return self.image.size
+        """
+        The dimensions of the image as it is shown, i.e. swapped if its EXIF orientation turns it a quarter.
+        """
+        if self.mimetype is not None and self.width is not None:
+            return (self.width, self.height)
+        return self._memo("dims", self._oriented_dims)
+
+    def _oriented_dims(self) -> tuple[int]:
+        return imaging.oriented_size(self.image.size, imaging.exif_orientation(self.image))
     
     @property
     def base64(self) -> str | bool:
@@ -277,22 +499,14 @@ class File(db.Model):
 
         return PNG_START + img_str.decode("utf-8")
 
-    @property
-    def frame_count(self) -> int:
-        if self.extension != ".GIF":
-            return None
-        
-        return self.image.n_frames
-
     def resize(self, height: int, sampling = PIL.Image.Resampling.BICUBIC) -> str:
         """
         Resize the image to a specified height.
         Returns a base64 string
         """
-        # Scale width to same aspect ratio with changed height
-        dims = self.dims
-        width = int(dims[0] * height // dims[1])
-        im_downsized = self.image.resize((width, height), sampling)
+        # Scale width to same aspect ratio with changed height, decoding JPEGs at a reduced scale where possible.
+        # A new handle is opened, as decoding at a reduced scale would change the shared image.
+        im_downsized = imaging.resize_height(self._open_image(), height, sampling)
 
         extension = self.extension
 
@@ -307,22 +521,78 @@ class File(db.Model):
         
         return FILE_SRC
     
-    def rotate_left(self) -> bytes:
-        original = self.image
-        original = original.rotate(90, expand=True)
+    def derivative(self, preset: str) -> bytes:
+        """
+        Returns the encoded bytes of a preview of the image, for one of the presets in modules/imaging.py.
+        Previews are rendered once and then read from the derivative cache.
+        """
+        if not self.hash:
+            return imaging.render(self.bytesio, preset, self.edit_list)
 
-        extension = self.extension
+        return derivatives.render(self.hash, preset, blobstore.image_path(self.hash), self.edit_list)
 
-        buffered = BytesIO()
-        original.save(buffered, format=extension[1:]) # Stripping the period off of the file extension
-        return buffered.getvalue()
+    def preview(self, preset: str) -> str:
+        """
+        Returns a preview of the image as a base64 string for web usage.
+        """
+        return imaging.data_uri(self.derivative(preset))
+
+    def preview_url(self, preset: str) -> str:
+        """
+        Returns the URL of a preview of the image, which the browser fetches and caches (see '/derivative' in images.py).
+        Files stored before the blob store have no hash to serve their previews by, so their preview is inlined as base64.
+        Must be called within a request.
+        """
+        if not self.hash:
+            return self.preview(preset)
+
+        # The hash of the edits is part of the URL, so that browsers fetch the new previews once an image is edited.
+        edits = image_edits.edits_hash(self.edit_list)
+        return url_for("images.serve_derivative", digest=self.hash, preset=preset, v=imaging.PREVIEW_VERSION, e=edits)
+
+    # Edit methods
+
+    @property
+    def edit_list(self) -> list[dict]:
+        """
+        The edit operations of the image, in the order they are applied (see modules/edits.py).
+        """
+        return json.loads(self.edits) if self.edits else []
+
+    def set_edits(self, edits: list) -> None:
+        """
+        Replaces the edit operations of the image. An empty list shows the image as it was uploaded again.
+        The bytes of the image are never changed, only the operations which its previews and exports are rendered with.
+        Raises ValueError if an operation is invalid.
+        """
+        edits = image_edits.validate(edits)
+        self.edits = json.dumps(edits) if edits else None
+
+    def add_edits(self, edits: list) -> None:
+        """
+        Adds edit operations after the ones the image already has. Raises ValueError if an operation is invalid.
+        """
+        self.set_edits(self.edit_list + list(edits))
+
+    @property
+    def edited_dims(self) -> tuple[int]:
+        """
+        The dimensions of the image as it is shown, once its edits are applied.
+        """
+        return image_edits.edited_size(self.dims, self.edit_list)
+
+    def rotate_left(self) -> None:
+        """
+        Rotates the image 90 degrees anti-clockwise, as an edit operation.
+        """
+        self.add_edits([{"op": "rotate", "degrees": 270}])
 
     def deprecated_rotate_left(self) -> bytes:
         """
         Deprecated as the nested for loops was too slow.
         Rotates the image 90 degrees anti-clockwise. Returns a Byte array
         """
-        w, h = self.dims
+        w, h = self.image.size
 
         original = self.image
         original_pixels = original.load()
@@ -348,7 +618,9 @@ class File(db.Model):
         # self.exif = self.image.getexif()
         # self._metadata = self.exif
         # <class 'PIL.Image.Exif'>
+        return self._memo("metadata", self._parse_metadata)
 
+    def _parse_metadata(self) -> dict:
         if self.exif != None:
             return json.loads(self.exif)
 
@@ -357,7 +629,277 @@ class File(db.Model):
         self.exif = json.dumps(data)
 
         return data
-    
+
+class UploadSession(db.Model):
+    __tablename__ = 'upload_session'
+
+    id = db.Column(db.String(32), primary_key=True) # Random token, also the name of the session's staging directory
+    user = db.Column(db.String, db.ForeignKey('user.username'))
+    name = db.Column(db.String)
+    chunk_count = db.Column(db.Integer)
+    properties = db.Column(db.String) # Upload options, e.g. overwrite and allowImages
+    date_created = db.Column(db.String)
+
+    def get_property(self, key: str) -> str | None:
+        if not self.properties:
+            return None
+
+        return json.loads(self.properties).get(key)
+
+class Download(db.Model):
+    __tablename__ = 'download'
+
+    id = db.Column(db.String(32), primary_key=True) # Random token, given in the download URL
+    user = db.Column(db.String, db.ForeignKey('user.username'))
+    names = db.Column(db.String) # JSON list of the file names, in the order they are zipped
+    date_created = db.Column(db.String, index=True) # In DATE_FORMAT, which sorts in date order
+
     @property
-    def orientation(self) -> int:
-        return self.get_metadata().get("Orientation")
\ No newline at end of file
+    def name_list(self) -> list[str]:
+        return json.loads(self.names)
+
+class StorageUsage(db.Model):
+    __tablename__ = 'storage_usage'
+
+    user = db.Column(db.String, db.ForeignKey('user.username'), primary_key=True)
+    type_class = db.Column(db.String(8), primary_key=True) # IMAGES or FILES, or empty for files whose metadata has not been extracted
+    archived = db.Column(db.Boolean, primary_key=True)
+    file_count = db.Column(db.Integer, nullable=False, default=0)
+    bytes = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @staticmethod
+    def key(user: str, type_class: str | None, archived: bool | None) -> tuple:
+        """
+        Returns the primary key of the counters which a file with the given user, type class and archived state counts towards.
+        """
+        return (user, type_class or "", bool(archived))
+
+    @staticmethod
+    def count(deltas: dict, key: tuple, file_count: int, size: int | None) -> None:
+        """
+        Adds a change in the number of files and bytes to a dict of changes keyed by StorageUsage.key.
+        """
+        delta = deltas.setdefault(key, [0, 0])
+        delta[0] += file_count
+        delta[1] += file_count * (size or 0)
+
+    @staticmethod
+    def apply(connection, deltas: dict) -> None:
+        """
+        Adds the changes in a dict from StorageUsage.count to the counters, creating any counters which do not exist yet.
+        The counters are updated with relative UPDATEs within the caller's transaction,
+        so concurrent changes to the same user add up rather than overwrite one another.
+        """
+        table = StorageUsage.__table__
+        for (user, type_class, archived), (file_count, size) in deltas.items():
+            if file_count == 0 and size == 0:
+                continue
+
+            result = connection.execute(
+                update(table)
+                .where(table.c.user == user, table.c.type_class == type_class, table.c.archived == archived)
+                .values(file_count=table.c.file_count + file_count, bytes=table.c.bytes + size)
+            )
+            if result.rowcount == 0:
+                connection.execute(insert(table).values(
+                    user=user, type_class=type_class, archived=archived, file_count=file_count, bytes=size
+                ))
+
+class Job(db.Model):
+    __tablename__ = 'job'
+    __table_args__ = (
+        # Workers claim the queued job with the highest priority, oldest first.
+        db.Index("ix_job_status_priority", "status", "priority", "id"),
+        # A blob only has one queued or running job of each kind (see Job.enqueue).
+        db.Index("ix_job_kind_target", "kind", "target"),
+    )
+
+    # Kinds of jobs, see modules/jobs.py for what each one does.
+    RENDER = "render"
+    COMPRESS = "compress"
+    ORIENT = "orient"
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    # Priorities, higher priority jobs are run first.
+    HIGH = 10
+    LOW = 0
+
+    id = db.Column(db.Integer, primary_key=True)
+    user = db.Column(db.String, db.ForeignKey('user.username'))
+    kind = db.Column(db.String(16), nullable=False)
+    target = db.Column(db.String(64), nullable=False) # Hash of the blob which the job works on
+    status = db.Column(db.String(8), nullable=False, default=QUEUED)
+    priority = db.Column(db.Integer, nullable=False, default=LOW)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_after = db.Column(db.Float, nullable=False, default=0) # Unix time, later than now while waiting to be retried
+    locked_until = db.Column(db.Float) # Unix time when a running job is given up on, if its worker has died
+    error = db.Column(db.String)
+    date_created = db.Column(db.String)
+    date_finished = db.Column(db.String)
+
+    @staticmethod
+    def enqueue(connection, kind: str, targets: dict[str, str], priority: int = LOW) -> None:
+        """
+        Queues a job of the given kind for each target, within the caller's transaction.
+        Targets which already have a queued or running job of the same kind are not queued again,
+        although a queued job is raised to the given priority if it is lower.
+
+        Takes in the connection of the transaction, the kind of job, a dict of the users who own each target keyed by the target,
+        and the priority of the jobs.
+        """
+        table = Job.__table__
+        targets = dict(targets)
+
+        keys = list(targets)
+        for start in range(0, len(keys), 500):
+            query = (
+                select(table.c.id, table.c.target, table.c.status, table.c.priority)
+                .where(table.c.kind == kind, table.c.target.in_(keys[start:start + 500]),
+                       table.c.status.in_([Job.QUEUED, Job.RUNNING]))
+            )
+            for row in connection.execute(query).all():
+                targets.pop(row.target, None)
+                if row.status == Job.QUEUED and row.priority < priority:
+                    connection.execute(update(table).where(table.c.id == row.id).values(priority=priority))
+
+        if targets:
+            date_created = datetime.now().strftime(DATE_FORMAT)
+            connection.execute(insert(table), [
+                {"user": user, "kind": kind, "target": target, "status": Job.QUEUED, "priority": priority,
+                 "attempts": 0, "run_after": 0, "date_created": date_created}
+                for target, user in targets.items()
+            ])
+
+    def to_json(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "target": self.target,
+            "status": self.status,
+            "attempts": self.attempts,
+            "error": self.error
+        }
+
+@event.listens_for(Session, "before_flush")
+def extract_file_metadata(session, flush_context, instances):
+    """
+    Extracts the metadata of files which are new, or whose bytes or name have changed, before they are written.
+    """
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, File):
+            continue
+
+        state = inspect(obj)
+        if obj.mimetype is None or state.attrs.hash.history.has_changes() or state.attrs.name.history.has_changes():
+            obj.extract_metadata()
+
+# Columns of File which decide which counters of StorageUsage a file counts towards, and by how much.
+USAGE_COLUMNS = ["user", "type_class", "archived", "size"]
+
+@event.listens_for(Session, "before_flush")
+def count_storage_usage(session, flush_context, instances):
+    """
+    Updates the storage usage counters for files which are about to be added, changed or deleted.
+    Registered after extract_file_metadata, so the type class of new files is already known.
+
+    The counters a file counted towards before the flush are read from the database,
+    as the old values of attributes which were changed without being loaded first are not kept.
+    """
+    changed = []
+    for obj in session.dirty:
+        if isinstance(obj, File) and any(inspect(obj).attrs[column].history.has_changes() for column in USAGE_COLUMNS):
+            changed.append(obj)
+    deleted = [obj for obj in session.deleted if isinstance(obj, File)]
+
+    if not changed and not deleted and not any(isinstance(obj, File) for obj in session.new):
+        return
+
+    deltas = {}
+    connection = session.connection()
+
+    ids = [obj.id for obj in changed + deleted]
+    for start in range(0, len(ids), 500):
+        query = select(File.user, File.type_class, File.archived, File.size).where(File.id.in_(ids[start:start + 500]))
+        for user, type_class, archived, size in connection.execute(query):
+            StorageUsage.count(deltas, StorageUsage.key(user, type_class, archived), -1, size)
+
+    for obj in list(session.new) + changed:
+        if isinstance(obj, File):
+            StorageUsage.count(deltas, StorageUsage.key(obj.user, obj.type_class, obj.archived), 1, obj.size)
+
+    StorageUsage.apply(connection, deltas)
+
+@event.listens_for(Session, "after_flush")
+def collect_released_hashes(session, flush_context):
+    """
+    Collects the hashes of blobs which a deleted or overwritten File referred to,
+    so that they and their previews can be removed once the transaction is committed.
+    """
+    released = session.info.setdefault("released_hashes", set())
+
+    for obj in session.deleted:
+        if isinstance(obj, File) and obj.hash:
+            released.add(obj.hash)
+
+    for obj in session.dirty:
+        if isinstance(obj, File):
+            released.update(digest for digest in inspect(obj).attrs.hash.history.deleted if digest)
+
+@event.listens_for(Session, "after_commit")
+def purge_released_blobs(session):
+    """
+    Removes the blobs, and their cached previews, that no File refers to anymore.
+    Files share blobs (e.g. copies of a file), so a released hash may still be in use by another file.
+    The hash column is indexed, so the files which still refer to a blob are found without a separate reference count.
+    """
+    released = session.info.pop("released_hashes", None)
+    if not released:
+        return
+
+    # The session cannot emit SQL after committing, so a separate connection is used.
+    with db.engine.connect() as connection:
+        referenced = set(connection.scalars(select(File.hash).where(File.hash.in_(released))))
+
+    for digest in released - referenced:
+        derivatives.purge(digest)
+        blobstore.release(digest)
+
+@event.listens_for(Session, "after_flush")
+def queue_blob_jobs(session, flush_context):
+    """
+    Queues the background work on blobs which a new or changed File refers to, in the same transaction as the file,
+    so that the work is never lost or done for a file which was rolled back:
+        - Rendering the previews of images, so that they are cached before the browser asks for them.
+        - Compressing the blobs of compressible types.
+        - Turning the originals of images with an EXIF orientation upright, only if ORIENT_ORIGINALS is set (see modules/jobs.py).
+    """
+    render = {}
+    compress = {}
+    orient = {}
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, File) or not obj.hash:
+            continue
+        if obj not in session.new and not inspect(obj).attrs.hash.history.added:
+            continue
+
+        if obj.is_image:
+            render[obj.hash] = obj.user
+            if obj.orientation not in (None, imaging.UPRIGHT) and current_app.config.get("ORIENT_ORIGINALS", False):
+                orient[obj.hash] = obj.user
+        elif obj.compressible:
+            compress[obj.hash] = obj.user
+
+    if render:
+        Job.enqueue(session.connection(), Job.RENDER, render, Job.HIGH)
+    if compress:
+        Job.enqueue(session.connection(), Job.COMPRESS, compress, Job.LOW)
+    if orient:
+        Job.enqueue(session.connection(), Job.ORIENT, orient, Job.LOW)
+
+@event.listens_for(Session, "after_rollback")
+def forget_released_hashes(session):
+    session.info.pop("released_hashes", None)
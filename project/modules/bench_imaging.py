@@ -0,0 +1,103 @@
+"""
+Benchmark of preview rendering, comparing a full decode and BICUBIC resample of the original
+(how previews were rendered before) against the reduced-resolution path in imaging.py.
+
+Run from the root directory:
+    python -m project.modules.bench_imaging [directory of JPEGs]
+
+Without a directory, a corpus of large JPEGs (24 megapixels) is generated in a temporary directory.
+For each preset, the average time per image is shown along with the number of pixels that had to be decoded,
+which is what decides the peak memory of a render (about 3 bytes per pixel for RGB).
+"""
+
+import os
+import sys
+from io import BytesIO
+from time import perf_counter
+from tempfile import TemporaryDirectory
+from os.path import join
+
+import PIL
+import PIL.Image
+from PIL import ImageFilter
+
+from . import imaging
+
+CORPUS_SIZE = 6
+CORPUS_DIMS = (6000, 4000)
+
+def make_corpus(directory: str) -> list[str]:
+    """
+    Writes large JPEGs with gradients, detail and some grain, so that they compress like photos rather than flat colours.
+    """
+    paths = []
+    for i in range(CORPUS_SIZE):
+        gradient = PIL.Image.linear_gradient("L").resize(CORPUS_DIMS)
+        detail = PIL.Image.effect_mandelbrot(CORPUS_DIMS, (-2.0 + i * 0.1, -1.2, 1.0, 1.2), 100)
+        grain = PIL.Image.effect_noise(CORPUS_DIMS, 8 + i).filter(ImageFilter.GaussianBlur(1))
+        im = PIL.Image.merge("RGB", (gradient, detail, grain))
+
+        path = join(directory, f"corpus{i}.jpg")
+        im.save(path, format="JPEG", quality=90)
+        paths.append(path)
+
+    return paths
+
+def render_full(source: str, preset: str) -> tuple[bytes, int]:
+    """
+    Renders a preset by decoding the whole image and resampling it in one step.
+    Returns the preview bytes and the number of decoded pixels.
+    """
+    im = PIL.Image.open(source)
+    im.load()
+    decoded = im.size[0] * im.size[1]
+
+    if preset == imaging.THUMBNAIL:
+        size = imaging.cover_size(im.size, imaging.THUMBNAIL_SIZE)
+    else:
+        size = imaging.height_size(im.size, imaging.preset_height(preset, im.size))
+    im_preview = im.resize(size, PIL.Image.Resampling.BICUBIC)
+
+    buffered = BytesIO()
+    im_preview.save(buffered, format="JPEG")
+    return buffered.getvalue(), decoded
+
+def render_reduced(source: str, preset: str) -> tuple[bytes, int]:
+    """
+    Renders a preset with imaging.render, measuring the number of pixels decoded after drafting.
+    """
+    im = PIL.Image.open(source)
+    if preset == imaging.THUMBNAIL:
+        size = imaging.cover_size(im.size, imaging.THUMBNAIL_SIZE)
+    else:
+        size = imaging.height_size(im.size, imaging.preset_height(preset, im.size))
+    imaging.draft(im, size)
+    decoded = im.size[0] * im.size[1]
+
+    return imaging.render(source, preset), decoded
+
+def benchmark(paths: list[str]) -> None:
+    print(f"{len(paths)} image(s)")
+    print(f"{'preset':<10} {'full (ms)':>10} {'reduced (ms)':>13} {'speedup':>8} {'full px':>12} {'reduced px':>12}")
+
+    for preset in imaging.PRESETS:
+        timings = {}
+        pixels = {}
+        for name, function in [("full", render_full), ("reduced", render_reduced)]:
+            start = perf_counter()
+            decoded = 0
+            for path in paths:
+                decoded += function(path, preset)[1]
+            timings[name] = (perf_counter() - start) / len(paths) * 1000
+            pixels[name] = decoded // len(paths)
+
+        print(f"{preset:<10} {timings['full']:>10.1f} {timings['reduced']:>13.1f} {timings['full'] / timings['reduced']:>7.1f}x "
+              f"{pixels['full']:>12,} {pixels['reduced']:>12,}")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        directory = sys.argv[1]
+        benchmark([join(directory, name) for name in sorted(os.listdir(directory)) if name.lower().endswith((".jpg", ".jpeg"))])
+    else:
+        with TemporaryDirectory() as directory:
+            benchmark(make_corpus(directory))
@@ -0,0 +1,407 @@
+"""
+Content-addressed storage for file bytes.
+- BlobStore object
+    -> Stores bytes on disk in a sharded directory tree, keyed by their SHA-256 hash.
+    -> Streams bytes into the store in fixed-size chunks, hashing them as they are written.
+    -> Reads bytes back using mmap.
+    -> Compresses blobs of compressible types, which are then decompressed as they are read.
+    -> Removes blobs which are no longer referenced.
+
+Files share a blob simply by having the same hash, e.g. a copy of a file or an identical upload,
+so a blob is only stored once no matter how many files refer to it. Changing the bytes of one file
+writes a new blob rather than changing the shared one (copy on write), and the old blob is removed
+once the last file referring to it is gone (see models.py).
+
+Blobs live within the instance folder, split into two levels of sub-directories
+so that no single directory holds too many files:
+    instance/blobs/ab/cd/abcdef0123...
+
+Since the key of a blob is the hash of its contents, identical uploads are only stored once.
+
+Blobs are written uncompressed, and those of compressible types (text, code, documents) are compressed afterwards
+with the codec given by the config (see models.py). A compressed blob keeps the hash of its uncompressed bytes,
+and the suffix of its path names its codec:
+    instance/blobs/ab/cd/abcdef0123....gz (zlib, in a gzip stream)
+    instance/blobs/ab/cd/abcdef0123....xz (lzma)
+Both are read as a stream, so a compressed blob is never decompressed into memory all at once.
+Blobs which an image refers to are not compressed, so that they can be opened by path (e.g. by PIL or the image pipeline).
+As blobs are shared by hash, a blob may have been compressed before an image came to refer to it (e.g. an identical upload,
+or a renamed copy), so image readers get their path from image_path, which decompresses the blob again if need be.
+
+Config:
+    BLOB_CODEC: Codec which blobs are compressed with, zlib (default) or lzma. None turns compression off.
+    BLOB_CODEC_LEVEL: Compression level of the codec, 1 to 9 (default 6).
+"""
+
+import os
+import mmap
+import gzip
+import lzma
+import hashlib
+from time import time
+from os.path import join, dirname, exists
+from tempfile import mkstemp
+from contextlib import contextmanager
+
+HASH_ALGORITHM = "sha256"
+CHUNK_SIZE = 1024 * 1024 # Bytes read at a time when streaming into the blob store
+
+# Suffixes of the paths of compressed blobs, by their codec. Uncompressed blobs have no suffix.
+CODECS = {"zlib": ".gz", "lzma": ".xz"}
+# Compressed blobs are only kept if they are at most this fraction of the uncompressed size.
+MIN_SAVING = 0.9
+
+class BlobWriter:
+    """
+    A writable file object which stores bytes into a temporary file while computing their hash and size,
+    so that a blob can be written without ever holding all of its bytes in memory.
+    Once all of the bytes are written, 'commit' moves the file into the blob store under its hash.
+    """
+    def __init__(self, store: "BlobStore"):
+        self.store = store
+        self.size = 0
+        self._hash = hashlib.new(HASH_ALGORITHM)
+        self._committed = None
+
+        handle, self.temp_path = mkstemp(dir=join(store.root, "tmp"))
+        self._file = os.fdopen(handle, "w+b")
+
+    def write(self, data: bytes) -> int:
+        self._file.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        # Werkzeug rewinds a file container after a multipart upload has been written to it.
+        return self._file.seek(offset, whence)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def commit(self) -> tuple[str, int]:
+        """
+        Closes the writer and moves the written bytes into the blob store.
+        If a blob with the same hash already exists, the written bytes are discarded instead.
+
+        Committing again returns the same result, without doing anything.
+
+        Returns the hash of the written bytes and their size.
+        """
+        if self._committed is not None:
+            return self._committed
+
+        self._file.close()
+        digest = self._hash.hexdigest()
+
+        if self.store.touch(digest):
+            os.remove(self.temp_path)
+        else:
+            self.store._commit(self.temp_path, digest)
+
+        self._committed = (digest, self.size)
+        return self._committed
+
+    def discard(self) -> None:
+        self._file.close()
+        if exists(self.temp_path):
+            os.remove(self.temp_path)
+
+class BlobStore:
+    def __init__(self, root: str | None = None):
+        self.root = root
+        self.grace = 0
+        self.codec = None
+        self.level = 6
+
+    def init_app(self, app) -> None:
+        """
+        Sets the root directory of the blob store from the app config,
+        defaulting to 'blobs' within the app's instance folder.
+        """
+        self.root = app.config.setdefault("BLOB_STORE_PATH", join(app.instance_path, "blobs"))
+        # Seconds after a blob is written during which it is not released, see 'release'.
+        self.grace = app.config.setdefault("BLOB_RELEASE_GRACE", 60 * 60)
+        self.codec = app.config.setdefault("BLOB_CODEC", "zlib")
+        self.level = app.config.setdefault("BLOB_CODEC_LEVEL", 6)
+        if self.codec is not None and self.codec not in CODECS:
+            raise ValueError(f"Unknown blob codec: {self.codec}")
+        os.makedirs(join(self.root, "tmp"), exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        """
+        Returns the path of an uncompressed blob on disk from its hash.
+        """
+        return join(self.root, digest[:2], digest[2:4], digest)
+
+    def locate(self, digest: str) -> tuple[str, str | None]:
+        """
+        Returns the path of a blob on disk, compressed or not, along with its codec (None if it is uncompressed).
+        Raises FileNotFoundError if the blob does not exist.
+        """
+        path = self.path(digest)
+        if exists(path):
+            return path, None
+
+        for codec, suffix in CODECS.items():
+            if exists(path + suffix):
+                return path + suffix, codec
+
+        raise FileNotFoundError(path)
+
+    def exists(self, digest: str) -> bool:
+        try:
+            self.locate(digest)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def touch(self, digest: str) -> bool:
+        """
+        Marks a blob as just written, for bytes which were stored again or are about to be referred to by a new file.
+        Returns False if the blob does not exist.
+        """
+        try:
+            os.utime(self.locate(digest)[0])
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, data: bytes) -> tuple[str, int]:
+        """
+        Writes bytes to the blob store if they are not already stored.
+
+        Takes in data<bytes>.
+        Returns the hash of the data and its size in bytes.
+        """
+        digest = hashlib.new(HASH_ALGORITHM, data).hexdigest()
+
+        if not self.touch(digest):
+            # Write to a temporary file first so that a half written blob is never visible under its hash.
+            handle, temp_path = mkstemp(dir=join(self.root, "tmp"))
+            with os.fdopen(handle, "wb") as f:
+                f.write(data)
+            self._commit(temp_path, digest)
+
+        return digest, len(data)
+
+    def writer(self) -> BlobWriter:
+        return BlobWriter(self)
+
+    def put_stream(self, stream, chunk_size: int = CHUNK_SIZE) -> tuple[str, int]:
+        """
+        Writes a readable stream to the blob store, reading it in chunks of chunk_size bytes.
+
+        Returns the hash of the data and its size in bytes.
+        """
+        writer = self.writer()
+        try:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                writer.write(chunk)
+        except BaseException:
+            writer.discard()
+            raise
+
+        return writer.commit()
+
+    def _commit(self, temp_path: str, digest: str) -> None:
+        """
+        Moves a fully written temporary file to its place in the blob store.
+        """
+        path = self.path(digest)
+        os.makedirs(dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+    def compress(self, digest: str) -> bool:
+        """
+        Compresses an uncompressed blob with the configured codec, streaming it through the compressor in chunks.
+        The compressed blob replaces the uncompressed one only if it saves enough space (see MIN_SAVING),
+        so incompressible bytes are left as they are.
+
+        Returns whether the blob was compressed.
+        """
+        path = self.path(digest)
+        if self.codec is None or not exists(path):
+            return False
+
+        handle, temp_path = mkstemp(dir=join(self.root, "tmp"))
+        os.close(handle)
+        try:
+            with open(path, "rb") as source, self._open_codec(temp_path, self.codec, "wb") as target:
+                while True:
+                    chunk = source.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        if os.stat(temp_path).st_size > os.stat(path).st_size * MIN_SAVING:
+            os.remove(temp_path)
+            return False
+
+        # The compressed blob is in place before the uncompressed one is removed, so the blob can always be found.
+        os.replace(temp_path, path + CODECS[self.codec])
+        os.remove(path)
+        return True
+
+    def image_path(self, digest: str) -> str:
+        """
+        Returns the path of the uncompressed blob, for readers which open it by path (e.g. PIL).
+        A compressed blob is decompressed in place first, streaming it through the decompressor in chunks.
+        The path of a blob which does not exist is returned as it is, so that readers fail as they would for any missing file.
+        """
+        try:
+            path, codec = self.locate(digest)
+        except FileNotFoundError:
+            return self.path(digest)
+        if codec is None:
+            return path
+
+        handle, temp_path = mkstemp(dir=join(self.root, "tmp"))
+        try:
+            with self._open_codec(path, codec, "rb") as source, os.fdopen(handle, "wb") as target:
+                while True:
+                    chunk = source.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        # As with compressing, the uncompressed blob is in place before the compressed one is removed.
+        self._commit(temp_path, digest)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Another request decompressed it at the same time.
+            pass
+        return self.path(digest)
+
+    def _open_codec(self, path: str, codec: str, mode: str):
+        if codec == "lzma":
+            return lzma.open(path, mode, preset=self.level if "w" in mode else None)
+        return gzip.open(path, mode, compresslevel=self.level)
+
+    def open(self, digest: str):
+        """
+        Opens a blob for reading as a binary file object. Compressed blobs are decompressed as they are read.
+        """
+        path, codec = self.locate(digest)
+        if codec is None:
+            return open(path, "rb")
+        return self._open_codec(path, codec, "rb")
+
+    def physical_size(self, digest: str) -> int:
+        """
+        Returns the number of bytes a blob takes up on disk, which is less than its size if it is compressed.
+        """
+        return os.stat(self.locate(digest)[0]).st_size
+
+    @contextmanager
+    def view(self, digest: str):
+        """
+        Memory maps a blob for reading, so that only the pages that are accessed are read from disk.
+        Yields a read-only mmap (or empty bytes for empty blobs, which cannot be mapped).
+        Compressed blobs cannot be mapped, so they are decompressed and yielded as bytes instead.
+        """
+        path, codec = self.locate(digest)
+        if codec is not None:
+            with self._open_codec(path, codec, "rb") as f:
+                yield f.read()
+            return
+
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b""
+                return
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+
+    def read(self, digest: str) -> bytes:
+        """
+        Returns the entire contents of a blob as bytes.
+        """
+        with self.view(digest) as mapped:
+            return mapped[:]
+
+    def iter_chunks(self, digest: str, chunk_size: int = CHUNK_SIZE):
+        """
+        Yields the bytes of a blob in chunks of chunk_size bytes, decompressing compressed blobs as they are read.
+        """
+        path, codec = self.locate(digest)
+        if codec is None:
+            with self.view(digest) as mapped:
+                for offset in range(0, len(mapped), chunk_size):
+                    yield mapped[offset:offset + chunk_size]
+            return
+
+        with self._open_codec(path, codec, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def head(self, digest: str, size: int) -> bytes:
+        """
+        Returns the first bytes of a blob, e.g. to check its magic bytes without reading the whole blob.
+        """
+        with self.open(digest) as f:
+            return f.read(size)
+
+    def tail(self, digest: str, size: int) -> bytes:
+        """
+        Returns the last bytes of a blob.
+        Compressed blobs have to be decompressed up to the end, so this is only quick for uncompressed blobs.
+        """
+        path, codec = self.locate(digest)
+        if codec is not None:
+            data = b""
+            for chunk in self.iter_chunks(digest):
+                data = (data + chunk)[-size:]
+            return data
+
+        with open(path, "rb") as f:
+            f.seek(max(os.fstat(f.fileno()).st_size - size, 0))
+            return f.read(size)
+
+    def delete(self, digest: str) -> None:
+        try:
+            os.remove(self.locate(digest)[0])
+        except FileNotFoundError:
+            pass
+
+    def release(self, digest: str) -> bool:
+        """
+        Deletes a blob which no file refers to anymore, unless it was written within the grace period.
+        Bytes are stored before the file which refers to them is committed (e.g. while an upload streams in),
+        so a recently written blob may be about to be referred to by a new file with the same content.
+
+        Returns whether the blob was deleted.
+        """
+        try:
+            path = self.locate(digest)[0]
+            if time() - os.stat(path).st_mtime < self.grace:
+                return False
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def digests(self):
+        """
+        Iterates over the hashes of every blob in the store, compressed or not.
+        """
+        for first in os.listdir(self.root):
+            if first == "tmp":
+                continue
+            for second in os.listdir(join(self.root, first)):
+                for name in os.listdir(join(self.root, first, second)):
+                    yield name.split(".")[0]
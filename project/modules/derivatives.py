@@ -0,0 +1,103 @@
+"""
+Persistent on-disk cache of image previews (derivatives).
+- DerivativeCache object
+    -> Reads the cached preview of a blob for a preset.
+    -> Renders and stores a preview the first time it is requested.
+    -> Removes every preview of a blob once no file refers to it anymore.
+    -> Removes previews which were rendered by an older version of imaging.py.
+
+Previews are keyed by the hash of the original, the name of the preset and the version of the previews (see imaging.py),
+so a preview is only ever rendered once, no matter how many files share the same bytes:
+    instance/derivatives/ab/abcdef0123...-gallery-v2
+Previews of an image with edits (see edits.py) are also keyed by the hash of its edits, and so are its full size exports:
+    instance/derivatives/ab/abcdef0123...-0f1e2d3c4b5a6978-export-v2
+When previews are rendered differently (imaging.PREVIEW_VERSION is increased), the old previews are no longer read,
+and are rendered again when they are next requested. 'flask sweep-derivatives' removes the old previews from disk.
+"""
+
+import os
+from os.path import join, dirname, exists
+from tempfile import mkstemp
+
+from . import imaging
+from .edits import edits_hash
+
+class DerivativeCache:
+    def __init__(self, root: str | None = None):
+        self.root = root
+
+    def init_app(self, app) -> None:
+        """
+        Sets the root directory of the cache from the app config,
+        defaulting to 'derivatives' within the app's instance folder.
+        """
+        self.root = app.config.setdefault("DERIVATIVE_CACHE_PATH", join(app.instance_path, "derivatives"))
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, digest: str, preset: str, edits: list[dict] | None = None) -> str:
+        key = digest if not edits else f"{digest}-{edits_hash(edits)}"
+        return join(self.root, digest[:2], f"{key}-{preset}-v{imaging.PREVIEW_VERSION}")
+
+    def get(self, digest: str, preset: str, edits: list[dict] | None = None) -> bytes | None:
+        """
+        Returns the cached preview of a blob with the given edits, or None if it has not been rendered yet.
+        """
+        try:
+            with open(self.path(digest, preset, edits), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, digest: str, preset: str, data: bytes, edits: list[dict] | None = None) -> None:
+        path = self.path(digest, preset, edits)
+        os.makedirs(dirname(path), exist_ok=True)
+
+        # Previews may be rendered by several requests at once, so they are written to a temporary file first.
+        handle, temp_path = mkstemp(dir=dirname(path))
+        with os.fdopen(handle, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def render(self, digest: str, preset: str, source, edits: list[dict] | None = None) -> bytes:
+        """
+        Returns the preview of a blob for a preset, rendering and caching it if it is not cached yet.
+
+        Takes in the hash of the blob, the name of the preset, the source image as a path or file object
+        and the edits of the image, if any.
+        """
+        data = self.get(digest, preset, edits)
+        if data is None:
+            data = imaging.render(source, preset, edits)
+            self.put(digest, preset, data, edits)
+
+        return data
+
+    def purge(self, digest: str) -> None:
+        """
+        Removes every cached preview of a blob, with any edits and of every version.
+        """
+        directory = join(self.root, digest[:2])
+        if not exists(directory):
+            return
+
+        for entry in os.scandir(directory):
+            if entry.name.startswith(f"{digest}-"):
+                os.remove(entry.path)
+
+    def sweep(self) -> int:
+        """
+        Removes the previews rendered by older versions of imaging.py. Returns the number of previews removed.
+        """
+        suffix = f"-v{imaging.PREVIEW_VERSION}"
+
+        removed = 0
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                # Temporary files of previews which are being written are left alone.
+                if "-" in entry.name and not entry.name.startswith("tmp") and not entry.name.endswith(suffix):
+                    os.remove(entry.path)
+                    removed += 1
+
+        return removed
@@ -0,0 +1,150 @@
+"""
+Non-destructive edits of images, kept as a list of operations on each File (see models.py)
+and applied when a preview or an export of the image is rendered (see imaging.py).
+
+Operations are applied in order, to the image as it is shown (after its EXIF orientation):
+    - {'op': 'rotate', 'degrees': 90 | 180 | 270}: rotates the image clockwise.
+    - {'op': 'flip', 'direction': 'horizontal' | 'vertical'}: mirrors the image.
+    - {'op': 'crop', 'box': [left, top, right, bottom]}: crops the image to a box given as fractions (0 to 1)
+      of its width and height, so a crop is the same whatever scale the image is decoded at.
+    - {'op': 'resize', 'width': int, 'height': int}: resizes the image. Either side may be left out to keep the aspect ratio.
+    - {'op': 'quality', 'preset': 'high' | 'medium' | 'low'}: the JPEG quality the result is encoded at.
+
+Editing an image only changes its list of operations, so the original blob is never re-encoded or rewritten.
+Every render starts from the original, so repeated edits never compound the loss of JPEG encoding.
+Renders are cached under the hash of the original and the hash of the operations (see edits_hash),
+so files which share a blob and have the same edits share their previews.
+"""
+
+import json
+import hashlib
+from math import ceil
+
+import PIL
+import PIL.Image
+from PIL.Image import Transpose
+
+ROTATIONS = {90: Transpose.ROTATE_270, 180: Transpose.ROTATE_180, 270: Transpose.ROTATE_90}
+FLIPS = {"horizontal": Transpose.FLIP_LEFT_RIGHT, "vertical": Transpose.FLIP_TOP_BOTTOM}
+QUALITY_PRESETS = {"high": 95, "medium": 85, "low": 70}
+
+MAX_EDITS = 64 # Operations kept for one image
+MAX_DIMENSION = 10000 # Largest width or height an image may be resized to
+
+def validate(edits: list) -> list[dict]:
+    """
+    Checks a list of operations given by a client.
+
+    Returns the operations with only their known keys, in the form they are stored in.
+    Raises ValueError if an operation is unknown or its parameters are invalid.
+    """
+    if not isinstance(edits, list) or len(edits) > MAX_EDITS:
+        raise ValueError(f"Edits must be a list of at most {MAX_EDITS} operations.")
+
+    valid = []
+    for edit in edits:
+        op = edit.get("op") if isinstance(edit, dict) else None
+
+        if op == "rotate" and edit.get("degrees") in ROTATIONS:
+            valid.append({"op": op, "degrees": edit["degrees"]})
+
+        elif op == "flip" and edit.get("direction") in FLIPS:
+            valid.append({"op": op, "direction": edit["direction"]})
+
+        elif op == "crop" and _valid_box(edit.get("box")):
+            valid.append({"op": op, "box": [float(value) for value in edit["box"]]})
+
+        elif op == "resize" and _valid_resize(edit):
+            valid.append({"op": op, **{side: int(edit[side]) for side in ["width", "height"] if edit.get(side)}})
+
+        elif op == "quality" and edit.get("preset") in QUALITY_PRESETS:
+            valid.append({"op": op, "preset": edit["preset"]})
+
+        else:
+            raise ValueError(f"Invalid edit: {edit}")
+
+    return valid
+
+def _is_number(value) -> bool:
+    # bool is a subclass of int, but True and False are not sizes.
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _valid_box(box) -> bool:
+    if not isinstance(box, list) or len(box) != 4 or not all(_is_number(value) for value in box):
+        return False
+
+    left, top, right, bottom = box
+    return 0 <= left < right <= 1 and 0 <= top < bottom <= 1
+
+def _valid_resize(edit: dict) -> bool:
+    sides = [edit.get(side) for side in ["width", "height"] if edit.get(side) is not None]
+    return bool(sides) and all(
+        isinstance(side, int) and not isinstance(side, bool) and 0 < side <= MAX_DIMENSION for side in sides
+    )
+
+def edits_hash(edits: list[dict] | None) -> str | None:
+    """
+    Returns a short hash of a list of operations, or None if there are none (the image as it was uploaded).
+    """
+    if not edits:
+        return None
+
+    return hashlib.sha256(json.dumps(edits, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def quality(edits: list[dict] | None) -> int | None:
+    """
+    Returns the JPEG quality chosen by the last quality operation, or None to encode at the default quality.
+    """
+    presets = [edit["preset"] for edit in edits or [] if edit["op"] == "quality"]
+    return QUALITY_PRESETS[presets[-1]] if presets else None
+
+def resizes(edits: list[dict] | None) -> bool:
+    return any(edit["op"] == "resize" for edit in edits or [])
+
+def _crop_box(size: tuple[int], box: list[float]) -> tuple[int]:
+    """
+    Returns a crop box in pixels from a box in fractions of the size, at least one pixel wide and high.
+    """
+    left, top = int(box[0] * size[0]), int(box[1] * size[1])
+    right = max(ceil(box[2] * size[0]), left + 1)
+    bottom = max(ceil(box[3] * size[1]), top + 1)
+    return (left, top, min(right, size[0]), min(bottom, size[1]))
+
+def _resize_size(size: tuple[int], edit: dict) -> tuple[int]:
+    width, height = edit.get("width"), edit.get("height")
+    if width is None:
+        width = max(size[0] * height // size[1], 1)
+    elif height is None:
+        height = max(size[1] * width // size[0], 1)
+    return (width, height)
+
+def edited_size(size: tuple[int], edits: list[dict] | None) -> tuple[int]:
+    """
+    Returns the size of an image of the given size once the operations are applied, without touching any pixels.
+    """
+    for edit in edits or []:
+        if edit["op"] == "rotate" and edit["degrees"] != 180:
+            size = (size[1], size[0])
+        elif edit["op"] == "crop":
+            left, top, right, bottom = _crop_box(size, edit["box"])
+            size = (right - left, bottom - top)
+        elif edit["op"] == "resize":
+            size = _resize_size(size, edit)
+
+    return size
+
+def apply(im: PIL.Image.Image, edits: list[dict] | None) -> PIL.Image.Image:
+    """
+    Applies the operations to an image, returning the edited image.
+    """
+    for edit in edits or []:
+        if edit["op"] == "rotate":
+            im = im.transpose(ROTATIONS[edit["degrees"]])
+        elif edit["op"] == "flip":
+            im = im.transpose(FLIPS[edit["direction"]])
+        elif edit["op"] == "crop":
+            im = im.crop(_crop_box(im.size, edit["box"]))
+        elif edit["op"] == "resize":
+            im = im.resize(_resize_size(im.size, edit), PIL.Image.Resampling.BICUBIC)
+
+    return im
@@ -0,0 +1,138 @@
+"""
+In-process publish/subscribe of progress events, which are pushed to the browser by the '/events' route (Server-Sent Events).
+- EventBus object
+    -> Keeps a bounded buffer of events for each subscriber (an open '/events' stream) of each user.
+    -> Publishes an event to every subscriber of a user, dropping the oldest buffered events of a subscriber which has fallen behind.
+- Progress object
+    -> Reports the progress of one long operation (an upload, a zip download or a bulk deletion) as it goes,
+       at most once every PROGRESS_INTERVAL seconds, and once more when it is finished.
+
+Progress events carry running totals rather than increments, so dropping an old event from a full buffer loses nothing
+that the next event does not repeat. Publishing for a user with no subscribers returns straight away,
+so the code paths which report progress cost next to nothing when nobody is watching.
+
+Events only reach the subscribers of the same server process.
+
+Config:
+    EVENT_BUFFER_SIZE: Number of events buffered for each subscriber (default 64).
+"""
+
+from collections import deque
+from threading import Lock, Condition
+from time import monotonic
+
+PROGRESS_INTERVAL = 0.25 # Seconds between progress events of one operation
+
+def operation_id(request) -> str | None:
+    """
+    Returns the id of the operation which the client gave a request, in the X-Operation header or the 'operation' query parameter,
+    so that the client can tell which progress events are about that request.
+    """
+    return request.headers.get("X-Operation") or request.args.get("operation")
+
+class Subscriber:
+    """
+    The buffer of events for one open event stream.
+    """
+    def __init__(self, size: int):
+        # Once the buffer is full, appending an event drops the oldest one.
+        self.events = deque(maxlen=size)
+        self.condition = Condition()
+
+    def push(self, event: tuple[str, dict]) -> None:
+        with self.condition:
+            self.events.append(event)
+            self.condition.notify()
+
+    def pop_all(self, timeout: float) -> list[tuple[str, dict]]:
+        """
+        Returns every buffered event, waiting up to timeout seconds for one if the buffer is empty.
+        """
+        with self.condition:
+            if not self.events:
+                self.condition.wait(timeout)
+            events = list(self.events)
+            self.events.clear()
+            return events
+
+class EventBus:
+    def __init__(self):
+        self.buffer_size = 64
+        self._subscribers = {}
+        self._lock = Lock()
+
+    def init_app(self, app) -> None:
+        self.buffer_size = app.config.setdefault("EVENT_BUFFER_SIZE", 64)
+
+    def subscribe(self, user: str) -> Subscriber:
+        subscriber = Subscriber(self.buffer_size)
+        with self._lock:
+            self._subscribers.setdefault(user, []).append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user: str, subscriber: Subscriber) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(user, [])
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            if not subscribers:
+                self._subscribers.pop(user, None)
+
+    def watched(self, user: str) -> bool:
+        """
+        Returns whether the user has any open event streams.
+        """
+        return user in self._subscribers
+
+    def publish(self, user: str, event: str, data: dict) -> None:
+        """
+        Sends an event to every open event stream of a user.
+
+        Takes in the username, the type of the event (e.g. 'upload') and its data as a dict which can be serialised as JSON.
+        """
+        subscribers = self._subscribers.get(user)
+        if not subscribers:
+            return
+
+        for subscriber in list(subscribers):
+            subscriber.push((event, data))
+
+    def progress(self, user: str, event: str, operation: str | None, **totals) -> "Progress":
+        return Progress(self, user, event, operation, totals)
+
+class Progress:
+    """
+    Reports the progress of one operation of a user as events of the given type.
+    Each event has the id of the operation (given by the client, so it can tell its own operations apart),
+    the running counts given to 'update', any totals given at the start, and whether the operation is done.
+    """
+    def __init__(self, bus: EventBus, user: str, event: str, operation: str | None, totals: dict):
+        self.bus = bus
+        self.user = user
+        self.event = event
+        self.data = {"operation": operation, **totals, "done": False}
+        self._last = 0
+
+    def update(self, **counts) -> None:
+        """
+        Sets the running counts of the operation, e.g. update(bytes=1024), publishing them if PROGRESS_INTERVAL has passed.
+        """
+        self.data.update(counts)
+
+        now = monotonic()
+        if now - self._last >= PROGRESS_INTERVAL and self.bus.watched(self.user):
+            self._last = now
+            self.bus.publish(self.user, self.event, dict(self.data))
+
+    def add(self, **counts) -> None:
+        """
+        Adds to the running counts of the operation, e.g. add(bytes=len(chunk)).
+        """
+        self.update(**{key: self.data.get(key, 0) + value for key, value in counts.items()})
+
+    def finish(self, **counts) -> None:
+        """
+        Publishes the final counts of the operation, marking it as done.
+        """
+        self.data.update(counts, done=True)
+        self.bus.publish(self.user, self.event, dict(self.data))
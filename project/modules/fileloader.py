@@ -1,23 +1,38 @@
 """
 Methods for loading images, file data, thumbnails, or searching for a file within a user's file store.
 - FileLoader object
-    -> Load images
-    -> Load file thumbnails (allows both images and files)
-    -> Search a given user for a file name.
+    -> Load one page of images or file thumbnails at a time, sorted by the database (see FileLoader.load_page).
+    -> Listings are filtered by the database (see FileLoader.query), so only the files which are shown are loaded.
+    -> Image previews are given as URLs, which the browser fetches and caches.
+    -> Search a given user for a file name, or for many file names in one query.
 """
 
 from flask_login import current_user
+from sqlalchemy import type_coerce, JSON, and_, or_
 
-from ..models import User, File
+from ..models import User, File, FILE_SRC, PROPERTY_COLUMNS
+from .imaging import THUMBNAIL
 
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
 from time import perf_counter
-from threading import Thread
-
-IMAGES = "images"
-FILES = "files"
 
 IMAGE_EXTENSIONS = [".JPEG", ".JPG", ".PNG", ".GIF"]
 
+# Most file names to look up in a single IN (...) query, which stays within the database's limit of bound parameters.
+SEARCH_BATCH_SIZE = 500
+
+# Columns which listings can be sorted by. Each has an index on (user, archived, column), see models.py.
+SORT_COLUMNS = {
+    "name": File.name,
+    "size": File.size,
+    "date_uploaded": File.date_uploaded,
+    "date_taken": File.date_taken,
+    "type": File.mimetype,
+}
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
 def timer(func):
     """
     Time how long a method takes. Output is in the terminal.
@@ -29,45 +44,103 @@ def timer(func):
         return data
     return wrapper
 
+def property_filter(key: str, value):
+    """
+    Returns an SQL condition that a file's property has the given value, where a value of None means the property is not set.
+    Properties with their own column are compared on the column, and any others within the properties JSON.
+    """
+    if key in PROPERTY_COLUMNS:
+        column = getattr(File, key)
+        if key == "archived":
+            return column == bool(value)
+    else:
+        element = type_coerce(File.properties, JSON)[key]
+        if isinstance(value, bool):
+            column = element.as_boolean()
+        elif isinstance(value, int):
+            column = element.as_integer()
+        else:
+            column = element.as_string()
+
+    if value is None:
+        return column == None
+    return column == value
+
+def encode_cursor(value, file_id: int) -> str:
+    """
+    Returns the cursor of a listing page, which holds the sort value and id of the last file on the page.
+    """
+    return urlsafe_b64encode(json.dumps([value, file_id]).encode("utf-8")).decode("utf-8")
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Returns the sort value and id held by a cursor. Raises ValueError if the cursor is not valid.
+    """
+    try:
+        value, file_id = json.loads(urlsafe_b64decode(cursor.encode("utf-8")))
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+    # The value is given to the database as a bind parameter, so it must be a single value rather than a list or dict.
+    if not isinstance(file_id, int) or isinstance(file_id, bool) or not isinstance(value, (str, int, float, type(None))):
+        raise ValueError("Invalid cursor")
+    return value, file_id
+
+def after_cursor(column, descending: bool, value, file_id: int):
+    """
+    Returns an SQL condition for the files which come after a cursor, when sorted by a column and then by id (keyset pagination).
+    Files without a value sort before every other file, as the database sorts NULL first in ascending order.
+    """
+    after_id = File.id < file_id if descending else File.id > file_id
+
+    if value is None:
+        if descending:
+            return and_(column == None, after_id)
+        return or_(and_(column == None, after_id), column != None)
+
+    beyond = column < value if descending else column > value
+    condition = or_(beyond, and_(column == value, after_id))
+    if descending:
+        return or_(condition, column == None)
+    return condition
+
 class FileLoader:
-    images = []
-    @timer
-    def load(self, **keys):
-        threads = []
+    def __init__(self):
+        # The files loaded by this loader. Kept per instance, as a list on the class would be shared by every request.
+        self.images = []
 
-        user_images = File.query.filter(File.user == current_user.username).all()
+    def query(self, _type: str | None = None, archived: bool = False, **keys):
+        """
+        Returns a query of the current user's files, which is filtered by the database rather than in Python.
 
-        user_images = [image for image in user_images if image.is_image]
-        
-        def _load_image(image: File):
-            if image.extension == ".GIF":
-                self.images[f"{image.id}:{image.name}"] = image.first_frame
-            else:
-                self.images[f"{image.id}:{image.name}"] = image.resize(height=240)
+        Takes in the type class of the files (IMAGES, FILES, or None for all files), whether the files are archived,
+        and any other properties which the files must have.
+        """
+        query = File.query.filter(File.user == current_user.username, File.archived == archived)
 
-        self.images = {}
-        for image in user_images:
-            for key in keys:
-                if image.get_property(key) != keys[key]:
-                    break
-            else:
-                threads.append(Thread(target=_load_image, args=(image,)))
+        if _type is not None:
+            query = query.filter(File.type_class == _type)
 
-        for thread in threads:
-            thread.start()
+        for key in keys:
+            query = query.filter(property_filter(key, keys[key]))
 
-        for thread in threads:
-            thread.join()
+        return query
 
-        return self.images
+    def _previews(self, files: list[File], preset: str) -> dict[int, str]:
+        """
+        Returns the URLs of the previews of image files for a preset, keyed by file id.
+        Nothing is rendered here: the browser requests the URLs in parallel, and any previews missing
+        from the derivative cache are rendered by the image pipeline as they are requested (see images.py).
+        """
+        return {file.id: file.preview_url(preset) for file in files}
 
-    def load_thumbnail(self, file):
+    def load_thumbnail(self, file, src: str | None = None):
         file_json = {
             "name": file.name,
             "date_uploaded": file.get_property("date_uploaded"),
             "type": file.type,
             "size": file.size,
-            "src": file.thumbnail
+            "src": src or file.thumbnail
         }
         if file.is_image:
             file_json["date_taken"] = file.date
@@ -76,75 +149,74 @@ class FileLoader:
         return file_json
         
     @timer
-    def load_thumbnails(self, _type=None, archived: bool = False):
-        threads = []
+    def load_page(self, _type: str | None = None, archived: bool = False, sort: str = "name", descending: bool = False,
+                  cursor: str | None = None, limit: int = PAGE_SIZE, preset: str = THUMBNAIL) -> tuple[list[dict], str | None]:
+        """
+        Loads one page of the current user's files, sorted by the database.
+        Pages are found by keyset: the next page starts after the sort value and id of the last file on this one,
+        so each page takes the same time to load no matter how far into the listing it is.
 
-        files = File.query.filter_by(user=current_user.username).all()
+        Takes in the type class (IMAGES, FILES, or None for all files), whether the files are archived,
+        the column to sort by (a key of SORT_COLUMNS), the direction, the cursor given with the previous page,
+        the number of files per page, and the preset of the image previews.
 
-        if archived:
-            files = [file for file in files if file.get_property("archived")]
-        else:
-            files = [file for file in files if not file.get_property("archived")]
+        Returns the file data of the page, and the cursor of the next page (None if this is the last page).
+        Raises ValueError if the sort or cursor are not valid.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort by {sort}")
+        column = SORT_COLUMNS[sort]
 
-        if _type == IMAGES:
-            files = [file for file in files if file.extension in IMAGE_EXTENSIONS]
-        elif _type == FILES:
-            files = [file for file in files if file.extension not in IMAGE_EXTENSIONS]
-        # If type is None -> all files
+        query = self.query(_type, archived)
+        if cursor:
+            query = query.filter(after_cursor(column, descending, *decode_cursor(cursor)))
 
-        self.images = []
-        for file in files:
-            threads.append(Thread(target=self.load_thumbnail, args=(file,)))
+        if descending:
+            query = query.order_by(column.desc(), File.id.desc())
+        else:
+            query = query.order_by(column, File.id)
 
-        for thread in threads:
-            thread.start()
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        files = query.limit(limit + 1).all()
 
-        for thread in threads:
-            thread.join()
-            
-        return self.images
+        next_cursor = None
+        if len(files) > limit:
+            files = files[:limit]
+            next_cursor = encode_cursor(getattr(files[-1], column.key), files[-1].id)
 
-    def _binary_search(self, filenames: list[str], name: str, low_index: int, high_index: int):
-        """
-        Recursively accesses the middle value of a list of filenames and compares it with the name that is being searched,
-        until the name is either found, in which case the method returns the index of the name,
-        or returns None if the name is not found.
+        previews = self._previews([file for file in files if file.is_image], preset)
 
-        Takes in a list of file names in the same order as the original files list,
-        the name that is being searched, and the lower and highest indices of the lists.
+        self.images = []
+        for file in files:
+            self.load_thumbnail(file, previews.get(file.id, FILE_SRC))
+
+        return self.images, next_cursor
 
-        Returns None or <int>
-        """
-        # print(filenames[low_index:high_index], name, low_index, high_index)
-        if low_index > high_index:
-            return None
-        else:
-            middle_index = (high_index + low_index) // 2
-
-            if name == filenames[middle_index]:
-                return middle_index
-            
-            elif name > filenames[middle_index]:
-                return self._binary_search(filenames, name, middle_index + 1, high_index)
-            
-            else:
-                return self._binary_search(filenames, name, low_index, middle_index - 1)
-        
     def search(self, name: str, user: User):
         """
-        Searches the given user's files for a file name using the binary search algorithm [O(log n)].
+        Searches the given user's files for a file name, using the unique index on (user, name).
         The file name given is case-sensitive
         
         Takes in the file name as a string, and a user which must be a User object (found in models.py).
 
         Returns the File object if found, and returns None if the file is not found.
         """
-        files = user.files.copy()
-        filenames = [file.name for file in files]
+        return user.files.filter(File.name == name).first()
 
-        file_index = self._binary_search(filenames, name, 0, len(filenames) - 1)
+    def search_many(self, names: list[str], user: User) -> dict[str, File]:
+        """
+        Searches the given user's files for many file names at once, with one IN (...) query per batch of names.
 
-        if file_index == None:
-            return None
-        
-        return files[file_index]
\ No newline at end of file
+        Takes in a list of file names as strings, and a user which must be a User object (found in models.py).
+
+        Returns a dict of the File objects which were found keyed by their names. Names which were not found are left out.
+        """
+        names = list(dict.fromkeys(names))
+
+        files = {}
+        for start in range(0, len(names), SEARCH_BATCH_SIZE):
+            batch = names[start:start + SEARCH_BATCH_SIZE]
+            for file in user.files.filter(File.name.in_(batch)):
+                files[file.name] = file
+
+        return files
@@ -0,0 +1,117 @@
+"""
+Set-based operations on many of a user's files at once, e.g. archiving, restoring or deleting a selection.
+    - The file names are resolved in one query (per batch of names, see SEARCH_BATCH_SIZE).
+    - The change is applied with one UPDATE or DELETE statement, rather than loading and changing each File.
+    - The session is committed once, however many files are changed.
+    - The storage usage counters are updated in the same transaction, as statements skip the flush events which do so.
+Each operation returns the names which were not found, so the routes can report them back per file.
+The number of files changed so far can be reported after each batch, as progress events (see events.py).
+
+New bulk operations (e.g. moving or tagging files) can be built on update(), which sets any columns of the files.
+"""
+
+from sqlalchemy import select, update as update_statement, delete as delete_statement
+
+from .. import db
+from ..models import User, File, StorageUsage
+from .fileloader import SEARCH_BATCH_SIZE
+from .events import Progress
+
+def batches(items: list, size: int = SEARCH_BATCH_SIZE):
+    """
+    Yields the items in lists of at most the given size, to stay within the database's limit of bound parameters.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def resolve(names: list[str], user: User) -> tuple[dict, list[str]]:
+    """
+    Finds the given file names among the user's files.
+
+    Takes in a list of file names as strings, and a user which must be a User object (found in models.py).
+
+    Returns a dict of rows of each file found keyed by its name, with the columns id, hash, size, type_class and archived,
+    and the list of names which were not found.
+    """
+    names = list(dict.fromkeys(names))
+
+    found = {}
+    for batch in batches(names):
+        query = (
+            select(File.name, File.id, File.hash, File.size, File.type_class, File.archived)
+            .where(File.user == user.username, File.name.in_(batch))
+        )
+        for row in db.session.execute(query):
+            found[row.name] = row
+
+    missing = [name for name in names if name not in found]
+    return found, missing
+
+def update(names: list[str], user: User, progress: Progress | None = None, **values) -> list[str]:
+    """
+    Sets columns of the named files to the given values, e.g. update(names, user, archived=True).
+    The number of files changed so far is reported to the progress, if one is given.
+
+    Returns the names which were not found.
+    """
+    found, missing = resolve(names, user)
+
+    deltas = {}
+    for row in found.values():
+        StorageUsage.count(deltas, StorageUsage.key(user.username, row.type_class, row.archived), -1, row.size)
+        StorageUsage.count(deltas, StorageUsage.key(
+            user.username, values.get("type_class", row.type_class), values.get("archived", row.archived)
+        ), 1, values.get("size", row.size))
+
+    ids = [row.id for row in found.values()]
+    for start, batch in enumerate(batches(ids)):
+        db.session.execute(update_statement(File).where(File.id.in_(batch)).values(**values))
+        if progress:
+            progress.update(files=start * SEARCH_BATCH_SIZE + len(batch))
+    StorageUsage.apply(db.session.connection(), deltas)
+    db.session.commit()
+
+    if progress:
+        progress.finish(files=len(ids), missing=len(missing))
+
+    return missing
+
+def archive(names: list[str], user: User, progress: Progress | None = None) -> list[str]:
+    """
+    Archives the named files, moving them to recently deleted. Returns the names which were not found.
+    """
+    return update(names, user, progress, archived=True)
+
+def restore(names: list[str], user: User, progress: Progress | None = None) -> list[str]:
+    """
+    Restores the named files from recently deleted. Returns the names which were not found.
+    """
+    return update(names, user, progress, archived=False)
+
+def delete(names: list[str], user: User, progress: Progress | None = None) -> list[str]:
+    """
+    Permanently deletes the named files. Returns the names which were not found.
+    """
+    found, missing = resolve(names, user)
+
+    # A DELETE statement skips the flush events which collect the blobs that files let go of,
+    # so their hashes are added here and their previews are removed once the transaction is committed (see models.py).
+    released = db.session.info.setdefault("released_hashes", set())
+    released.update(row.hash for row in found.values() if row.hash)
+
+    deltas = {}
+    for row in found.values():
+        StorageUsage.count(deltas, StorageUsage.key(user.username, row.type_class, row.archived), -1, row.size)
+
+    ids = [row.id for row in found.values()]
+    for start, batch in enumerate(batches(ids)):
+        db.session.execute(delete_statement(File).where(File.id.in_(batch)))
+        if progress:
+            progress.update(files=start * SEARCH_BATCH_SIZE + len(batch))
+    StorageUsage.apply(db.session.connection(), deltas)
+    db.session.commit()
+
+    if progress:
+        progress.finish(files=len(ids), missing=len(missing))
+
+    return missing
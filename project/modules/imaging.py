@@ -0,0 +1,267 @@
+"""
+Renders downsized previews (derivatives) of image files.
+
+Each preview is described by a preset:
+    - thumbnail: 32x32 square crop, shown in the file lists.
+    - gallery: 240px high, shown in the gallery.
+    - viewer: half of the original height (at most 1280px), shown in the gallery viewer.
+An image with edits (see edits.py) can also be rendered at full size (export), which is not a preview preset.
+
+The functions take in the source image as a path or a file object and return the encoded bytes,
+so they do not depend on the database or the app.
+PNG sources are rendered as PNG, GIFs as a PNG of their first frame, and everything else as JPEG.
+
+Downscaling takes the cheapest path for the output size: JPEGs are decoded at a reduced scale in the DCT domain
+(Image.draft), images are then reduced by an integer factor (Image.reduce), and only the last step uses a BICUBIC
+resample. PNGs and GIFs cannot be decoded at a reduced scale, so they are decoded in full.
+
+Originals are stored as they were uploaded, along with their EXIF orientation (rotated and/or mirrored).
+Previews are sized for the image as it is shown, and the orientation is applied to the downscaled preview
+with ImageOps.exif_transpose, so turning an image costs a few thousand pixels rather than re-encoding the original.
+Images with edits are turned upright before the edits are applied, as edits are made to the image as it is shown.
+"""
+
+from io import BytesIO
+from math import ceil
+from base64 import b64encode
+
+import PIL
+import PIL.Image
+from PIL import ImageOps
+
+from . import edits as image_edits
+
+THUMBNAIL = "thumbnail"
+GALLERY = "gallery"
+VIEWER = "viewer"
+
+PRESETS = [THUMBNAIL, GALLERY, VIEWER]
+EXPORT = "export" # The full size image with its edits applied
+
+THUMBNAIL_SIZE = 32
+GALLERY_HEIGHT = 240
+VIEWER_MAX_HEIGHT = 1280
+
+PNG_SIGNATURE = b"\x89PNG"
+
+# Part of the URL of every preview, which browsers cache forever. Increase it when previews are rendered differently,
+# so that browsers fetch the new previews instead of reusing their cached ones.
+PREVIEW_VERSION = 2
+
+# Images are only reduced cheaply (DCT scaling or Image.reduce) down to this many times the output size,
+# so that the final BICUBIC resample still has enough pixels to keep previews sharp.
+REDUCING_GAP = 2
+
+# Modes which Image.reduce cannot average, and the mode each is converted to first.
+REDUCE_CONVERSIONS = {
+    "P": lambda im: "RGBA" if "transparency" in im.info or im.palette.mode == "RGBA" else "RGB",
+    "1": lambda im: "L",
+}
+
+ORIENTATION_TAG = 0x0112
+UPRIGHT = 1
+# EXIF orientations which turn the image a quarter, so that its width and height are swapped when it is shown.
+TRANSPOSED_ORIENTATIONS = [5, 6, 7, 8]
+
+def exif_orientation(im: PIL.Image.Image) -> int:
+    """
+    Returns the EXIF orientation of an image, 1 (upright) to 8. Only the header of the image is read.
+    """
+    orientation = im.getexif().get(ORIENTATION_TAG, UPRIGHT)
+    return orientation if orientation in range(1, 9) else UPRIGHT
+
+def oriented_size(size: tuple[int], orientation: int) -> tuple[int]:
+    """
+    Returns the size of an image as it is shown, after its EXIF orientation is applied.
+    The same function turns the size as shown back into the size of the stored image.
+    """
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        return (size[1], size[0])
+    return size
+
+def preset_height(preset: str, dims: tuple[int]) -> int:
+    """
+    Returns the height of a preset for an image of the given dimensions.
+    """
+    if preset == THUMBNAIL:
+        return THUMBNAIL_SIZE
+    elif preset == GALLERY:
+        return GALLERY_HEIGHT
+    elif preset == VIEWER:
+        return max(min(VIEWER_MAX_HEIGHT, dims[1] // 2), 1)
+
+    raise ValueError(f"Unknown preset: {preset}")
+
+def height_size(dims: tuple[int], height: int) -> tuple[int]:
+    """
+    Returns the size of an image scaled to the given height, keeping the same aspect ratio.
+    """
+    return (max(int(dims[0] * height // dims[1]), 1), height)
+
+def cover_size(dims: tuple[int], size: int) -> tuple[int]:
+    """
+    Returns the size of an image scaled so that its shortest side is the given size, keeping the same aspect ratio.
+    """
+    # Portrait
+    if dims[1] > dims[0]:
+        return (size, int(dims[1] * size // dims[0]))
+
+    # Landscape
+    return (int(dims[0] * size // dims[1]), size)
+
+def draft(im: PIL.Image.Image, size: tuple[int]) -> None:
+    """
+    Asks the JPEG decoder to decode the image at a reduced scale (1/2, 1/4 or 1/8), in the DCT domain,
+    while staying at least REDUCING_GAP times as large as the given size.
+    Must be called before the image is loaded. Other formats are not affected and are decoded in full.
+    """
+    if im.format == "JPEG":
+        im.draft(im.mode, (size[0] * REDUCING_GAP, size[1] * REDUCING_GAP))
+
+def downscale(im: PIL.Image.Image, size: tuple[int], sampling = PIL.Image.Resampling.BICUBIC) -> PIL.Image.Image:
+    """
+    Downscales an image to the given size by the cheapest path:
+    first by an integer factor with Image.reduce (averaging blocks of pixels),
+    and then resampling the rest of the way, from REDUCING_GAP times the size at most.
+    """
+    factor = min(im.size[0] // (size[0] * REDUCING_GAP), im.size[1] // (size[1] * REDUCING_GAP))
+    if factor >= 2:
+        if im.mode in REDUCE_CONVERSIONS:
+            # Palette and bilevel images cannot be averaged, so they are converted to RGB(A) first.
+            im = im.convert(REDUCE_CONVERSIONS[im.mode](im))
+        im = im.reduce(factor)
+
+    return im.resize(size, sampling)
+
+def resize_height(im: PIL.Image.Image, height: int, sampling = PIL.Image.Resampling.BICUBIC) -> PIL.Image.Image:
+    """
+    Resizes an image to the given height, scaling its width to keep the same aspect ratio.
+    """
+    size = height_size(im.size, height)
+    draft(im, size)
+    return downscale(im, size, sampling)
+
+def crop_square(im: PIL.Image.Image, size: int) -> PIL.Image.Image:
+    """
+    Downsizes an image so that its shortest side is the given size, then crops the middle of it to a square.
+    """
+    scaled_size = cover_size(im.size, size)
+    draft(im, scaled_size)
+    im_downsized = downscale(im, scaled_size)
+
+    left = scaled_size[0] // 2 - size // 2
+    top = scaled_size[1] // 2 - size // 2
+    return im_downsized.crop((left, top, left + size, top + size))
+
+def render(source, preset: str, edits: list[dict] | None = None) -> bytes:
+    """
+    Renders a preset of an image.
+
+    Takes in the source image as a path or file object, the name of the preset (or EXPORT),
+    and the list of edits to apply (see edits.py), if any.
+    Returns the encoded bytes of the preview.
+    """
+    im = PIL.Image.open(source)
+    output_format = "JPEG"
+
+    if im.format == "GIF":
+        # GIFs are previewed by their first frame after the background frame.
+        im.seek(min(1, im.n_frames - 1))
+        output_format = "PNG"
+    elif im.format == "PNG":
+        output_format = "PNG"
+
+    if edits or preset == EXPORT:
+        im_preview = render_edited(im, preset, edits)
+    else:
+        orientation = exif_orientation(im)
+
+        if preset == THUMBNAIL:
+            # A square crop from the middle is the same whichever way the image is turned.
+            im_preview = crop_square(im, THUMBNAIL_SIZE)
+        else:
+            # The preset's height is of the image as it is shown, so the stored image is scaled to the turned size.
+            dims = oriented_size(im.size, orientation)
+            size = oriented_size(height_size(dims, preset_height(preset, dims)), orientation)
+            draft(im, size)
+            im_preview = downscale(im, size)
+
+        # The downscaled preview keeps the EXIF data of the original, so it is turned upright here.
+        im_preview = ImageOps.exif_transpose(im_preview)
+
+    options = {}
+    quality = image_edits.quality(edits)
+    if quality and output_format == "JPEG":
+        options["quality"] = quality
+    if preset == EXPORT and "exif" in im_preview.info:
+        # Exports keep the EXIF data of the original, less the orientation which has been applied.
+        options["exif"] = im_preview.info["exif"]
+
+    buffered = BytesIO()
+    im_preview.save(buffered, format=output_format, **options)
+    return buffered.getvalue()
+
+def render_edited(im: PIL.Image.Image, preset: str, edits: list[dict] | None) -> PIL.Image.Image:
+    """
+    Turns an image upright, applies its edits and then downsizes it for the preset (or not at all for EXPORT).
+    The edits need the image upright, so it is turned before it is downsized. To keep that cheap,
+    JPEGs are still decoded at a reduced scale when the preview is much smaller than the edited image,
+    unless the edits resize it (which needs the pixels at the scale the resize was chosen for).
+    """
+    orientation = exif_orientation(im)
+    final = image_edits.edited_size(oriented_size(im.size, orientation), edits)
+
+    size = None
+    if preset == THUMBNAIL:
+        size = cover_size(final, THUMBNAIL_SIZE)
+    elif preset != EXPORT:
+        size = height_size(final, preset_height(preset, final))
+
+    if size is not None and not image_edits.resizes(edits):
+        scale = size[1] / final[1]
+        # The scale is the same along both sides, so it applies to the stored image whichever way it is turned.
+        draft(im, (ceil(im.size[0] * scale), ceil(im.size[1] * scale)))
+
+    im_edited = image_edits.apply(ImageOps.exif_transpose(im), edits)
+
+    if preset == EXPORT:
+        return im_edited
+    if preset == THUMBNAIL:
+        return crop_square(im_edited, THUMBNAIL_SIZE)
+    return downscale(im_edited, size)
+
+def orient(source) -> bytes | None:
+    """
+    Re-encodes an image upright, applying its EXIF orientation to the pixels and resetting the orientation tag.
+    JPEGs are re-encoded at a high quality, but some quality is still lost, which is why originals are only
+    turned when the ORIENT_ORIGINALS config is set (see modules/jobs.py).
+
+    Takes in the source image as a path or file object.
+    Returns the encoded bytes, or None if the image is already upright or is animated.
+    """
+    im = PIL.Image.open(source)
+    if exif_orientation(im) == UPRIGHT or getattr(im, "n_frames", 1) > 1:
+        return None
+
+    output_format = im.format
+    im_upright = ImageOps.exif_transpose(im)
+
+    buffered = BytesIO()
+    # exif_transpose removes the orientation tag, and the rest of the EXIF data is kept.
+    options = {"quality": 95} if output_format == "JPEG" else {}
+    im_upright.save(buffered, format=output_format, exif=im_upright.getexif(), **options)
+    return buffered.getvalue()
+
+def mimetype(data: bytes) -> str:
+    """
+    Returns the mimetype of rendered preview bytes.
+    """
+    if data[:4] == PNG_SIGNATURE:
+        return "image/png"
+    return "image/jpeg"
+
+def data_uri(data: bytes) -> str:
+    """
+    Returns rendered preview bytes as a base64 string for web usage.
+    """
+    return f"data:{mimetype(data)};base64," + b64encode(data).decode("utf-8")
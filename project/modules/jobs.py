@@ -0,0 +1,170 @@
+"""
+Runs the queued background jobs (see the Job model), so heavy work on files is done outside of the requests.
+- Handlers
+    -> render: renders and caches every preview of an image's blob (see imaging.py and derivatives.py).
+    -> compress: compresses the blob of a compressible file, unless an image refers to the same blob (see blobstore.py).
+    -> orient: re-encodes an image with an EXIF orientation upright, and points every file with its blob at the new blob.
+       Only queued if ORIENT_ORIGINALS is set, as it re-encodes the original. Otherwise originals are kept as they were
+       uploaded, and only their previews are turned upright (see imaging.py).
+- Worker
+    -> Claims the queued job with the highest priority, so that no other worker runs it too.
+    -> Retries a failed job after a delay which doubles each time, up to MAX_ATTEMPTS.
+    -> Requeues running jobs whose worker died, once their lease runs out.
+
+Jobs are queued in the same transaction as the files they work on, and are run by worker processes
+started with 'flask worker'. Each worker process works through one job at a time, so jobs run in parallel across processes.
+Nothing breaks if no worker is running: previews are still rendered when they are first requested,
+and blobs are left uncompressed until a worker runs (or 'flask compress-blobs').
+
+Config:
+    ORIENT_ORIGINALS: Whether to queue orient jobs for uploaded images with an EXIF orientation (default False).
+"""
+
+import os
+import socket
+from time import time, sleep
+from datetime import datetime
+
+from sqlalchemy import update
+
+from .. import db, blobstore, derivatives
+from ..models import File, Job, DATE_FORMAT
+from . import imaging
+from .imaging import PRESETS
+from .functions import log
+
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 30 # Seconds before the first retry of a failed job
+LEASE = 10 * 60 # Seconds a job may run before it is given to another worker
+POLL_INTERVAL = 1 # Seconds between looking for jobs while the queue is empty
+
+def render_previews(digest: str) -> None:
+    """
+    Renders every preview of an image into the derivative cache, skipping previews which are already cached.
+    """
+    for preset in PRESETS:
+        derivatives.render(digest, preset, blobstore.image_path(digest))
+
+def compress_blob(digest: str) -> bool:
+    """
+    Compresses a blob, unless any file which refers to it is an image, as images are opened by path.
+    Returns whether the blob was compressed.
+    """
+    if any(file.is_image for file in File.query.filter_by(hash=digest)):
+        return False
+
+    return blobstore.compress(digest)
+
+def orient_original(digest: str) -> None:
+    """
+    Replaces the blob of an image with an EXIF orientation by an upright copy, for every file which refers to it.
+    The old blob is released once the files are committed, and the new blob gets its own render job (see models.py).
+    """
+    data = imaging.orient(blobstore.image_path(digest))
+    if data is None:
+        return
+
+    for file in File.query.filter_by(hash=digest).all():
+        file.value = data
+    db.session.commit()
+
+HANDLERS = {
+    Job.RENDER: render_previews,
+    Job.COMPRESS: compress_blob,
+    Job.ORIENT: orient_original
+}
+
+def claim() -> Job | None:
+    """
+    Claims the next job to run: the queued job with the highest priority, oldest first.
+    Returns None if no job is waiting.
+    """
+    now = time()
+
+    # Jobs whose worker died while running them are queued again once their lease runs out.
+    db.session.execute(
+        update(Job)
+        .where(Job.status == Job.RUNNING, Job.locked_until < now)
+        .values(status=Job.QUEUED)
+    )
+    db.session.commit()
+
+    while True:
+        job = (
+            Job.query
+            .filter(Job.status == Job.QUEUED, Job.run_after <= now)
+            .order_by(Job.priority.desc(), Job.id)
+            .first()
+        )
+        if job is None:
+            return None
+
+        # Another worker may claim the same job at the same time, so it is only claimed if it is still queued.
+        result = db.session.execute(
+            update(Job)
+            .where(Job.id == job.id, Job.status == Job.QUEUED)
+            .values(status=Job.RUNNING, attempts=Job.attempts + 1, locked_until=now + LEASE)
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            db.session.refresh(job)
+            return job
+
+def run(job: Job) -> None:
+    """
+    Runs a claimed job, marking it as done, or as queued again to be retried (failed after MAX_ATTEMPTS).
+    Jobs on blobs which no file refers to anymore are skipped, e.g. if the file was deleted while the job was queued.
+    """
+    try:
+        if File.query.filter_by(hash=job.target).first():
+            HANDLERS[job.kind](job.target)
+    except Exception as e:
+        db.session.rollback()
+        job.error = f"{type(e).__name__}: {e}"
+        if job.attempts < MAX_ATTEMPTS:
+            job.status = Job.QUEUED
+            job.run_after = time() + RETRY_DELAY * 2 ** (job.attempts - 1)
+        else:
+            job.status = Job.FAILED
+            job.date_finished = datetime.now().strftime(DATE_FORMAT)
+        log(f"Job {job.id} ({job.kind}) failed on attempt {job.attempts}: {job.error}")
+    else:
+        job.status = Job.DONE
+        job.error = None
+        job.date_finished = datetime.now().strftime(DATE_FORMAT)
+
+    job.locked_until = None
+    db.session.commit()
+
+def work(burst: bool = False) -> int:
+    """
+    Runs jobs one at a time until stopped, waiting POLL_INTERVAL seconds whenever the queue is empty.
+    If burst is True, returns once the queue is empty instead.
+
+    Must be called within an app context. Returns the number of jobs run.
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    log(f"Worker {worker} started.")
+
+    count = 0
+    while True:
+        job = claim()
+        if job is None:
+            if burst:
+                return count
+            sleep(POLL_INTERVAL)
+            continue
+
+        run(job)
+        db.session.expunge_all()
+        count += 1
+
+def work_process(burst: bool) -> None:
+    """
+    Entry point of a worker process, which creates its own app (and so its own database connections).
+    """
+    from .. import create_app
+
+    app = create_app()
+    with app.app_context():
+        work(burst)
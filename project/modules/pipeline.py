@@ -0,0 +1,135 @@
+"""
+Shared process pool for rendering image previews.
+- ImagePipeline object
+    -> Renders many previews at once across every CPU core.
+    -> Limits how many renders can be waiting at once (backpressure).
+    -> Gives up on renders which take longer than a timeout, or which wait longer than it for a free slot.
+       A render which timed out cannot be cancelled once it is running, so the pool is killed and started again,
+       which frees the slots of its renders.
+
+Resizing and encoding images holds the GIL for most of the work, so threads cannot render in parallel.
+Instead, renders are sent to a pool of worker processes which is created once and reused by every request.
+Tasks only carry the path of a blob, the name of a preset and any edits of the image (never database objects),
+and the workers send back the encoded preview bytes.
+
+Config:
+    IMAGE_WORKERS: Number of worker processes (defaults to the number of CPU cores). 0 renders in the request instead.
+    IMAGE_QUEUE_SIZE: Maximum number of renders submitted but not finished. Submitting more waits for a free slot.
+    IMAGE_TASK_TIMEOUT: Seconds to wait for a single render, or for a free slot, before giving up on it.
+"""
+
+import os
+import multiprocessing
+from threading import Lock, BoundedSemaphore
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from . import imaging
+from .functions import log
+
+class ImagePipeline:
+    def __init__(self):
+        self.workers = 0
+        self.timeout = None
+        self._executor = None
+        self._slots = None
+        self._lock = Lock()
+
+    def init_app(self, app) -> None:
+        self.workers = app.config.setdefault("IMAGE_WORKERS", os.cpu_count() or 1)
+        queue_size = app.config.setdefault("IMAGE_QUEUE_SIZE", self.workers * 4)
+        self.timeout = app.config.setdefault("IMAGE_TASK_TIMEOUT", 30)
+
+        self._slots = BoundedSemaphore(max(queue_size, 1))
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """
+        Returns the process pool, starting it the first time it is needed.
+        """
+        with self._lock:
+            if self._executor is None:
+                # Worker processes are spawned rather than forked, as forking copies the server's threads and database connections.
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def _reset(self, kill: bool = False) -> None:
+        """
+        Discards a broken pool (e.g. a worker process was killed), so the next render starts a new one.
+        If kill is given, the worker processes are terminated first, for a pool with a render which hung.
+        The renders left in the pool then fail, which frees their slots.
+        """
+        with self._lock:
+            if self._executor is not None:
+                if kill:
+                    for process in list(self._executor._processes.values()):
+                        process.terminate()
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def submit(self, source: str, preset: str, edits: list[dict] | None = None):
+        """
+        Submits a render to the pool, waiting for a free slot if too many renders are already queued.
+
+        Takes in the path of the source image, the name of the preset and the edits of the image (see edits.py), if any.
+        Returns a Future of the encoded preview bytes, or None if no slot was freed within the timeout.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            log("Image render gave up waiting for a free slot.")
+            return None
+        try:
+            future = self._get_executor().submit(imaging.render, source, preset, edits)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def render_many(self, tasks: list[tuple]) -> list[bytes | None]:
+        """
+        Renders many previews in parallel.
+
+        Takes in a list of (source path, preset) or (source path, preset, edits) tasks.
+        Returns the encoded bytes of each preview in the same order, or None for a render that failed or timed out.
+        """
+        if self.workers == 0:
+            return [self._render(*task) for task in tasks]
+
+        results = []
+        futures = []
+        try:
+            for task in tasks:
+                futures.append(self.submit(*task))
+        except BrokenProcessPool:
+            self._reset()
+
+        for future in futures:
+            if future is None:
+                results.append(None)
+                continue
+
+            try:
+                results.append(future.result(timeout=self.timeout))
+            except TimeoutError:
+                # A running render cannot be cancelled, so its pool is killed to free the worker and its slot.
+                log("Image render timed out.")
+                self._reset(kill=True)
+                results.append(None)
+            except BrokenProcessPool:
+                self._reset()
+                results.append(None)
+            except Exception as e:
+                log(f"Image render failed: {e}")
+                results.append(None)
+
+        # Any tasks which could not be submitted to a broken pool
+        results.extend(None for _ in tasks[len(futures):])
+
+        return results
+
+    def _render(self, source: str, preset: str, edits: list[dict] | None = None) -> bytes | None:
+        try:
+            return imaging.render(source, preset, edits)
+        except Exception as e:
+            log(f"Image render failed: {e}")
+            return None
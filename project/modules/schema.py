@@ -0,0 +1,65 @@
+"""
+Keeps the SQL database in line with the SQLAlchemy models.
+
+db.create_all() only creates tables which do not exist yet, so columns and indexes
+that are added to an existing model are added here with ALTER TABLE / CREATE INDEX.
+"""
+
+from sqlalchemy import inspect, text, select, func
+
+from .functions import log
+
+def has_duplicates(connection, index) -> bool:
+    """
+    Returns whether any rows have the same values in the columns of an index, which would stop it being made unique.
+    """
+    columns = list(index.columns)
+    query = select(*columns).group_by(*columns).having(func.count() > 1).limit(1)
+    return connection.execute(query).first() is not None
+
+def upgrade_schema(db) -> None:
+    """
+    Creates any missing tables, then adds any columns and indexes which exist on the models
+    but are missing from the tables in the database.
+
+    Must be called within an app context.
+    """
+    db.create_all()
+
+    engine = db.engine
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+
+                definition = column.type.compile(dialect=engine.dialect)
+                if column.server_default is not None:
+                    # Existing rows take the default, which also allows the column to be NOT NULL.
+                    definition += f" DEFAULT {column.server_default.arg.compile(dialect=engine.dialect)}"
+                    if not column.nullable:
+                        definition += " NOT NULL"
+
+                connection.execute(text(
+                    f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {preparer.quote(column.name)} {definition}"
+                ))
+                log(f"Added column {table.name}.{column.name}")
+
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+
+            for index in table.indexes:
+                if index.name in existing_indexes:
+                    continue
+
+                if index.unique and has_duplicates(connection, index):
+                    columns = ", ".join(column.name for column in index.columns)
+                    log(f"Could not add unique index {index.name}, as some rows of {table.name} have the same ({columns}).")
+                    continue
+
+                index.create(bind=connection)
+                log(f"Added index {index.name}")
@@ -0,0 +1,123 @@
+"""
+On-disk staging area for the chunks of resumable uploads.
+- UploadStaging object
+    -> Writes numbered chunks of an upload session, in any order.
+    -> Lists which chunks of a session have arrived.
+    -> Assembles the chunks in order into the blob store without reading the whole file into memory.
+
+This follows the idea sketched in image_to_bytes.py of sending a file as a series of byte chunks,
+except that each chunk is numbered so that the file can be put back together without searching for
+start and end sequences.
+
+Chunks are kept within the instance folder:
+    instance/uploads/<session id>/<chunk index>.part
+
+Config:
+    UPLOAD_MAX_CHUNKS: Largest number of chunks one upload session may have (default 10000).
+    UPLOAD_MAX_SIZE: Largest number of bytes one upload session may stage (default 16 GiB).
+"""
+
+import os
+import shutil
+from os.path import join, exists
+from tempfile import mkstemp
+
+from .blobstore import BlobStore, CHUNK_SIZE
+
+CHUNK_SUFFIX = ".part"
+
+class UploadStaging:
+    def __init__(self, root: str | None = None):
+        self.root = root
+        self.max_chunks = 10000
+        self.max_size = 16 * 1024 ** 3
+
+    def init_app(self, app) -> None:
+        """
+        Sets the root directory of the staging area from the app config,
+        defaulting to 'uploads' within the app's instance folder.
+        """
+        self.root = app.config.setdefault("UPLOAD_STAGING_PATH", join(app.instance_path, "uploads"))
+        self.max_chunks = app.config.setdefault("UPLOAD_MAX_CHUNKS", 10000)
+        self.max_size = app.config.setdefault("UPLOAD_MAX_SIZE", 16 * 1024 ** 3)
+        os.makedirs(self.root, exist_ok=True)
+
+    def directory(self, session_id: str) -> str:
+        return join(self.root, session_id)
+
+    def chunk_path(self, session_id: str, index: int) -> str:
+        return join(self.directory(session_id), f"{index}{CHUNK_SUFFIX}")
+
+    def write_chunk(self, session_id: str, index: int, stream, limit: int | None = None) -> int:
+        """
+        Writes a chunk of an upload session from a readable stream.
+        A chunk that is sent again replaces the previous copy, so retries are safe.
+
+        Takes in the id of the session, the index of the chunk, the stream to read it from,
+        and optionally the most bytes the chunk may have.
+        Returns the size of the chunk in bytes. Raises ValueError if the chunk is larger than the limit, and nothing is kept.
+        """
+        directory = self.directory(session_id)
+        os.makedirs(directory, exist_ok=True)
+
+        # Chunks are only visible under their index once they are completely written.
+        handle, temp_path = mkstemp(dir=directory)
+        size = 0
+        try:
+            with os.fdopen(handle, "wb") as f:
+                while True:
+                    data = stream.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    f.write(data)
+                    size += len(data)
+                    if limit is not None and size > limit:
+                        raise ValueError(f"Chunk is larger than {limit} bytes.")
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        os.replace(temp_path, self.chunk_path(session_id, index))
+        return size
+
+    def staged_size(self, session_id: str, exclude: int | None = None) -> int:
+        """
+        Returns the number of bytes of every chunk of a session which has been written, leaving out the chunk at exclude.
+        """
+        return sum(
+            os.path.getsize(self.chunk_path(session_id, index)) for index in self.received(session_id) if index != exclude
+        )
+
+    def received(self, session_id: str) -> list[int]:
+        """
+        Returns the sorted indices of every chunk of a session that has been completely written.
+        """
+        directory = self.directory(session_id)
+        if not exists(directory):
+            return []
+
+        return sorted(int(name[:-len(CHUNK_SUFFIX)]) for name in os.listdir(directory) if name.endswith(CHUNK_SUFFIX))
+
+    def assemble(self, session_id: str, chunk_count: int, store: BlobStore) -> tuple[str, int]:
+        """
+        Writes chunks 0 to chunk_count - 1 of a session, in order, into the blob store.
+
+        Returns the hash and size of the assembled file.
+        """
+        writer = store.writer()
+        try:
+            for index in range(chunk_count):
+                with open(self.chunk_path(session_id, index), "rb") as f:
+                    while True:
+                        data = f.read(CHUNK_SIZE)
+                        if not data:
+                            break
+                        writer.write(data)
+        except BaseException:
+            writer.discard()
+            raise
+
+        return writer.commit()
+
+    def discard(self, session_id: str) -> None:
+        shutil.rmtree(self.directory(session_id), ignore_errors=True)
@@ -0,0 +1,112 @@
+"""
+Receives uploaded files from the request body straight into the blob store.
+
+Upload routes accept two streaming formats besides the older JSON/base64 body:
+    - application/octet-stream: the raw bytes of a single file, with its name given as the 'name' query parameter.
+    - multipart/form-data: one or more files, with any options given as form fields.
+
+Bytes are written to the blob store in fixed-size chunks as they arrive,
+so the full file is never held in memory. The number of bytes received so far can be reported as progress events (see events.py).
+"""
+
+from flask import Request
+from werkzeug.formparser import parse_form_data
+
+from .. import blobstore
+from .blobstore import CHUNK_SIZE
+from .events import Progress
+
+STREAM_MIMETYPES = ["application/octet-stream", "multipart/form-data"]
+
+def is_streaming(request: Request) -> bool:
+    """
+    Returns True if the request body is a raw or multipart upload rather than JSON.
+    """
+    return request.mimetype in STREAM_MIMETYPES
+
+class _CountingReader:
+    """
+    Reads from a stream, adding the number of bytes read to the progress of an upload.
+    """
+    def __init__(self, stream, progress: Progress):
+        self.stream = stream
+        self.progress = progress
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.progress.add(bytes=len(data))
+        return data
+
+class _CountingWriter:
+    """
+    Writes to a blob writer, adding the number of bytes written to the progress of an upload.
+    """
+    def __init__(self, writer, progress: Progress):
+        self.writer = writer
+        self.progress = progress
+
+    def write(self, data: bytes) -> int:
+        self.progress.add(bytes=len(data))
+        return self.writer.write(data)
+
+    def __getattr__(self, name: str):
+        return getattr(self.writer, name)
+
+def stream_uploads(request: Request, progress: Progress | None = None) -> tuple[dict, list[tuple[str, str, int]]]:
+    """
+    Writes every file in a raw or multipart request body to the blob store.
+
+    Takes in the current flask request, and optionally the progress of the upload,
+    to which the bytes and files received so far are reported.
+    Returns the options of the upload as a dict (query parameters and form fields),
+    and a list of (name, hash, size) for each uploaded file. Files without a name are left out.
+    """
+    options = request.args.to_dict()
+
+    if request.mimetype == "application/octet-stream":
+        if not options.get("name"):
+            # The name of a raw body can only be given as a query parameter, so without it there is no file to store.
+            return options, []
+        stream = _CountingReader(request.stream, progress) if progress else request.stream
+        digest, size = blobstore.put_stream(stream, CHUNK_SIZE)
+        return options, [(options["name"], digest, size)]
+
+    writers = []
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        # Parts are parsed one after another, so a new part means the last one is complete. It is committed now,
+        # closing its temporary file, so that only one file is open at a time however many files are uploaded.
+        if writers:
+            writers[-1].commit()
+
+        writer = blobstore.writer()
+        writers.append(writer)
+        if progress:
+            progress.update(received=len(writers) - 1)
+            return _CountingWriter(writer, progress)
+        return writer
+
+    try:
+        _, form, files = parse_form_data(request.environ, stream_factory=stream_factory)
+    except BaseException:
+        for writer in writers:
+            writer.discard()
+        raise
+
+    options.update(form.to_dict())
+
+    uploads = []
+    for _, file in files.items(multi=True):
+        digest, size = file.stream.commit()
+        uploads.append((file.filename, digest, size))
+
+    if progress:
+        progress.update(received=len(uploads))
+
+    # A single file may be renamed with the 'name' field.
+    if len(uploads) == 1 and "name" in options:
+        uploads[0] = (options["name"], *uploads[0][1:])
+
+    # Their blobs are left unreferenced, and are removed by 'flask sweep-blobs'.
+    uploads = [upload for upload in uploads if upload[0]]
+
+    return options, uploads
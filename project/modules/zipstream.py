@@ -0,0 +1,79 @@
+"""
+Builds zip files as a stream of bytes, so that a download can be sent to the client as it is being zipped.
+
+Members are read from the blob store one chunk at a time and written straight to the response,
+so memory use stays the same no matter how many files, or how large the files, are in the zip.
+Files which are already compressed (images, zips, media) are STORED, as deflating them again only costs time,
+and everything else (text, code, documents) is DEFLATED.
+"""
+
+import zipfile
+from datetime import datetime
+
+from ..models import File, DATE_FORMAT, COMPRESSED_EXTENSIONS
+from .events import Progress
+
+class _StreamBuffer:
+    """
+    Write-only file object which collects the bytes written by ZipFile until they are drained into the response.
+    It has no tell or seek, so ZipFile writes data descriptors after each member instead of seeking back.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def compress_type(file: File) -> int:
+    """
+    Returns the zip compression method for a file based on its type.
+    """
+    if file.extension in COMPRESSED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def stream_zip(files: list[File], progress: Progress | None = None):
+    """
+    Yields the bytes of a zip file containing the given files, one chunk at a time.
+
+    Takes in a list of File objects, and optionally the progress of the download,
+    to which the number of members and bytes written so far are reported.
+    """
+    buffer = _StreamBuffer()
+
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for index, file in enumerate(files):
+            date_uploaded = file.get_property("date_uploaded")
+            date = datetime.strptime(date_uploaded, DATE_FORMAT) if date_uploaded else datetime.now()
+
+            info = zipfile.ZipInfo(file.name, date_time=date.timetuple()[:6])
+            info.compress_type = compress_type(file)
+            info.file_size = file.size or 0 # Lets ZipFile decide whether the member needs ZIP64 extensions
+
+            with zf.open(info, "w") as member:
+                for chunk in file.iter_chunks():
+                    member.write(chunk)
+                    if progress:
+                        progress.add(bytes=len(chunk))
+                    data = buffer.drain()
+                    if data:
+                        yield data
+
+            if progress:
+                progress.update(members=index + 1)
+            yield buffer.drain()
+
+    # Central directory
+    yield buffer.drain()
+
+    if progress:
+        progress.finish()
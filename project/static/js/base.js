@@ -63,6 +63,83 @@ function toggleMenu() {
     }
 }
 
+// Files larger than this are uploaded without checking whether their content is already stored,
+// as hashing them would read the whole file into memory.
+const CHECK_UPLOAD_MAX_SIZE = 256 * 1024 * 1024;
+
+async function hashFile(/*File*/file) {
+    /*
+    Returns the SHA-256 hash of a file's bytes as a hex string.
+    */
+    let digest = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest), byte => byte.toString(16).padStart(2, "0")).join("");
+}
+
+async function checkUploads(/*array*/files, /*json*/options = {}) {
+    /*
+    Sends the name, size and hash of each file to '/checkUploads' before uploading them.
+    Files whose content the user has already stored are saved by the backend without sending their bytes.
+    'options' is sent along with the files, e.g. {overwrite: 1, allowImages: 1, preset: "gallery"}.
+
+    Returns {results, missing}: the results of the files which did not need to be uploaded (see '/checkUploads'),
+    and the list of files which still have to be uploaded.
+    Hashing needs a secure context (https or localhost), otherwise every file is returned as missing.
+    */
+    let checked = files.filter(file => file.size <= CHECK_UPLOAD_MAX_SIZE);
+    if (!window.crypto || !crypto.subtle || checked.length === 0)
+        return {results: [], missing: files};
+
+    let checks = [];
+    for (let file of checked)
+        checks.push({name: file.name, size: file.size, hash: await hashFile(file)});
+
+    let response = await fetch("/checkUploads", {
+        method: "POST",
+        body: JSON.stringify({files: checks, ...options}),
+        headers: {
+            "Content-type": "application/json; charset=UTF-8"
+        }
+    });
+    let data = await response.json();
+    if (data.response !== 200)
+        return {results: [], missing: files};
+
+    let stored = data.files.filter(result => result.response !== 202);
+    let storedNames = stored.map(result => result.name);
+    return {results: stored, missing: files.filter(file => !storedNames.includes(file.name))};
+}
+
+// Progress events of long operations, pushed by the backend at '/events'. The stream is opened by the first operation watched.
+let eventSource;
+let operationCallbacks = {};
+const OPERATION_EVENTS = ["upload", "zip", "archive", "restore", "delete"];
+
+function watchOperation(/*function*/callback) {
+    /*
+    Returns a new operation id, to be sent in the 'X-Operation' header (or 'operation' query parameter) of a long request.
+    'callback' is called with the data of each progress event of that request, e.g. {bytes, total_bytes, done},
+    and is forgotten once the operation is done.
+    */
+    let operation = Math.random().toString(36).slice(2);
+    operationCallbacks[operation] = callback;
+
+    if (!eventSource && window.EventSource) {
+        eventSource = new EventSource("/events");
+        for (let type of OPERATION_EVENTS) {
+            eventSource.addEventListener(type, (event) => {
+                let data = JSON.parse(event.data);
+                let callback = operationCallbacks[data.operation];
+                if (!callback)
+                    return;
+                if (data.done)
+                    delete operationCallbacks[data.operation];
+                callback(data);
+            });
+        }
+    }
+    return operation;
+}
+
 function handleScroll(/*Event*/event) {
     scrollToTopButton = document.getElementById("scroll-to-top");
     scrollToTopButton.style = ""
@@ -160,6 +160,7 @@ function sendRenameRequest(/*string*/originalName, /*string*/newName) {
     Send a POST request to rename file with the original and new names.
     If the request returns a response of 300, then most likely the filename does not match
     an existing file and a page reload is required.
+    If the request returns a response of 301, then another file already has the new name.
     Prompts the user.
     */
     fetch("/renameFile", {
@@ -179,6 +180,14 @@ function sendRenameRequest(/*string*/originalName, /*string*/newName) {
             buttons.confirm.onclick = clearNotifications;
             return;
         }
+        if (data.response === 301) {
+            let buttons = createNotification(`${newName} already exists.`, options={
+                confirm: "Okay"
+            });
+            buttons.confirm.id = "confirm-button";
+            buttons.confirm.onclick = clearNotifications;
+            return;
+        }
 
         let storedFile = allFiles.filter(file => {return file.name == originalName})[0];
         storedFile.name = newName;
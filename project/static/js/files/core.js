@@ -1,5 +1,7 @@
 /*
 The core functions for the file manager. Involves file sorting, selection, and displaying on the user's webpage.
+Files are requested from /listFiles one page at a time, already sorted by the backend,
+and the next page is requested when the user scrolls to the bottom of the table.
 Note that handleSelection is different between the file manager and recently deleted pages.
 This is because the selection systems are different so that they need their individual select handling methods.
 */
@@ -21,6 +23,16 @@ const DESCENDING = 0x19;
 var globalSortBy;
 var globalSortDirection;
 
+// Which files the page lists, given by the template: {type: "images"/"files"/null, archived: bool}
+let listView = {};
+// Cursor of the next page of files, null once every page has been loaded.
+let nextCursor = null;
+let loadingFiles = false;
+// Incremented for every first page request, so that responses to an older sorting are ignored.
+let listRequest = 0;
+// Element below the table which requests the next page when it is scrolled into view.
+let pageSentinel;
+
 // How long after a file is uploaded that it will fade away.
 const UPLOAD_FADE_SECONDS = 5;
 
@@ -36,7 +48,7 @@ var navbar;
 var fileOptions;
 var body;
 
-let allFiles;
+let allFiles = [];
 
 let selected = [];
 let previous, current, previousIndex, currentIndex;
@@ -148,6 +160,13 @@ function displayFiles(/*array*/files) {
         fileManagerBody.children[1].remove();
     }
 
+    appendFiles(files);
+}
+
+function appendFiles(/*array*/files) {
+    /*
+    Adds a row to the end of the table for each of the files, in the given order.
+    */
     let label;
     let newFile;
     let textElement;
@@ -208,6 +227,61 @@ function displayFiles(/*array*/files) {
     checkSelected();
 }
 
+function loadFiles(/*bool*/reset) {
+    /*
+    Requests a page of files from /listFiles, sorted by the backend with the current sort type and direction.
+    If reset is true, the table is replaced with the first page (e.g. after the sorting has changed).
+    Otherwise the next page is added to the end of the table.
+    */
+    if (!reset && (loadingFiles || nextCursor === null))
+        return;
+
+    let params = new URLSearchParams({
+        sort: globalSortBy,
+        direction: globalSortDirection === DESCENDING ? "descending" : "ascending"
+    });
+    if (listView.type)
+        params.set("type", listView.type);
+    if (listView.archived)
+        params.set("archived", "1");
+    if (!reset)
+        params.set("cursor", nextCursor);
+
+    if (reset)
+        listRequest++;
+    let request = listRequest;
+    loadingFiles = true;
+
+    fetch(`/listFiles?${params}`)
+    .then(response => response.json())
+    .then(data => {
+        // The sorting changed while this page was loading.
+        if (request !== listRequest)
+            return;
+        loadingFiles = false;
+
+        if (data.response !== 200)
+            return;
+
+        if (reset) {
+            allFiles = data.files;
+            displayFiles(allFiles);
+        } else {
+            allFiles = allFiles.concat(data.files);
+            appendFiles(data.files);
+        }
+        nextCursor = data.cursor;
+
+        // Keep loading while the bottom of the table is still on screen.
+        if (nextCursor !== null && pageSentinel.getBoundingClientRect().top < window.innerHeight)
+            loadFiles(false);
+    })
+    .catch(error => {
+        loadingFiles = false;
+        console.log(error);
+    });
+}
+
 let sortName;
 let sortDate;
 let sortType;
@@ -268,9 +342,9 @@ function update(/*string*/type) {
         }
     }
 
-    displayFiles(quickSortFiles(allFiles, type, direction));
     globalSortBy = type;
     globalSortDirection = direction;
+    loadFiles(true);
 }
 
 // File Manipulation
@@ -336,26 +410,10 @@ function archiveFiles() {
     buttons.cancel.onclick = clearNotifications;
 }
 
-function confirmDownloadRequest(/*string*/zipPath) {
-    /*
-    Once the user has received the downloaded files,
-    a request is sent to the backend to delete the zip file.
-    Takes in the path of the zip file.
-    */
-    fetch("/downloadFiles", {
-            method: "POST",
-            body: JSON.stringify({path: zipPath}),
-            headers: {
-                "Content-type": "application/json; charset=UTF-8"
-            }
-        })
-}
-
 function sendDownloadRequest(/*array*/files) {
     /*
-    Sends a delete image request to the backend at /downloadFiles
-    Redirects the user to the download location which downloads the zip file.
-    After 10 seconds, it will call 'confirmDownloadRequest' which deletes the zip file from the system.
+    Sends a download request to the backend at /downloadFiles
+    Redirects the user to the download location which streams the zip file.
     */
     fetch("/downloadFiles", {
             method: "POST",
@@ -371,8 +429,6 @@ function sendDownloadRequest(/*array*/files) {
 
             // Automatically give the current user the download.
             window.location = data.path;
-            // After ten seconds, the zip file will be deleted. [Should adjust in case of larger files?]
-            setTimeout(`confirmDownloadRequest('${data.path}')`, 1000 * 10);
         })
         .catch(error => console.log(error))
 }
@@ -467,6 +523,15 @@ window.addEventListener("load", () => {
     sortSize.firstElementChild.append(arrow.cloneNode());
 
     sortArrows = document.getElementsByClassName("sort-arrow");
+
+    // Request the next page of files once the bottom of the table is scrolled into view.
+    pageSentinel = document.createElement("div");
+    pageSentinel.className = "page-sentinel";
+    fileManager.after(pageSentinel);
+    new IntersectionObserver(entries => {
+        if (entries[0].isIntersecting)
+            loadFiles(false);
+    }).observe(pageSentinel);
     
     // Show the files with type 'name' and order 'ascending'.
     update(NAME);
@@ -37,6 +37,7 @@ function previewFile() {
                 method: "POST",
                 body: JSON.stringify({
                     name: file.name,
+                    base64: false,
                 }),
                 headers: {
                     "Content-type": "application/json; charset=UTF-8"
@@ -44,10 +45,13 @@ function previewFile() {
             })
             .then(response => response.json())
             .then(data => {
+                if (data.response === 300)
+                    throw new Error("Image not found.");
+
                 // Show previewFrame and remove all previous elements shown
                 previewFrame.style.display = "flex";
 
-                image.src = data.base64;
+                image.src = data.src;
             })
             .catch(error => {
                 console.log(error);
@@ -65,63 +65,94 @@ function handleUploadResponses(duplicateFiles, imageFiles, files) {
 
 let duplicateFiles;
 let imageFiles;
-let file;
-function sendUploadRequest(/*array*/files, /*bool*/overwrite = false) {
+function handleUploadResults(/*array*/results, /*array*/files, /*bool*/overwrite) {
     /*
-    Send an upload request to backend file by file.
-    Therefore the path '/uploadFile' will receive a request for each file in the list.
-    After all of the files have been sent and received, then it called 'handleUploadResponses' with the responses as a list.
+    Shows the result of each uploaded file, adding the uploaded files to the table.
+    Then calls 'handleUploadResponses' with the files which conflicted or were rejected.
     */
     duplicateFiles = [];
     imageFiles = [];
 
-    let uploadCount = 0;
-    for (let file of files) {
-        // Overwrite option
-        if (overwrite) 
-            file.overwrite = 1;
-        if (!window.location.href.includes("file_manager"))
-            file.allowImages = 1;
-
-        let uploadNotification = uploadNotifications[file.name];
-
-        fetch("/uploadFile", {
-            method: "POST",
-            body: JSON.stringify(file),
-            headers: {
-                "Content-type": "application/json; charset=UTF-8"
-            }
-        })
-        .then(response => response.json())
-        .then(data => {
-            if (data.response === 201) {
-                duplicateFiles.push(file);
-            } else if (data.response === 300) {
-                imageFiles.push(file);
-                uploadNotification.innerHTML = `${file.name} could not be uploaded.`;
-                setTimeout(`removeUploadNotification('${file.name}');`, 1000 * UPLOAD_FADE_SECONDS);
-            } else {
-                if (overwrite) {
-                    for (let item of allFiles) {
-                        if (item.name === data.file.name)
-                            allFiles.splice(allFiles.indexOf(item), 1);
-                    }
+    for (let result of results) {
+        let file = files.filter(file => file.name === result.name)[0];
+        let uploadNotification = uploadNotifications[result.name];
+
+        if (result.response === 201) {
+            duplicateFiles.push(file);
+        } else if (result.response === 300) {
+            imageFiles.push(file);
+            uploadNotification.innerHTML = `${result.name} could not be uploaded.`;
+            setTimeout(`removeUploadNotification('${result.name}');`, 1000 * UPLOAD_FADE_SECONDS);
+        } else {
+            if (overwrite) {
+                for (let item of allFiles) {
+                    if (item.name === result.file.name)
+                        allFiles.splice(allFiles.indexOf(item), 1);
                 }
-                allFiles.push(data.file);
+            }
+            allFiles.push(result.file);
 
-                displayFiles(quickSortFiles(allFiles, globalSortBy, globalSortDirection));
+            uploadNotification.innerHTML = `Uploaded ${result.name}`;
 
-                uploadNotification.innerHTML = `Uploaded ${file.name}`;
+            setTimeout(`removeUploadNotification('${result.name}');`, 1000 * UPLOAD_FADE_SECONDS);
+        }
+    }
 
-                setTimeout(`removeUploadNotification('${file.name}');`, 1000 * UPLOAD_FADE_SECONDS);
-            }
+    displayFiles(quickSortFiles(allFiles, globalSortBy, globalSortDirection));
+
+    handleUploadResponses(duplicateFiles=duplicateFiles, imageFiles=imageFiles, files=files);
+}
+
+async function sendUploadRequest(/*array*/files, /*bool*/overwrite = false) {
+    /*
+    Uploads the files to the backend.
+    First the hashes of the files are checked at '/checkUploads', so that files whose content is already stored are not sent again.
+    The rest are sent in one multipart request at '/uploadFiles', streamed as they are rather than being read into base64 first.
+    The results of both requests are then passed on to 'handleUploadResults'.
+    */
+    let options = {};
+    // Overwrite option
+    if (overwrite)
+        options.overwrite = 1;
+    if (!window.location.href.includes("file_manager"))
+        options.allowImages = 1;
+
+    try {
+        let {results, missing} = await checkUploads(files, options);
+
+        if (missing.length > 0) {
+            let formData = new FormData();
+            for (let file of missing)
+                formData.append("files", file, file.name);
+            for (let option in options)
+                formData.append(option, options[option]);
+
+            // Shows how much of the upload has been received on each of its notifications.
+            let operation = watchOperation((progress) => {
+                if (!progress.total_bytes || progress.done)
+                    return;
+                let percent = Math.floor(100 * (progress.bytes || 0) / progress.total_bytes);
+                for (let file of missing) {
+                    let uploadNotification = uploadNotifications[file.name];
+                    if (uploadNotification)
+                        uploadNotification.lastChild.textContent = `Uploading ${file.name} (${percent}%)`;
+                }
+            });
+
+            let response = await fetch("/uploadFiles", {
+                method: "POST",
+                body: formData,
+                headers: {
+                    "X-Operation": operation
+                }
+            });
+            let data = await response.json();
+            results = results.concat(data.files);
+        }
 
-            uploadCount++;
-            
-            if (uploadCount === files.length)
-                handleUploadResponses(duplicateFiles=duplicateFiles, imageFiles=imageFiles, files=files);
-        })
-        .catch(error => console.log(error));
+        handleUploadResults(results, files, overwrite);
+    } catch (error) {
+        console.log(error);
     }
 }
 
@@ -155,34 +186,15 @@ function notifyUpload(/*string*/filename) {
 let uploadNotifications = {};
 function uploadEvent() {
     /*
-    Reads the files from the user.
-    Makes an upload request at 'sendUploadRequest' after all of the files have been read.
+    Takes the files chosen by the user and makes one upload request for all of them at 'sendUploadRequest'.
     */
-    let files = uploadButton.files;
-    
-    let filesData = [];
-    let value;
-    let uploadCount = 0;
-    for (let file of files) {
-        reader = new FileReader();
-        reader.onload = function (/*ProgressEvent*/event) {
-            value = event.target.result;
-            filesData.push({
-                name: file.name,
-                value: value
-            });
-
-            uploadNotifications[file.name] = notifyUpload(file.name);
+    let files = Array.from(uploadButton.files);
 
-            uploadCount++;
+    for (let file of files)
+        uploadNotifications[file.name] = notifyUpload(file.name);
 
-            if (uploadCount === uploadButton.files.length) {
-                sendUploadRequest(filesData);
+    sendUploadRequest(files);
 
-                // Reset upload buttons files
-                uploadButton.value = '';
-            }
-        };
-        reader.readAsDataURL(file);
-    }
+    // Reset upload buttons files
+    uploadButton.value = '';
 }
@@ -1,6 +1,8 @@
 /*
 The main script for the Gallery page.
 Holds functions for image selection, the click event for a gallery item, image viewing, uploading and archiving
+Images are requested from /listFiles one page at a time, in the order they were uploaded,
+and the next page is requested when the user scrolls to the bottom of the gallery.
 */
 
 // Define user settings
@@ -40,6 +42,12 @@ let downsizedImage;
 var galleryBox;
 let galleryItems;
 
+// Cursor of the next page of images, null once every page has been loaded.
+let nextCursor = null;
+let loadingImages = false;
+// Element below the gallery which requests the next page when it is scrolled into view.
+let pageSentinel;
+
 function destroyLoadingScreen() {
     /*
     Destroys the spinner loading screen which is displayed when the images are loading.
@@ -324,6 +332,7 @@ function onItemClick(/*PointerEvent*/event, /*HTMLElement*/item) {
         method: "POST",
         body: JSON.stringify({
             name: fileName,
+            base64: false,
         }),
         headers: {
             "Content-type": "application/json; charset=UTF-8"
@@ -331,14 +340,17 @@ function onItemClick(/*PointerEvent*/event, /*HTMLElement*/item) {
         })
         .then(response => response.json())
         .then(data => {
-            viewerImage.src = data.base64;
+            if (data.response === 300)
+                throw new Error("Image not found.");
+
+            viewerImage.src = data.src;
             viewerResult.style.backgroundImage = `url('${data.downsized}')`
             downsizedImage = data.downsized;
             viewerFileName = fileName;
 
             let len = viewerFileName.length;
             if (viewerFileName.slice(len - 3, len).toLowerCase() === "gif")
-                viewerResult.style.backgroundImage = `url('${data.base64}')`;
+                viewerResult.style.backgroundImage = `url('${data.src}')`;
 
             metadata = data.metadata;
             // Populate info panel / image details
@@ -390,7 +402,7 @@ function createGalleryItem(/*string*/alt, /*string*/src) {
     Create a web element for a gallery item within the div "gallery-box"
     Parameters:
         alt<string>, the name of the image file
-        src<string>, the image in base64
+        src<string>, the URL of the image preview
     */
 
     galleryBox = document.getElementById("gallery-box");
@@ -444,6 +456,43 @@ function createGalleryItem(/*string*/alt, /*string*/src) {
     return galleryItem;
 }
 
+function loadImages(/*bool*/first) {
+    /*
+    Requests a page of images from /listFiles with their gallery previews, and adds them to the end of the gallery.
+    The first page replaces the loading screen.
+    */
+    if (loadingImages || (!first && nextCursor === null))
+        return;
+    loadingImages = true;
+
+    let params = new URLSearchParams({type: "images", sort: "date_uploaded", preset: "gallery"});
+    if (!first)
+        params.set("cursor", nextCursor);
+
+    fetch(`/listFiles?${params}`)
+    .then(response => response.json())
+    .then(data => {
+        loadingImages = false;
+        if (first)
+            destroyLoadingScreen();
+
+        if (data.response !== 200)
+            return;
+
+        for (let file of data.files)
+            createGalleryItem(file.name, file.src);
+        nextCursor = data.cursor;
+
+        // Keep loading while the bottom of the gallery is still on screen.
+        if (nextCursor !== null && pageSentinel.getBoundingClientRect().top < window.innerHeight)
+            loadImages(false);
+    })
+    .catch(error => {
+        loadingImages = false;
+        console.log(error);
+    });
+}
+
 function loadSettings(/*json*/settings) {
     /*
     In the gallery, the setting required is
@@ -521,4 +570,15 @@ window.addEventListener("load", (event) => {
     let uploadButton = document.getElementById("upload-button");
     uploadButton.addEventListener("change", () => uploadEvent());
     uploadContainer = document.getElementById("upload");
+
+    // Request the next page of images once the bottom of the gallery is scrolled into view.
+    pageSentinel = document.createElement("div");
+    pageSentinel.className = "page-sentinel";
+    galleryBox.after(pageSentinel);
+    new IntersectionObserver(entries => {
+        if (entries[0].isIntersecting)
+            loadImages(false);
+    }).observe(pageSentinel);
+
+    loadImages(true);
 });
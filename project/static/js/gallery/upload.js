@@ -101,42 +101,65 @@ function sendUploadRequest(/*array*/images, /*bool*/overwrite) {
         .catch((error) => console.log(error));
 }
 
+function readImages(/*array*/files) {
+    /*
+    Reads the given image files as base64 and calls 'sendUploadRequest' after all of the files have been read.
+    */
+    let images = [];
+    let uploadCount = 0;
+
+    for (let file of files) {
+        let reader = new FileReader();
+        reader.onload = function (e) {
+            images.push({
+                name: file.name,
+                value: e.target.result
+            });
+
+            uploadCount++;
+
+            // Once last file is read, make upload request to backend
+            if (uploadCount === files.length)
+                sendUploadRequest(images);
+        };
+        reader.readAsDataURL(file);
+    }
+}
+
 function uploadEvent() {
     /*
     Callback for the upload button
     Files must be image files otherwise prompts user with this information
-    Calls 'sendUploadRequest' after all of the files have been read.
+    Images which are already stored are added through 'checkUploads', and the rest are read by 'readImages'.
     */
     let uploadButton = document.getElementById("upload-button");
     let url = uploadButton.value;
     let ext = url.substring(url.lastIndexOf('.') + 1).toLowerCase();
     if (uploadButton.files && uploadButton.files[0] && (ext == "png" || ext == "jpeg" || ext == "jpg" || ext == "gif")) {
-        let images = [];
-
-        let uploadCount = 0;
-
-        let reader;
-        let fileJson;
-        let imageB64;
-        for (let i = 0; i < uploadButton.files.length; i++) {
-            reader = new FileReader();
-            let file = uploadButton.files[i];
-            reader.onload = function (e) {
-                imageB64 = e.target.result;
-                fileJson = {
-                    name: file.name,
-                    value: imageB64
-                };
-                images.push(fileJson);
-                
-                uploadCount++;
-
-                // Once last file is read, make upload request to backend
-                if (uploadCount === uploadButton.files.length)
-                    sendUploadRequest(images);
-            };
-            reader.readAsDataURL(file);
-        }
+        let files = Array.from(uploadButton.files);
+
+        // Images which are already stored are added without being sent again,
+        // under the same name that '/uploadImage' would give them (with an upper case extension).
+        let named = files.map(file => new File([file], file.name.replace(/\.[^.]+$/, extension => extension.toUpperCase())));
+        checkUploads(named, {allowImages: 1, preset: "gallery"}).then(({results}) => {
+            let stored = results.filter(result => result.response === 200);
+            for (let result of stored) {
+                for (let item of galleryBox.getElementsByClassName("item-overlay")) {
+                    if (item.getAttribute("data-content") === result.name)
+                        item.remove();
+                }
+                createGalleryItem(result.name, result.file.src);
+            }
+            if (stored.length > 0) {
+                labelNothing.style.display = "none";
+                createUploadItem(stored.map(result => result.name).join(", "));
+                uploadItem.innerHTML = `Uploaded ${stored.map(result => result.name).join(", ")}.`;
+            }
+
+            // Files with conflicting names are sent as well, so that the user is asked whether to overwrite them.
+            let storedNames = stored.map(result => result.name);
+            readImages(named.filter(file => !storedNames.includes(file.name)));
+        });
     } else {
         let buttons = createNotification("Please only upload .PNG, .JPEG, or .GIF files to the gallery.", options={
             confirm: "Okay"
@@ -0,0 +1,205 @@
+"""
+Routes handling resumable uploads, for large files on unreliable connections.
+    - Creating an upload session
+    - Uploading numbered chunks, in any order or in parallel
+    - Querying which chunks have arrived
+    - Finalising a session into a File
+    - Cancelling a session
+
+A client creates a session with the name of the file and the number of chunks it will send,
+PUTs the raw bytes of each chunk to /uploadSession/<id>/<index>, and then finalises the session.
+If the connection drops, the client asks which chunks have arrived and only sends the rest.
+"""
+
+from flask import Blueprint, request, jsonify
+from flask_login import login_required, current_user
+
+from .models import UploadSession, DATE_FORMAT
+from .files import save_upload
+from .modules.fileloader import FileLoader
+from .modules.functions import log
+from . import db, blobstore, staging
+
+import json
+import secrets
+from datetime import datetime
+
+uploads = Blueprint('uploads', __name__)
+
+def parse_count(value, minimum: int, maximum: int) -> int | None:
+    """
+    Returns a count given by the client as an int, or None if it is not a whole number from minimum to maximum.
+    Counts may be given as numbers or as strings of digits.
+    """
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or not minimum <= value <= maximum:
+        return None
+
+    return value
+
+def get_session(session_id: str) -> UploadSession | None:
+    """
+    Returns the upload session with the given id if it belongs to the current user.
+    """
+    session = db.session.get(UploadSession, session_id)
+    if not session or session.user != current_user.username:
+        return None
+
+    return session
+
+@uploads.route('/uploadSession', methods=['POST'])
+@login_required
+def create_session():
+    """
+    '/uploadSession' route, creates a resumable upload session.
+
+    Takes in 'name'<string>, 'chunks'<int> (the number of chunks that will be sent, at most UPLOAD_MAX_CHUNKS),
+    optionally 'size'<int> (the total number of bytes that will be sent, at most UPLOAD_MAX_SIZE),
+    'overwrite'<bool> and 'allowImages'<bool>.
+
+    Response code 204: File name or number of chunks is not given, or the number of chunks or size is not valid.
+    Response code 201: File with the same name exists, so the upload would not be able to be finalised.
+    Response code 200: Returns the id of the session.
+    """
+    data = json.loads(request.data)
+    if "name" not in data or "chunks" not in data:
+        return jsonify({"response": 204})
+
+    chunk_count = parse_count(data["chunks"], 1, staging.max_chunks)
+    size = parse_count(data.get("size", staging.max_size), 0, staging.max_size)
+    if chunk_count is None or size is None:
+        return jsonify({"response": 204})
+
+    overwrite = bool("overwrite" in data)
+
+    # Check for duplicate names before any bytes are sent.
+    fileloader = FileLoader()
+    if not overwrite and fileloader.search(name=data["name"], user=current_user):
+        return jsonify({"response": 201})
+
+    options = {"overwrite": overwrite, "allowImages": bool("allowImages" in data), "size": size}
+
+    session = UploadSession(
+        id=secrets.token_hex(16),
+        user=current_user.username,
+        name=data["name"],
+        chunk_count=chunk_count,
+        properties=json.dumps(options),
+        date_created=datetime.now().strftime(DATE_FORMAT)
+    )
+    db.session.add(session)
+    db.session.commit()
+
+    return jsonify({"response": 200, "id": session.id})
+
+@uploads.route('/uploadSession/<session_id>/<int:index>', methods=['PUT'])
+@login_required
+def upload_chunk(session_id: str, index: int):
+    """
+    '/uploadSession/<id>/<index>' route, stores one chunk of an upload session.
+    The request body is the raw bytes of the chunk. Sending a chunk again replaces it.
+
+    Response code 202: Upload session does not exist.
+    Response code 304: Chunk index is out of range.
+    Response code 306: The chunks would be larger than the size of the session (or UPLOAD_MAX_SIZE), so the chunk is not kept.
+    Response code 200: Chunk has been stored, returns its index and size.
+    """
+    session = get_session(session_id)
+    if not session:
+        return jsonify({"response": 202})
+
+    if not 0 <= index < session.chunk_count:
+        return jsonify({"response": 304})
+
+    # Sessions created before sizes were kept may stage up to UPLOAD_MAX_SIZE.
+    size_limit = session.get_property("size")
+    if size_limit is None:
+        size_limit = staging.max_size
+    limit = size_limit - staging.staged_size(session.id, exclude=index)
+    if request.content_length is not None and request.content_length > limit:
+        return jsonify({"response": 306})
+
+    try:
+        size = staging.write_chunk(session.id, index, request.stream, limit)
+    except ValueError:
+        return jsonify({"response": 306})
+
+    return jsonify({"response": 200, "index": index, "size": size})
+
+@uploads.route('/uploadSession/<session_id>', methods=['GET'])
+@login_required
+def session_status(session_id: str):
+    """
+    '/uploadSession/<id>' GET route, returns which chunks of an upload session have arrived.
+
+    Response code 202: Upload session does not exist.
+    Response code 200: Returns the number of chunks, and the lists of received and missing chunk indices.
+    """
+    session = get_session(session_id)
+    if not session:
+        return jsonify({"response": 202})
+
+    received = staging.received(session.id)
+    missing = sorted(set(range(session.chunk_count)) - set(received))
+
+    return jsonify({"response": 200, "chunks": session.chunk_count, "received": received, "missing": missing})
+
+@uploads.route('/uploadSession/<session_id>/finalize', methods=['POST'])
+@login_required
+def finalize_session(session_id: str):
+    """
+    '/uploadSession/<id>/finalize' route, assembles the chunks of an upload session into a File.
+
+    Optionally takes in 'overwrite'<bool>, so that a session which conflicted with an existing file
+    can be finalised again without sending its chunks again.
+
+    Response code 202: Upload session does not exist.
+    Response code 305: Not every chunk has arrived, returns the missing chunk indices.
+    Otherwise responds with the same response codes as '/uploadFile'.
+    """
+    session = get_session(session_id)
+    if not session:
+        return jsonify({"response": 202})
+
+    missing = sorted(set(range(session.chunk_count)) - set(staging.received(session.id)))
+    if missing:
+        return jsonify({"response": 305, "missing": missing})
+
+    data = json.loads(request.data) if request.data else {}
+    overwrite = bool("overwrite" in data) or bool(session.get_property("overwrite"))
+
+    digest, size = staging.assemble(session.id, session.chunk_count, blobstore)
+
+    response = save_upload(session.name, {"hash": digest, "size": size}, overwrite, bool(session.get_property("allowImages")))
+
+    if response["response"] == 201:
+        # Keep the chunks so that the client can choose to overwrite without uploading them again.
+        return jsonify(response)
+
+    staging.discard(session.id)
+    db.session.delete(session)
+    db.session.commit()
+
+    log(f"Upload session finalised: {session.name}, {session.chunk_count} chunk(s), {size} bytes")
+
+    return jsonify(response)
+
+@uploads.route('/uploadSession/<session_id>', methods=['DELETE'])
+@login_required
+def cancel_session(session_id: str):
+    """
+    '/uploadSession/<id>' DELETE route, cancels an upload session and removes its chunks.
+
+    Response code 202: Upload session does not exist.
+    Response code 200: Upload session has been cancelled.
+    """
+    session = get_session(session_id)
+    if not session:
+        return jsonify({"response": 202})
+
+    staging.discard(session.id)
+    db.session.delete(session)
+    db.session.commit()
+
+    return jsonify({"response": 200})
@@ -0,0 +1,66 @@
+"""
+Fixtures shared by the tests: an app with its database, blob store and caches in a temporary directory,
+and a test client logged in as a user.
+"""
+
+import os
+import json
+from os.path import join, dirname, exists
+
+import pytest
+
+os.environ.setdefault("secret", "test")
+
+from project import create_app, db, pipeline
+from project.models import User
+from project.modules.functions import bitshift_hash
+
+LOG_PATH = join(dirname(dirname(__file__)), "instance", ".log")
+
+@pytest.fixture(autouse=True, scope="session")
+def keep_log():
+    """
+    The app logs to instance/.log, so whatever the tests log is cut off again once they are done.
+    """
+    size = os.path.getsize(LOG_PATH) if exists(LOG_PATH) else None
+    yield
+    if size is None:
+        if exists(LOG_PATH):
+            os.remove(LOG_PATH)
+    else:
+        with open(LOG_PATH, "r+") as f:
+            f.truncate(size)
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'db.sqlite'}",
+        "BLOB_STORE_PATH": str(tmp_path / "blobs"),
+        "DERIVATIVE_CACHE_PATH": str(tmp_path / "derivatives"),
+        "UPLOAD_STAGING_PATH": str(tmp_path / "uploads"),
+        "IMAGE_WORKERS": 0,
+    })
+    pipeline.workers = 0
+
+    with app.app_context():
+        db.session.add(User(email="alice@example.com", username="alice", password=bitshift_hash("password")))
+        db.session.commit()
+
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post("/login", data={"email": "alice@example.com", "password": "password"})
+    return client
+
+def post_json(client, url: str, data):
+    """
+    Posts data as JSON, the way the front end calls the routes. Returns the JSON response.
+    """
+    return client.post(url, data=json.dumps(data), headers={"Content-type": "application/json"}).get_json()
@@ -0,0 +1,112 @@
+import os
+import io
+import hashlib
+
+import base64
+
+import pytest
+import PIL.Image
+
+from project import blobstore
+from project.models import File
+from project.modules.blobstore import BlobStore
+from project.modules import jobs
+from conftest import post_json
+
+@pytest.fixture
+def store(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"))
+    os.makedirs(tmp_path / "blobs" / "tmp")
+    store.codec = "zlib"
+    return store
+
+def test_put_is_keyed_by_hash(store):
+    digest, size = store.put(b"hello world")
+
+    assert digest == hashlib.sha256(b"hello world").hexdigest()
+    assert size == 11
+    assert store.read(digest) == b"hello world"
+    assert store.path(digest).endswith(f"{digest[:2]}/{digest[2:4]}/{digest}")
+
+def test_put_dedupes_identical_bytes(store):
+    first, _ = store.put(b"same bytes")
+    second, _ = store.put_stream(io.BytesIO(b"same bytes"), chunk_size=4)
+
+    assert first == second
+    assert list(store.digests()) == [first]
+
+def test_compressed_blob_reads_back(store):
+    data = b"compressible text " * 1000
+    digest, _ = store.put(data)
+
+    assert store.compress(digest)
+    assert store.locate(digest)[1] == "zlib"
+    assert store.physical_size(digest) < len(data)
+    assert b"".join(store.iter_chunks(digest, chunk_size=100)) == data
+    assert store.head(digest, 11) == data[:11]
+    assert list(store.digests()) == [digest]
+
+def test_release_respects_grace_period(store):
+    digest, _ = store.put(b"released")
+
+    store.grace = 3600
+    assert not store.release(digest)
+    assert store.exists(digest)
+
+    store.grace = 0
+    assert store.release(digest)
+    assert not store.exists(digest)
+
+def test_deleting_last_file_purges_blob(app, client):
+    blobstore.grace = 0
+    post_json(client, "/uploadFile", {"name": "a.txt", "value": "aGVsbG8="})
+    post_json(client, "/copyFile", {"name": "a.txt"})
+
+    with app.app_context():
+        digest = File.query.filter_by(name="a.txt").first().hash
+    assert blobstore.exists(digest)
+
+    # The copy still refers to the blob
+    post_json(client, "/deleteFiles", ["a.txt"])
+    assert blobstore.exists(digest)
+
+    post_json(client, "/deleteFiles", ["a - Copy.txt"])
+    assert not blobstore.exists(digest)
+
+def test_image_path_decompresses_blob(store):
+    data = b"compressible text " * 1000
+    digest, _ = store.put(data)
+    store.compress(digest)
+
+    path = store.image_path(digest)
+
+    assert path == store.path(digest)
+    assert store.locate(digest) == (path, None)
+    with open(path, "rb") as f:
+        assert f.read() == data
+
+def gif() -> bytes:
+    buffer = io.BytesIO()
+    PIL.Image.new("P", (200, 100)).save(buffer, "GIF", comment=b"compressible " * 500)
+    return buffer.getvalue()
+
+def test_blob_shared_with_image_is_not_compressed(app, client):
+    value = base64.b64encode(gif()).decode()
+    post_json(client, "/uploadFile", {"name": "a.gif", "value": value, "allowImages": True})
+    post_json(client, "/uploadFile", {"name": "a.txt", "value": value})
+
+    with app.app_context():
+        digest = File.query.filter_by(name="a.txt").one().hash
+        assert not jobs.compress_blob(digest)
+        assert blobstore.locate(digest)[1] is None
+
+def test_image_reads_blob_compressed_before_it_was_shared(app, client):
+    value = base64.b64encode(gif()).decode()
+    post_json(client, "/uploadFile", {"name": "a.txt", "value": value})
+    with app.app_context():
+        assert jobs.compress_blob(File.query.filter_by(name="a.txt").one().hash)
+
+    post_json(client, "/uploadFile", {"name": "a.gif", "value": value, "allowImages": True})
+
+    assert post_json(client, "/editImage", {"name": "a.gif", "edits": [{"op": "rotate", "degrees": 90}]})["response"] == 200
+    assert client.get(post_json(client, "/getImage", {"name": "a.gif"})["downsized"]).status_code == 200
@@ -0,0 +1,42 @@
+import io
+import base64
+import zipfile
+
+from project import db
+from project.models import User
+from project.modules.functions import bitshift_hash
+from conftest import post_json
+
+def upload(client, name: str, value: bytes):
+    post_json(client, "/uploadFile", {"name": name, "value": base64.b64encode(value).decode()})
+
+def test_download_path_is_short_for_many_files(client):
+    names = [f"{'a-long-file-name-' * 10}{i}.txt" for i in range(200)]
+    for i, name in enumerate(names):
+        upload(client, name, f"file {i}".encode())
+
+    data = post_json(client, "/downloadFiles", names)
+
+    assert data["response"] == 200
+    assert len(data["path"]) < 100
+    response = client.get(data["path"])
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.namelist() == names
+        assert archive.read(names[7]) == b"file 7"
+
+def test_download_is_kept_to_its_user(app, client):
+    upload(client, "a.txt", b"a")
+    path = post_json(client, "/downloadFiles", ["a.txt"])["path"]
+
+    assert client.get(path.replace("id=", "id=0")).status_code == 404
+    with app.app_context():
+        db.session.add(User(email="bob@example.com", username="bob", password=bitshift_hash("password")))
+        db.session.commit()
+    other = app.test_client()
+    other.post("/login", data={"email": "bob@example.com", "password": "password"})
+    assert other.get(path).status_code == 404
+
+def test_missing_file_is_not_downloaded(client):
+    upload(client, "a.txt", b"a")
+    assert post_json(client, "/downloadFiles", ["a.txt", "b.txt"])["response"] == 304
@@ -0,0 +1,21 @@
+import pytest
+
+from project.modules import edits
+
+@pytest.mark.parametrize("edit", [
+    {"op": "crop", "box": [0, 0, True, 1]},
+    {"op": "crop", "box": [False, 0, 1, 1]},
+    {"op": "resize", "width": True},
+    {"op": "resize", "width": 100, "height": True},
+    {"op": "resize", "width": 1.5},
+    {"op": "resize"},
+])
+def test_invalid_parameters_are_rejected(edit):
+    with pytest.raises(ValueError):
+        edits.validate([edit])
+
+def test_valid_parameters_are_kept():
+    assert edits.validate([
+        {"op": "crop", "box": [0, 0.25, 1, 0.75], "extra": 1},
+        {"op": "resize", "width": 100},
+    ]) == [{"op": "crop", "box": [0.0, 0.25, 1.0, 0.75]}, {"op": "resize", "width": 100}]
@@ -0,0 +1,78 @@
+import io
+import json
+import threading
+from contextlib import contextmanager
+
+import PIL.Image
+
+from project import events
+from project.modules import jobs
+from project.modules.events import EventBus
+from conftest import post_json
+
+@contextmanager
+def event_stream(client, event: str):
+    """
+    Reads the user's event stream in another thread while the block runs, and collects the data of its events of one type
+    until one of them is done (a job event is always done).
+    The stream keeps its request context pushed while it is open, so it cannot be read on the thread which makes other requests.
+    """
+    received = []
+    subscribed = threading.Event()
+
+    def read():
+        response = client.get("/events", buffered=False)
+        try:
+            for chunk in response.iter_encoded():
+                subscribed.set()
+                lines = chunk.decode("utf-8").splitlines()
+                if lines and lines[0] == f"event: {event}":
+                    received.append(json.loads(lines[1][len("data: "):]))
+                    if received[-1].get("done", True):
+                        return
+        finally:
+            response.close()
+
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    # The stream subscribes to the user's events before its first line is sent.
+    assert subscribed.wait(5)
+    yield received
+    thread.join(5)
+    assert not thread.is_alive()
+
+def test_delete_progress(app, client):
+    post_json(client, "/uploadFile", {"name": "a.txt", "value": "YQ=="})
+    post_json(client, "/uploadFile", {"name": "b.txt", "value": "Yg=="})
+
+    with event_stream(client, "delete") as received:
+        client.post("/deleteFiles", data=json.dumps(["a.txt", "b.txt", "c.txt"]), headers={"X-Operation": "op1"})
+
+    data = received[-1]
+    assert (data["operation"], data["done"]) == ("op1", True)
+    assert (data["total"], data["files"], data["missing"]) == (3, 2, 1)
+    assert not events.watched("alice")
+
+def test_finished_jobs_are_sent(app, client, monkeypatch):
+    monkeypatch.setattr("project.files.EVENT_POLL_INTERVAL", 0.01)
+    buffer = io.BytesIO()
+    PIL.Image.new("RGB", (20, 10)).save(buffer, "PNG")
+
+    with event_stream(client, "job") as received:
+        response = client.post("/uploadImage?name=a.png", data=buffer.getvalue(), content_type="application/octet-stream")
+        with app.app_context():
+            jobs.work(burst=True)
+
+    data = received[-1]
+    assert (data["id"], data["status"]) == (response.get_json()["images"][0]["job"], "done")
+
+def test_slow_subscriber_keeps_the_latest_events():
+    bus = EventBus()
+    bus.buffer_size = 2
+    subscriber = bus.subscribe("alice")
+
+    for count in range(5):
+        bus.publish("alice", "upload", {"files": count})
+    bus.publish("bob", "upload", {"files": 10})
+
+    assert subscriber.pop_all(0) == [("upload", {"files": 3}), ("upload", {"files": 4})]
@@ -0,0 +1,25 @@
+import io
+
+import PIL.Image
+
+from conftest import post_json
+
+def png() -> bytes:
+    buffer = io.BytesIO()
+    PIL.Image.new("RGB", (20, 10), "red").save(buffer, "PNG")
+    return buffer.getvalue()
+
+def test_get_image(client):
+    response = client.post("/uploadImage?name=a.png", data=png(), content_type="application/octet-stream")
+    name = response.get_json()["images"][0]["name"]
+
+    data = post_json(client, "/getImage", {"name": name, "base64": False})
+
+    assert client.get(data["src"]).data == png()
+    assert "base64" not in data
+
+def test_get_missing_image(client):
+    post_json(client, "/uploadFile", {"name": "a.txt", "value": "aGVsbG8="})
+
+    assert post_json(client, "/getImage", {"name": "b.png"}) == {"response": 300}
+    assert post_json(client, "/getImage", {"name": "a.txt"}) == {"response": 300}
@@ -0,0 +1,45 @@
+from io import BytesIO
+
+import PIL.Image
+import pytest
+
+from project.modules import imaging
+from project.modules.imaging import THUMBNAIL, GALLERY, VIEWER
+
+def encode(im: PIL.Image.Image, image_format: str) -> BytesIO:
+    buffered = BytesIO()
+    im.save(buffered, format=image_format)
+    buffered.seek(0)
+    return buffered
+
+# Large enough for every preset to be reduced by an integer factor before it is resampled.
+SIZE = (3000, 2400)
+
+def palette_gif() -> BytesIO:
+    return encode(PIL.Image.new("RGB", SIZE, "red").convert("P"), "GIF")
+
+def animated_gif() -> BytesIO:
+    frames = [PIL.Image.new("RGB", SIZE, color).convert("P") for color in ("red", "blue")]
+    buffered = BytesIO()
+    frames[0].save(buffered, format="GIF", save_all=True, append_images=frames[1:])
+    buffered.seek(0)
+    return buffered
+
+def palette_png() -> BytesIO:
+    return encode(PIL.Image.new("RGB", SIZE, "green").convert("P"), "PNG")
+
+def transparent_png() -> BytesIO:
+    return encode(PIL.Image.new("RGBA", SIZE, (0, 0, 255, 128)).convert("P"), "PNG")
+
+@pytest.mark.parametrize("source", [palette_gif, animated_gif, palette_png, transparent_png])
+@pytest.mark.parametrize("preset", [THUMBNAIL, GALLERY, VIEWER])
+def test_palette_images_render(source, preset):
+    data = imaging.render(source(), preset)
+
+    im = PIL.Image.open(BytesIO(data))
+    assert im.format == "PNG"
+    assert im.size[1] == imaging.preset_height(preset, SIZE)
+
+def test_bilevel_image_downscales():
+    im = PIL.Image.new("1", (1000, 800), 1)
+    assert imaging.downscale(im, (100, 80)).size == (100, 80)
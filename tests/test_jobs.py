@@ -0,0 +1,71 @@
+import io
+from time import time
+
+import PIL.Image
+
+from project import db, derivatives
+from project.models import Job
+from project.modules import jobs
+from project.modules.imaging import PRESETS
+from conftest import post_json
+
+def png(colour: str = "red") -> bytes:
+    buffer = io.BytesIO()
+    PIL.Image.new("RGB", (20, 10), colour).save(buffer, "PNG")
+    return buffer.getvalue()
+
+def upload_image(client, name: str, value: bytes) -> dict:
+    response = client.post(f"/uploadImage?name={name}", data=value, content_type="application/octet-stream")
+    return response.get_json()["images"][0]
+
+def job_status(client, *ids) -> list[dict]:
+    return client.get("/jobStatus", query_string={"id": ids}).get_json()["jobs"]
+
+def test_identical_uploads_share_one_job(app, client):
+    first = upload_image(client, "a.png", png())
+    second = upload_image(client, "b.png", png())
+
+    assert first["job"] == second["job"]
+    with app.app_context():
+        assert Job.query.filter_by(kind=Job.RENDER).count() == 1
+
+def test_worker_renders_previews(app, client):
+    image = upload_image(client, "a.png", png())
+
+    with app.app_context():
+        assert jobs.work(burst=True) == 1
+        digest = db.session.get(Job, image["job"]).target
+        assert all(derivatives.get(digest, preset) for preset in PRESETS)
+
+    assert job_status(client, image["job"])[0]["status"] == Job.DONE
+
+def test_higher_priority_jobs_are_claimed_first(app, client):
+    post_json(client, "/uploadFile", {"name": "a.txt", "value": "aGVsbG8="})
+    image = upload_image(client, "a.png", png())
+
+    with app.app_context():
+        job = jobs.claim()
+        assert (job.id, job.kind, job.status) == (image["job"], Job.RENDER, Job.RUNNING)
+        assert jobs.claim().kind == Job.COMPRESS
+        assert jobs.claim() is None
+
+def test_failed_job_is_retried_then_failed(app, client, monkeypatch):
+    def fail(digest):
+        raise OSError("disk full")
+    monkeypatch.setitem(jobs.HANDLERS, Job.RENDER, fail)
+    image = upload_image(client, "a.png", png())
+
+    with app.app_context():
+        for attempt in range(1, jobs.MAX_ATTEMPTS + 1):
+            job = jobs.claim()
+            assert (job.id, job.attempts) == (image["job"], attempt)
+            jobs.run(job)
+            if job.status == Job.QUEUED:
+                # Retries wait for a delay which doubles each time, so the job is only claimed again once it has passed.
+                assert job.run_after > time()
+                assert jobs.claim() is None
+                job.run_after = 0
+                db.session.commit()
+
+    status = job_status(client, image["job"])[0]
+    assert (status["status"], status["attempts"], status["error"]) == (Job.FAILED, jobs.MAX_ATTEMPTS, "OSError: disk full")
@@ -0,0 +1,66 @@
+import io
+import json
+import base64
+from base64 import urlsafe_b64encode
+
+import pytest
+import PIL.Image
+
+from conftest import post_json
+
+DATE_TIME = 306 # EXIF tag of the date and time the image was taken
+
+def cursor(value) -> str:
+    return urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("utf-8")
+
+@pytest.mark.parametrize("value", [
+    "not base64!",
+    cursor([[1, 2], 3]),
+    cursor([{"a": 1}, 3]),
+    cursor(["a.txt", "3"]),
+    cursor(["a.txt", True]),
+    cursor(["a.txt"]),
+])
+def test_invalid_cursor(client, value):
+    post_json(client, "/uploadFile", {"name": "a.txt", "value": "aGVsbG8="})
+
+    assert client.get("/listFiles", query_string={"cursor": value}).get_json() == {"response": 300}
+
+def jpeg(date_taken: str) -> bytes:
+    exif = PIL.Image.Exif()
+    exif[DATE_TIME] = date_taken
+    buffer = io.BytesIO()
+    PIL.Image.new("RGB", (8, 8)).save(buffer, "JPEG", exif=exif)
+    return buffer.getvalue()
+
+def list_all(client, **query) -> list[str]:
+    names = []
+    cursor = None
+    while True:
+        data = client.get("/listFiles", query_string={**query, "limit": 2, **({"cursor": cursor} if cursor else {})}).get_json()
+        assert data["response"] == 200
+        names.extend(file["name"] for file in data["files"])
+        cursor = data["cursor"]
+        if cursor is None:
+            return names
+
+@pytest.mark.parametrize("direction", ["ascending", "descending"])
+def test_keyset_paging_by_date_taken_with_nulls(client, direction):
+    # Files without a date taken (every non-image, and images without EXIF dates) have a NULL date_taken.
+    uploads = [
+        ("b.jpg", jpeg("2021:05:01 10:00:00")),
+        ("a.txt", b"a"),
+        ("c.jpg", jpeg("2019:01:01 00:00:00")),
+        ("d.txt", b"d"),
+        ("e.jpg", jpeg("2021:05:01 10:00:00")),
+        ("f.txt", b"f"),
+        ("g.jpg", jpeg("2020:07:15 12:30:00")),
+    ]
+    for name, value in uploads:
+        post_json(client, "/uploadFile", {"name": name, "value": base64.b64encode(value).decode(), "allowImages": True})
+
+    names = list_all(client, sort="date_taken", direction=direction)
+
+    # NULLs sort first in ascending order, and ties are broken by upload order (id).
+    ascending = ["a.txt", "d.txt", "f.txt", "c.jpg", "g.jpg", "b.jpg", "e.jpg"]
+    assert names == (ascending if direction == "ascending" else ascending[::-1])
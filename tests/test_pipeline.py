@@ -0,0 +1,36 @@
+import os
+from threading import BoundedSemaphore
+
+import pytest
+import PIL.Image
+
+from project.modules.pipeline import ImagePipeline
+from project.modules.imaging import THUMBNAIL
+
+@pytest.fixture
+def pipeline():
+    pipeline = ImagePipeline()
+    pipeline.workers = 1
+    pipeline.timeout = 2
+    pipeline._slots = BoundedSemaphore(1)
+    yield pipeline
+    pipeline._reset(kill=True)
+
+def test_hung_render_frees_its_slot(pipeline, tmp_path):
+    if not hasattr(os, "mkfifo"):
+        pytest.skip("Needs a named pipe to hang a render.")
+    # Opening a named pipe with no writer blocks forever.
+    hung = str(tmp_path / "hung.png")
+    os.mkfifo(hung)
+    image = str(tmp_path / "image.png")
+    PIL.Image.new("RGB", (50, 50)).save(image)
+
+    assert pipeline.render_many([(hung, THUMBNAIL)]) == [None]
+    assert pipeline.render_many([(image, THUMBNAIL)])[0].startswith(b"\x89PNG")
+
+def test_submit_gives_up_waiting_for_a_slot(pipeline):
+    pipeline.timeout = 0.1
+    pipeline._slots.acquire()
+
+    assert pipeline.submit("image.png", THUMBNAIL) is None
+    assert pipeline.render_many([("image.png", THUMBNAIL)]) == [None]
@@ -0,0 +1,39 @@
+import base64
+
+from project import db
+from project.models import StorageUsage
+from conftest import post_json
+
+def upload(client, name: str, value: bytes, **options):
+    return post_json(client, "/uploadFile", {"name": name, "value": base64.b64encode(value).decode(), **options})
+
+def storage(client) -> dict:
+    data = post_json(client, "/getFileStorage", {})
+    return {"size": data["size"], **data["usage"]["files"]}
+
+def test_usage_follows_uploads_copies_archives_and_deletes(client):
+    upload(client, "a.txt", b"12345")
+    upload(client, "b.txt", b"123")
+    assert storage(client) == {"size": 8, "live": {"files": 2, "size": 8}}
+
+    upload(client, "a.txt", b"1234567890", overwrite=True)
+    assert storage(client) == {"size": 13, "live": {"files": 2, "size": 13}}
+
+    post_json(client, "/copyFile", {"name": "b.txt"})
+    assert storage(client) == {"size": 16, "live": {"files": 3, "size": 16}}
+
+    post_json(client, "/archiveFiles", {"images": ["a.txt"]})
+    assert storage(client) == {"size": 16, "live": {"files": 2, "size": 6}, "archived": {"files": 1, "size": 10}}
+
+    post_json(client, "/deleteFiles", ["a.txt"])
+    assert storage(client) == {"size": 6, "live": {"files": 2, "size": 6}, "archived": {"files": 0, "size": 0}}
+
+def test_reconcile_usage_fixes_counters(app, client):
+    upload(client, "a.txt", b"12345")
+    with app.app_context():
+        StorageUsage.query.one().bytes = 1
+        db.session.commit()
+
+    app.test_cli_runner().invoke(args=["reconcile-usage", "--fix"])
+
+    assert storage(client) == {"size": 5, "live": {"files": 1, "size": 5}}
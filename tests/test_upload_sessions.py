@@ -0,0 +1,28 @@
+import pytest
+
+from project.models import File, UploadSession
+from conftest import post_json
+
+@pytest.mark.parametrize("chunks", ["abc", 1.5, True, None, [3], 0, -1, 10001, 10 ** 12])
+def test_invalid_chunk_counts_are_rejected(app, client, chunks):
+    assert post_json(client, "/uploadSession", {"name": "a.bin", "chunks": chunks}) == {"response": 204}
+
+    with app.app_context():
+        assert UploadSession.query.count() == 0
+
+@pytest.mark.parametrize("size", ["big", -1, True, 16 * 1024 ** 3 + 1])
+def test_invalid_sizes_are_rejected(client, size):
+    assert post_json(client, "/uploadSession", {"name": "a.bin", "chunks": 2, "size": size}) == {"response": 204}
+
+def test_chunks_are_limited_to_the_declared_size(app, client):
+    session_id = post_json(client, "/uploadSession", {"name": "a.bin", "chunks": "2", "size": 10})["id"]
+
+    assert client.put(f"/uploadSession/{session_id}/0", data=b"123456").get_json()["response"] == 200
+    assert client.put(f"/uploadSession/{session_id}/1", data=b"123456").get_json()["response"] == 306
+    # Sending a chunk again replaces it, so its old size does not count towards the limit.
+    assert client.put(f"/uploadSession/{session_id}/0", data=b"1234").get_json()["response"] == 200
+    assert client.put(f"/uploadSession/{session_id}/1", data=b"123456").get_json()["response"] == 200
+
+    assert post_json(client, f"/uploadSession/{session_id}/finalize", {})["response"] == 200
+    with app.app_context():
+        assert File.query.filter_by(name="a.bin").one().value == b"1234123456"
@@ -0,0 +1,91 @@
+import io
+import base64
+
+import pytest
+import PIL.Image
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from project.models import File
+from project.modules.fileloader import FileLoader
+from conftest import post_json
+
+def multipart(files: dict[str, bytes], **fields) -> dict:
+    return {"files": [(io.BytesIO(data), name) for name, data in files.items()], **fields}
+
+@pytest.fixture
+def commits():
+    """
+    Counts the commits of every session while a test runs.
+    """
+    count = []
+    listener = lambda session: count.append(session)
+    event.listen(Session, "after_commit", listener)
+    yield count
+    event.remove(Session, "after_commit", listener)
+
+def test_upload_batch_overwrites_in_one_transaction(app, client, commits):
+    files = {f"file{i}.txt": b"original" for i in range(5)}
+    client.post("/uploadFiles", data=multipart(files), content_type="multipart/form-data")
+
+    commits.clear()
+    files = {name: b"replaced" for name in files}
+    response = client.post("/uploadFiles", data=multipart(files, overwrite="1"), content_type="multipart/form-data")
+
+    assert [result["response"] for result in response.get_json()["files"]] == [200] * 5
+    assert len(commits) == 1
+    with app.app_context():
+        assert {file.value for file in File.query.all()} == {b"replaced"}
+
+def test_rejected_overwrite_keeps_original(app, client):
+    post_json(client, "/uploadFile", {"name": "a.txt", "value": base64.b64encode(b"original").decode()})
+    client.post("/uploadFile?name=a.txt&overwrite=1", data=b"replaced", content_type="application/octet-stream")
+
+    # An image without allowImages is rejected, and the file with its name is left as it was.
+    post_json(client, "/uploadFile", {"name": "b.png", "value": base64.b64encode(b"image").decode(), "allowImages": 1})
+    result = post_json(client, "/uploadFile", {"name": "b.png", "value": base64.b64encode(b"other").decode(), "overwrite": 1})
+
+    assert result["response"] == 300
+    with app.app_context():
+        assert File.query.filter_by(name="a.txt").one().value == b"replaced"
+        assert File.query.filter_by(name="b.png").one().value == b"image"
+
+def jpeg(i: int) -> bytes:
+    buffer = io.BytesIO()
+    PIL.Image.new("RGB", (8, 8), (i % 256, i // 256, 0)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+@pytest.mark.parametrize("extension, content", [
+    (".txt", lambda i: f"content {i}".encode()),
+    (".jpg", jpeg),
+])
+def test_many_files_keep_one_temp_file_open(app, client, extension, content):
+    resource = pytest.importorskip("resource")
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+    files = {f"file{i}{extension}": content(i) for i in range(300)}
+    resource.setrlimit(resource.RLIMIT_NOFILE, (256, hard))
+    try:
+        response = client.post("/uploadFiles", data=multipart(files, allowImages="1"), content_type="multipart/form-data")
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    assert [result["response"] for result in response.get_json()["files"]] == [200] * 300
+    with app.app_context():
+        assert File.query.filter_by(name=f"file299{extension}").one().value == content(299)
+
+@pytest.mark.parametrize("url, kwargs", [
+    ("/uploadFile", {"data": b"data", "content_type": "application/octet-stream"}),
+    ("/uploadFile?name=", {"data": b"data", "content_type": "application/octet-stream"}),
+    ("/uploadFile", {"data": multipart({"": b"data"}), "content_type": "multipart/form-data"}),
+])
+def test_upload_without_name_is_rejected(app, client, url, kwargs):
+    assert client.post(url, **kwargs).get_json() == {"response": 204}
+    with app.app_context():
+        assert File.query.count() == 0
+
+def test_uploads_do_not_accumulate_in_file_loaders(client):
+    files = {f"file{i}.txt": b"data" for i in range(50)}
+    client.post("/uploadFiles", data=multipart(files), content_type="multipart/form-data")
+
+    assert FileLoader().images == []